@@ -0,0 +1,177 @@
+#!/usr/bin/python
+"""
+Admission control of the gatekeeper.
+
+A request is admitted when its client still has a token in its bucket
+(otherwise 429) and when fewer requests than the adaptive concurrency limit
+are in progress (otherwise 503). Both rejections carry a `Retry-After`
+header and are answered immediately, so an overload is shed at the edge
+instead of building queues in every tier.
+
+The concurrency limit follows the latency of the admitted requests
+(gradient algorithm): while the recent latency stays close to the long-term
+one the limit grows, when it rises (requests queue somewhere downstream)
+the limit shrinks in proportion, and failures (5xx, upstream timeouts) cut
+it multiplicatively (AIMD).
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` tokens saved."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, now):
+        """Takes a token. Returns 0 on success, otherwise the seconds until the next token."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientRateLimiter:
+    """
+    One token bucket per client. The buckets of the clients not seen
+    recently are dropped beyond `max_clients`, a dropped client starts again
+    with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_clients=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket.take(now)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Concurrency limit adjusted from the observed latency.
+
+    Args:
+        initial (int): starting limit.
+        min_limit (int), max_limit (int): bounds of the limit.
+        tolerance (float): ratio of the recent to the long-term latency accepted before shrinking.
+        smoothing (float): weight of each new estimate in the limit.
+        backoff (float): factor applied to the limit on a failure.
+    """
+
+    def __init__(self, initial=100, min_limit=10, max_limit=1000, tolerance=1.5, smoothing=0.2, backoff=0.9):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+
+        self.in_flight = 0
+        self._short_rtt = None
+        self._long_rtt = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, failed=False):
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if failed:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                return
+            if self._short_rtt is None:
+                self._short_rtt = self._long_rtt = latency
+                return
+            self._short_rtt += 0.1 * (latency - self._short_rtt)
+            self._long_rtt += 0.01 * (latency - self._long_rtt)
+            if self._long_rtt > 2 * self._short_rtt:
+                # the load dropped, let the baseline follow instead of growing the limit for too long
+                self._long_rtt *= 0.95
+
+            gradient = max(0.5, min(1.0, self.tolerance * self._long_rtt / self._short_rtt))
+            if gradient == 1.0 and in_flight < self.limit / 2:
+                # the limit isn't what bounds the traffic, no evidence it can grow
+                return
+            estimate = self.limit * gradient + math.sqrt(self.limit)
+            self.limit = min(self.max_limit, max(self.min_limit,
+                                                 (1 - self.smoothing) * self.limit + self.smoothing * estimate))
+
+    def snapshot(self):
+        with self._lock:
+            return {"limit": int(self.limit), "in_flight": self.in_flight,
+                    "short_rtt_ms": self._short_rtt * 1000 if self._short_rtt is not None else None,
+                    "long_rtt_ms": self._long_rtt * 1000 if self._long_rtt is not None else None}
+
+
+class Rejection:
+    """Refused request : http status, reason label and seconds the client should wait."""
+
+    def __init__(self, status, reason, retry_after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def headers(self):
+        return {'Retry-After': str(max(1, math.ceil(self.retry_after)))}
+
+
+class AdmissionController:
+    """
+    Per-client rate limit followed by the global adaptive concurrency limit.
+
+    Args:
+        rate_limiter (ClientRateLimiter): None to disable the per-client limit.
+        concurrency_limit (AdaptiveConcurrencyLimit): None to disable the global limit.
+        retry_after (float): Retry-After of the 503 responses, in seconds.
+    """
+
+    def __init__(self, rate_limiter, concurrency_limit, retry_after=1.0):
+        self.rate_limiter = rate_limiter
+        self.concurrency_limit = concurrency_limit
+        self.retry_after = retry_after
+
+    def admit(self, client):
+        """
+        Returns None when the request is admitted, `release` then has to be
+        called once it completes. Returns a Rejection otherwise.
+        """
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take(client)
+            if wait > 0:
+                return Rejection(429, 'rate_limited', wait)
+        if self.concurrency_limit is not None and not self.concurrency_limit.acquire():
+            return Rejection(503, 'overloaded', self.retry_after)
+        return None
+
+    def release(self, latency, failed=False):
+        if self.concurrency_limit is not None:
+            self.concurrency_limit.release(latency, failed)
+
+    def snapshot(self):
+        return self.concurrency_limit.snapshot() if self.concurrency_limit is not None else {}
@@ -1,45 +1,165 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 from botocore.exceptions import ClientError
 
+import constants
+
+# instances accepted by a single TerminateInstances call
+TERMINATE_BATCH_SIZE = 1000
+# a security group stays referenced by the network interfaces of terminated instances for a little while
+DELETE_RETRIES = 5
+DELETE_RETRY_DELAY = 5
+
+
+def tag_filters(tag):
+    return [{'Name': f"tag:{tag['Key']}", 'Values': [tag['Value']]}]
+
+
+def find_instances(ec2_client, tag):
+    # every page of the project's instances that are not already terminated
+    filters = tag_filters(tag) + [{'Name': 'instance-state-name',
+                                   'Values': ['pending', 'running', 'stopping', 'stopped']}]
+    instance_ids = []
+    for page in ec2_client.get_paginator('describe_instances').paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                instance_ids.append(instance['InstanceId'])
+    return instance_ids
+
+
+def terminate_instances(ec2_client, instance_ids, dry_run=False):
+    if not instance_ids:
+        print("No project instances found.")
+        return
+
+    batches = [instance_ids[i:i + TERMINATE_BATCH_SIZE] for i in range(0, len(instance_ids), TERMINATE_BATCH_SIZE)]
+    for batch in batches:
+        print(f"{'Would terminate' if dry_run else 'Terminating'} instances: {batch}")
+        if not dry_run:
+            ec2_client.terminate_instances(InstanceIds=batch)
+    if dry_run:
+        return
+
+    # one waiter for the whole fleet, the security groups can't be deleted before
+    print(f"Waiting for {len(instance_ids)} instances to be terminated...")
+    waiter = ec2_client.get_waiter('instance_terminated')
+    for batch in batches:
+        waiter.wait(InstanceIds=batch)
+
 
-def terminate_instances(ec2_client):
-    # Describe all instances
-    response = ec2_client.describe_instances()
-    instances_to_terminate = []
+def find_security_groups(ec2_client, tag, untagged_names=()):
+    # the tagged groups, and with untagged_names the groups of these names created before the groups were tagged
+    groups = {}
+    paginator = ec2_client.get_paginator('describe_security_groups')
+    searches = [tag_filters(tag)]
+    if untagged_names:
+        searches.append([{'Name': 'group-name', 'Values': list(untagged_names)}])
+    for filters in searches:
+        for page in paginator.paginate(Filters=filters):
+            for security_group in page['SecurityGroups']:
+                if security_group['GroupName'] != 'default':
+                    groups[security_group['GroupId']] = security_group
+    return groups
 
-    for reservation in response['Reservations']:
-        for instance in reservation['Instances']:
-            # Check if the instance is running
-            if instance['State']['Name'] == 'running':
-                instances_to_terminate.append(instance['InstanceId'])
 
-    # Terminate instances
-    if instances_to_terminate:
-        print(f"Terminating instances: {instances_to_terminate}")
-        ec2_client.terminate_instances(InstanceIds=instances_to_terminate)
-    else:
-        print("No running instances found.")
+def referenced_groups(security_group):
+    # ids of the groups a group's rules point to
+    references = set()
+    for permission in security_group.get('IpPermissions', []) + security_group.get('IpPermissionsEgress', []):
+        for pair in permission.get('UserIdGroupPairs', []):
+            references.add(pair['GroupId'])
+    references.discard(security_group['GroupId'])
+    return references
 
 
-def delete_security_groups(ec2_client):
-    # Describe all security groups
-    response = ec2_client.describe_security_groups()
+def deletion_levels(groups):
+    """
+    Orders the groups so that a group is deleted after every group whose
+    rules reference it. The groups of a level can be deleted in parallel.
 
-    for security_group in response['SecurityGroups']:
+    Returns:
+        Tuple (levels, cyclic), cyclic being the groups that reference each
+        other and need their rules revoked before being deleted.
+    """
+    remaining = set(groups)
+    levels = []
+    while remaining:
+        referenced = set()
+        for group_id in remaining:
+            referenced |= referenced_groups(groups[group_id]) & remaining
+        level = sorted(remaining - referenced)
+        if not level:
+            break
+        levels.append(level)
+        remaining -= set(level)
+    return levels, sorted(remaining)
+
+
+def revoke_group_references(ec2_client, security_group):
+    # drops the rules pointing to other groups so they can be deleted
+    for key, revoke in (('IpPermissions', ec2_client.revoke_security_group_ingress),
+                        ('IpPermissionsEgress', ec2_client.revoke_security_group_egress)):
+        permissions = [permission for permission in security_group.get(key, []) if permission.get('UserIdGroupPairs')]
+        if permissions:
+            revoke(GroupId=security_group['GroupId'], IpPermissions=permissions)
+
+
+def delete_security_group(ec2_client, group_id):
+    for attempt in range(DELETE_RETRIES):
         try:
-            # Default security group cannot be deleted
-            if security_group['GroupName'] != 'default':
-                print(f"Deleting security group: {security_group['GroupId']}")
-                ec2_client.delete_security_group(GroupId=security_group['GroupId'])
+            ec2_client.delete_security_group(GroupId=group_id)
+            print(f"Deleted security group: {group_id}")
+            return True
         except ClientError as e:
-            print(f"Error deleting security group {security_group['GroupId']}: {e}")
+            if e.response['Error']['Code'] != 'DependencyViolation' or attempt == DELETE_RETRIES - 1:
+                print(f"Error deleting security group {group_id}: {e}")
+                return False
+            time.sleep(DELETE_RETRY_DELAY)
+
+
+def delete_security_groups(ec2_client, groups, dry_run=False, workers=8):
+    levels, cyclic = deletion_levels(groups)
+    if cyclic:
+        print(f"{'Would revoke' if dry_run else 'Revoking'} the cross-group rules of {cyclic}")
+        if not dry_run:
+            for group_id in cyclic:
+                revoke_group_references(ec2_client, groups[group_id])
+        levels.append(cyclic)
+
+    for level in levels:
+        print(f"{'Would delete' if dry_run else 'Deleting'} security groups: "
+              f"{[(group_id, groups[group_id]['GroupName']) for group_id in level]}")
+        if not dry_run:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda group_id: delete_security_group(ec2_client, group_id), level))
+
+
+def cleanup(ec2_client, tag=constants.PROJECT_TAG, dry_run=False, workers=8, untagged_names=()):
+    instance_ids = find_instances(ec2_client, tag)
+    groups = find_security_groups(ec2_client, tag, untagged_names)
+    if dry_run:
+        print(f"Dry run, nothing is deleted. Plan for {tag['Key']}={tag['Value']}:")
+    terminate_instances(ec2_client, instance_ids, dry_run)
+    delete_security_groups(ec2_client, groups, dry_run, workers)
 
 
 def main():
-    ec2_client = boto3.client('ec2')
+    parser = argparse.ArgumentParser(description="Deletes the instances and security groups of the project.")
+    parser.add_argument('--dry-run', action='store_true', help='print the plan without deleting anything')
+    parser.add_argument('--tag-key', default=constants.PROJECT_TAG['Key'])
+    parser.add_argument('--tag-value', default=constants.PROJECT_TAG['Value'])
+    parser.add_argument('--workers', type=int, default=8, help='security groups deleted at the same time')
+    parser.add_argument('--include-untagged-groups', action='store_true',
+                        help="also delete the untagged security groups with the project's names "
+                             f"({', '.join(constants.SECURITY_GROUP_NAMES)}), created before the groups were tagged")
+    args = parser.parse_args()
 
-    terminate_instances(ec2_client)
-    delete_security_groups(ec2_client)
+    ec2_client = boto3.client('ec2')
+    untagged_names = constants.SECURITY_GROUP_NAMES if args.include_untagged_groups else ()
+    cleanup(ec2_client, {'Key': args.tag_key, 'Value': args.tag_value}, args.dry_run, args.workers, untagged_names)
 
 
 if __name__ == "__main__":
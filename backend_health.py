@@ -0,0 +1,192 @@
+#!/usr/bin/python
+import threading
+import time
+from contextlib import contextmanager
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_connection_error(error):
+    """
+    Tells whether an exception means the backend couldn't be reached.
+
+    MySQL client errors (codes 2000 to 2999, e.g. 2003 can't connect or 2013
+    lost connection) are connection failures; server errors such as a syntax
+    error or a deadlock prove the backend is alive.
+    """
+    code = error.args[0] if error.args else None
+    if isinstance(code, int):
+        return 2000 <= code < 3000
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Per-backend circuit breaker (closed / open / half-open).
+
+    After `failure_threshold` consecutive failures the breaker opens and the
+    backend is skipped. Once `reset_timeout` seconds have passed a single
+    trial request is let through (half-open) : its success closes the
+    breaker, its failure opens it again for another `reset_timeout`.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=5.0, is_failure=is_connection_error):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._is_failure = is_failure
+
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Whether a request could be sent now, without claiming the half-open trial."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at >= self.reset_timeout
+            return not self._trial_in_flight
+
+    def acquire(self):
+        """Claims the right to send a request, the single trial request when not closed."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self, acquired=True):
+        # ends a trial whose outcome says nothing about the backend, only for the request that acquired it
+        if not acquired:
+            return
+        with self._lock:
+            self._trial_in_flight = False
+
+    @contextmanager
+    def guard(self, acquired=True):
+        """
+        Records the outcome of the request run in the `with` block. Errors
+        that don't mean the backend is unreachable (SQL errors, a streamed
+        response closed by the client...) are not counted either way, and
+        release the trial when the request `acquired` the breaker.
+        """
+        try:
+            yield
+        except BaseException as e:
+            if isinstance(e, Exception) and self._is_failure(e):
+                self.record_failure()
+            else:
+                self.release(acquired)
+            raise
+        self.record_success()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self._failures}
+
+
+class TunnelSupervisor:
+    """
+    Keeps the SSH tunnels to the slaves up.
+
+    `factories` maps each backend name to a callable creating and starting
+    its tunnel. A daemon thread checks every tunnel each `interval` seconds
+    and rebuilds the ones that are down, then calls `on_rebuild(name)` so the
+    connections opened through the dead tunnel can be dropped.
+    """
+
+    def __init__(self, factories, interval=2.0, on_rebuild=None):
+        self._factories = factories
+        self.interval = interval
+        self._on_rebuild = on_rebuild
+
+        self._tunnels = {}
+        self._status = {name: {"up": False, "rebuilds": 0, "last_error": None} for name in factories}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for name in self._factories:
+            self._rebuild(name, initial=True)
+        self._thread = threading.Thread(target=self._run, name="tunnel-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for tunnel in self._tunnels.values():
+            self._close(tunnel)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(status) for name, status in self._status.items()}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for name in self._factories:
+                if not self._is_up(name):
+                    self._rebuild(name)
+
+    def _is_up(self, name):
+        tunnel = self._tunnels.get(name)
+        if tunnel is None or not tunnel.is_active:
+            return False
+        try:
+            tunnel.check_tunnels()
+            return all(tunnel.tunnel_is_up.values())
+        except Exception:
+            return False
+
+    def _rebuild(self, name, initial=False):
+        old = self._tunnels.pop(name, None)
+        if old is not None:
+            self._close(old)
+        try:
+            self._tunnels[name] = self._factories[name]()
+        except Exception as e:
+            print(f"Could not start the tunnel to {name}: {e}")
+            with self._lock:
+                self._status[name].update(up=False, last_error=str(e))
+            return
+        with self._lock:
+            self._status[name]["up"] = True
+            self._status[name]["last_error"] = None
+            if not initial:
+                self._status[name]["rebuilds"] += 1
+        if not initial and self._on_rebuild is not None:
+            self._on_rebuild(name)
+
+    @staticmethod
+    def _close(tunnel):
+        try:
+            tunnel.stop()
+        except Exception:
+            pass
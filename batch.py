@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+Format of the batch requests accepted by the POST /batch endpoints.
+
+The body is a json object :
+    {"mode": "transaction" | "autocommit",
+     "statements": [{"sql": "... %s ...", "params": [...]}, ...]}
+`params` is optional and may also be an object for `%(name)s` placeholders.
+When given, they have to match the placeholders of the statement, whose
+literal `%` are then written `%%`.
+In transaction mode the statements are committed together and rolled back
+as soon as one fails; in autocommit mode each one is committed on its own.
+"""
+import json
+import re
+
+BATCH_MODES = ('transaction', 'autocommit')
+
+# statements accepted in a single batch
+MAX_BATCH_STATEMENTS = 1000
+
+
+# a % conversion of the statement, as interpolated by pymysql with the python % operator
+_CONVERSION = re.compile(r'%(\([^)]*\))?(.?)', re.DOTALL)
+
+
+class InvalidBatch(ValueError):
+    """Raised when a batch body doesn't follow the expected format."""
+
+
+def placeholders(sql):
+    """
+    Lists the pymysql placeholders of a statement.
+
+    Returns:
+        Tuple (count, names) of the `%s` placeholders and the names of the
+        `%(name)s` ones, or None when the statement has another conversion.
+    """
+    count = 0
+    names = set()
+    for match in _CONVERSION.finditer(sql):
+        name, conversion = match.groups()
+        if conversion == '%' and name is None:
+            continue
+        if conversion != 's':
+            return None
+        if name is None:
+            count += 1
+        else:
+            names.add(name[1:-1])
+    return count, names
+
+
+def check_params(sql, params):
+    """Checks that the params of a statement match its placeholders, raises InvalidBatch otherwise."""
+    values = params if isinstance(params, list) else list(params.values())
+    for value in values:
+        if value is not None and not isinstance(value, (str, int, float, bool)):
+            raise InvalidBatch("A param must be a string, a number, a boolean or null")
+
+    found = placeholders(sql)
+    if found is None:
+        raise InvalidBatch("Only %s and %(name)s placeholders are supported, a literal % is written %%")
+    count, names = found
+    if isinstance(params, list):
+        if names or count != len(params):
+            raise InvalidBatch(f"The statement has {count} %s placeholders but {len(params)} params were given")
+    else:
+        if count:
+            raise InvalidBatch("Named params can't be used with %s placeholders")
+        missing = names - params.keys()
+        if missing:
+            raise InvalidBatch(f"Missing params {', '.join(sorted(missing))}")
+
+
+def parse_batch(body):
+    """
+    Parses and checks the shape of a batch request body.
+
+    Args:
+        body (bytes or str): json request body.
+
+    Returns:
+        Tuple (mode, statements), statements being a list of (sql, params).
+    """
+    try:
+        batch = json.loads(body)
+    except ValueError as e:
+        raise InvalidBatch(f"Invalid json body: {e}")
+    if not isinstance(batch, dict):
+        raise InvalidBatch("The body must be a json object")
+
+    mode = batch.get('mode', 'transaction')
+    if mode not in BATCH_MODES:
+        raise InvalidBatch(f"Unknown mode {mode}, expected one of {', '.join(BATCH_MODES)}")
+
+    statements = batch.get('statements')
+    if not isinstance(statements, list) or not statements:
+        raise InvalidBatch("'statements' must be a non empty list")
+    if len(statements) > MAX_BATCH_STATEMENTS:
+        raise InvalidBatch(f"Too many statements ({len(statements)} > {MAX_BATCH_STATEMENTS})")
+
+    parsed = []
+    for idx, statement in enumerate(statements):
+        if not isinstance(statement, dict) or not isinstance(statement.get('sql'), str):
+            raise InvalidBatch(f"Statement {idx} must be an object with a 'sql' string")
+        params = statement.get('params')
+        if params is not None and not isinstance(params, (list, dict)):
+            raise InvalidBatch(f"The params of statement {idx} must be a list or an object")
+        if params is not None:
+            try:
+                check_params(statement['sql'], params)
+            except InvalidBatch as e:
+                raise InvalidBatch(f"Statement {idx}: {e}")
+        parsed.append((statement['sql'], params))
+    return mode, parsed
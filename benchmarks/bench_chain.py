@@ -0,0 +1,180 @@
+#!/usr/bin/python
+"""
+Benchmarks the gatekeeper -> trustedhost -> proxy forwarding chain on localhost.
+
+The three apps are started as local processes, the proxy with an in-memory
+database (fake_pymysql.py) and without ssh tunnels. The same open-loop load
+is then sent to each tier in turn, so the difference between two tiers is
+the cost of the extra hop, and the per-tier Server-Timing entries give the
+breakdown of each request. The report is printed (or written) as json.
+With --app-workers N the apps are served by N prefork.py workers each
+instead of their development server (the async gatekeeper excepted).
+
+Usage: python benchmarks/bench_chain.py [--rate R] [--duration S] [--output report.json]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+from loadgen import run_open_loop, summarize
+
+# tiers from the innermost, each one forwards to the previous
+TIERS = ('proxy', 'trustedhost', 'gatekeeper')
+
+
+def serve_proxy(app_workers=0, app_threads=8):
+    # runs proxy_app in this process on top of the in-memory database, or in prefork workers forked from it
+    import runpy
+    import fake_pymysql
+
+    fake_pymysql.install()
+    sys.path.insert(0, REPO_DIR)
+    if app_workers:
+        import prefork
+        sys.exit(prefork.Arbiter('proxy_app:app', '0.0.0.0', int(os.environ['PROXY_PORT']), app_workers,
+                                 app_threads).run())
+    runpy.run_path(os.path.join(REPO_DIR, 'proxy_app.py'), run_name='__main__')
+
+
+def start_tiers(tiers, base_port, db_latency_ms, rows, gatekeeper_mode='sync', verbose=False, app_workers=0,
+                app_threads=8):
+    """
+    Starts tiers of the chain on localhost, the proxy on the in-memory database.
+    With app_workers, the apps are served by that many prefork.py workers.
+
+    Returns:
+        Tuple (ports, processes), both dicts keyed by tier name.
+    """
+    ports = {tier: base_port + idx for idx, tier in enumerate(TIERS)}
+    env = dict(os.environ,
+               FAKE_DB_LATENCY_MS=str(db_latency_ms),
+               FAKE_DB_ROWS=str(rows),
+               PROXY_PORT=str(ports['proxy']),
+               PROXY_SSH_TUNNELS='0',
+               TRUSTEDHOST_PORT=str(ports['trustedhost']),
+               TRUSTEDHOST_UPSTREAM_URL=f"http://127.0.0.1:{ports['proxy']}",
+               GATEKEEPER_PORT=str(ports['gatekeeper']),
+               GATEKEEPER_UPSTREAM_URL=f"http://127.0.0.1:{ports['trustedhost']}",
+               GATEKEEPER_MODE=gatekeeper_mode)
+    commands = {
+        'proxy': [sys.executable, os.path.abspath(__file__), '--serve-proxy'],
+        'trustedhost': [sys.executable, os.path.join(REPO_DIR, 'trustedhost_app.py')],
+        'gatekeeper': [sys.executable, os.path.join(REPO_DIR, 'gatekeeper_app.py')],
+    }
+    if app_workers:
+        prefork = [sys.executable, os.path.join(REPO_DIR, 'prefork.py')]
+        options = ['--workers', str(app_workers), '--threads', str(app_threads)]
+        commands['proxy'] += ['--app-workers', str(app_workers), '--app-threads', str(app_threads)]
+        commands['trustedhost'] = prefork + ['trustedhost_app:app', '--port', str(ports['trustedhost'])] + options
+        if gatekeeper_mode == 'sync':
+            commands['gatekeeper'] = prefork + ['gatekeeper_app:app', '--port', str(ports['gatekeeper'])] + options
+    output = None if verbose else subprocess.DEVNULL
+    processes = {}
+    for tier in tiers:
+        processes[tier] = subprocess.Popen(commands[tier], cwd=REPO_DIR, env=env, stdout=output, stderr=output)
+    for tier in tiers:
+        wait_ready(tier, ports[tier], processes[tier])
+    return ports, processes
+
+
+def wait_ready(tier, port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The {tier} exited with code {process.returncode}, rerun with --verbose")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"The {tier} didn't start listening on port {port}")
+
+
+def stop_tiers(processes):
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=200, help='requests per second sent to each tier')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of measured load per tier')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of unmeasured load before each run')
+    parser.add_argument('--workers', type=int, default=64, help='client threads, bounds the requests in flight')
+    parser.add_argument('--route', default='normal', help='proxy route of the queries')
+    parser.add_argument('--sql', default='SELECT * FROM film WHERE film_id = {key}',
+                        help='query template, {key} is replaced by a random key')
+    parser.add_argument('--keys', type=int, default=100000,
+                        help='number of distinct keys, a large key space keeps the result cache cold')
+    parser.add_argument('--tiers', default=','.join(TIERS), help='tiers to load, comma separated')
+    parser.add_argument('--db-latency-ms', type=float, default=1.0, help='time taken by each fake query')
+    parser.add_argument('--rows', type=int, default=10, help='rows returned by each fake SELECT')
+    parser.add_argument('--base-port', type=int, default=18080, help='port of the proxy, the next ones for the others')
+    parser.add_argument('--gatekeeper-mode', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--app-workers', type=int, default=0,
+                        help='prefork.py workers of each app, 0 for their development server')
+    parser.add_argument('--app-threads', type=int, default=8, help='request threads of each prefork.py worker')
+    parser.add_argument('--output', help='file the json report is written to, stdout by default')
+    parser.add_argument('--verbose', action='store_true', help="show the apps' output")
+    parser.add_argument('--serve-proxy', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_proxy:
+        serve_proxy(args.app_workers, args.app_threads)
+        return
+
+    def next_request():
+        sql = args.sql.format(key=random.randrange(args.keys))
+        return args.route, 'GET', f"/{args.route}/{urllib.parse.quote(sql, safe='')}", None, None
+
+    # the inner tiers are needed by the outer ones
+    tiers = args.tiers.split(',')
+    ports, processes = start_tiers(TIERS[:max(TIERS.index(tier) for tier in tiers) + 1], args.base_port,
+                                   args.db_latency_ms, args.rows, args.gatekeeper_mode, args.verbose,
+                                   args.app_workers, args.app_threads)
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ('serve_proxy', 'verbose')},
+              "tiers": {}}
+    try:
+        for tier in tiers:
+            base_url = f"http://127.0.0.1:{ports[tier]}"
+            if args.warmup > 0:
+                run_open_loop(base_url, next_request, args.rate, args.warmup, args.workers)
+            start = time.perf_counter()
+            samples = run_open_loop(base_url, next_request, args.rate, args.duration, args.workers)
+            report["tiers"][tier] = summarize(samples, time.perf_counter() - start)
+    finally:
+        stop_tiers(processes)
+
+    # median cost of each hop : latency seen through a tier minus the latency of the tier it forwards to
+    report["hop_overhead_p50_ms"] = {}
+    for inner, outer in zip(TIERS, TIERS[1:]):
+        if inner in report["tiers"] and outer in report["tiers"]:
+            inner_p50 = report["tiers"][inner]["latency"]["p50_ms"]
+            outer_p50 = report["tiers"][outer]["latency"]["p50_ms"]
+            if inner_p50 is not None and outer_p50 is not None:
+                report["hop_overhead_p50_ms"][outer] = outer_p50 - inner_p50
+
+    rendered = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(rendered + '\n')
+    else:
+        print(rendered)
+
+
+if __name__ == '__main__':
+    main()
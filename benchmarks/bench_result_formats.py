@@ -0,0 +1,103 @@
+#!/usr/bin/python
+"""
+Compares the payload size and the encode/decode time of the proxy's output formats.
+
+The rows look like the sakila film table (ints, text, decimals, dates). The
+html page is the repr of the rows inside proxy_app's template; it has no
+decoder since the repr of dates and decimals can't be parsed back. The
+other formats are encoded by result_formats in batches of 500 rows, as the
+streaming responses are. msgpack is skipped when it isn't installed.
+
+Usage: python benchmarks/bench_result_formats.py [--rows 10,1000,10000] [--repeat N]
+"""
+import argparse
+import csv
+import datetime
+import decimal
+import io
+import json
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_formats import STREAM_FORMATS, decode_columnar, decode_msgpack
+
+# response of the html routes, as rendered by proxy_app.run_query
+RESPONSE_TEMPLATE = """
+<h1>{_ROUTE_TYPE_} route</h1><h2>Received from {_IP_} ({_NAME_})</h2>
+<p>{_CONTENT_}</p>"""
+
+COLUMNS = ('film_id', 'title', 'description', 'release_year', 'rental_rate', 'length', 'rating', 'last_update')
+
+BATCH_SIZE = 500
+
+
+def build_rows(count):
+    last_update = datetime.datetime(2006, 2, 15, 5, 3, 42)
+    return [(idx, f'FILM TITLE {idx}', f'A Thoughtful Drama of a Dentist And a Cat who must Find a Moose in {idx}',
+             2006, decimal.Decimal(('0.99', '2.99', '4.99')[idx % 3]), 46 + idx % 140,
+             ('G', 'PG', 'PG-13', 'R', 'NC-17')[idx % 5], last_update) for idx in range(1, count + 1)]
+
+
+def encode_html(rows):
+    content = str([dict(zip(COLUMNS, row)) for row in rows])
+    return RESPONSE_TEMPLATE.format(_ROUTE_TYPE_='Random', _IP_='127.0.0.1', _NAME_='SLAVE_1',
+                                    _CONTENT_=content).encode()
+
+
+def stream_encoder(name):
+    encoder = STREAM_FORMATS[name][0]
+
+    def encode(rows):
+        batches = (rows[idx:idx + BATCH_SIZE] for idx in range(0, len(rows), BATCH_SIZE))
+        return b''.join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in encoder(COLUMNS, batches))
+    return encode
+
+
+def decode_ndjson(data):
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+def decode_csv(data):
+    return list(csv.reader(io.StringIO(data.decode())))
+
+
+def measure(func, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(arg)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='10,1000,10000', help='result sizes, comma separated')
+    parser.add_argument('--repeat', type=int, default=20, help='encodings and decodings measured per format')
+    args = parser.parse_args()
+
+    # name -> (encoder, decoder)
+    formats = {
+        'html (repr)': (encode_html, None),
+        'ndjson': (stream_encoder('ndjson'), decode_ndjson),
+        'csv': (stream_encoder('csv'), decode_csv),
+        'columnar': (stream_encoder('columnar'), decode_columnar),
+    }
+    if 'msgpack' in STREAM_FORMATS:
+        formats['msgpack'] = (stream_encoder('msgpack'), decode_msgpack)
+
+    print(f"{'format':<12} {'rows':>6} {'bytes':>10} {'gzip bytes':>11} {'encode':>12} {'decode':>12}")
+    for count in (int(size) for size in args.rows.split(',')):
+        rows = build_rows(count)
+        for name, (encode, decode) in formats.items():
+            encode_time, data = measure(encode, rows, args.repeat)
+            decode_time = measure(decode, data, args.repeat)[0] if decode is not None else None
+            print(f"{name:<12} {count:>6} {len(data):>10} {len(zlib.compress(data, 6)):>11} "
+                  f"{encode_time * 1e3:>10.2f}ms " + (f"{decode_time * 1e3:>10.2f}ms" if decode else f"{'n/a':>12}"))
+        print()
+
+
+if __name__ == '__main__':
+    main()
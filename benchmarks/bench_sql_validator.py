@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""
+Compares the tokenizer based SqlValidator to the regex trustedhost_app used to run.
+
+Usage: python benchmarks/bench_sql_validator.py [--repeat N]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sql_validator import SqlValidator
+
+# validation regex previously used by trustedhost_app.is_valid_request
+LEGACY_PATTERN = r'^\s*(SELECT\s+.+?\s+FROM\s+.+?|INSERT\s+INTO\s+.+?\s+VALUES\s*\(.+?\)|UPDATE\s+.+?\s+SET\s+.+?(\s+WHERE\s+.+?)?|DELETE\s+FROM\s+.+?(\s+WHERE\s+.+?)?)\s*;?\s*$'
+
+
+def legacy_is_valid(sql):
+    return re.match(LEGACY_PATTERN, sql) is not None
+
+
+def build_inputs():
+    # name -> query, from typical traffic to inputs that make the lazy groups backtrack
+    inputs = {
+        'short select': "SELECT * FROM film WHERE film_id = 42",
+        'short insert': "INSERT INTO actor (first_name, last_name) VALUES ('PENELOPE', 'GUINESS')",
+        'short update': "UPDATE film SET rental_rate = 2.99 WHERE film_id = 7",
+    }
+    for size in (1000, 10000):
+        inputs[f'long select ({size} predicates)'] = \
+            "SELECT * FROM film WHERE " + " OR ".join(f"film_id = {i}" for i in range(size))
+        inputs[f'long insert ({size} rows)'] = \
+            "INSERT INTO actor (first_name) VALUES " + ", ".join(f"('actor_{i}')" for i in range(size))
+    for size in (200, 1000, 3000):
+        # no match possible because of the trailing newline, every split of the lazy groups is tried
+        inputs[f'pathological update ({size} words)'] = \
+            "UPDATE " + "t SET " * size + "x\n!"
+        inputs[f'pathological delete ({size} words)'] = \
+            "DELETE FROM " + "a WHERE " * size + "\n!"
+    return inputs
+
+
+def measure(func, sql, repeat, budget):
+    # average seconds per call, stops early once the time budget is spent
+    calls = 0
+    start = time.perf_counter()
+    while calls < repeat:
+        func(sql)
+        calls += 1
+        if time.perf_counter() - start > budget:
+            break
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=1000, help='calls per input and implementation')
+    parser.add_argument('--budget', type=float, default=5.0, help='maximum seconds per input and implementation')
+    args = parser.parse_args()
+
+    implementations = {
+        'legacy regex': legacy_is_valid,
+        'validator (cold)': lambda sql: SqlValidator(cache_size=0).is_valid(sql),
+        'validator (cached)': SqlValidator().is_valid,
+    }
+
+    print(f"{'input':<36} {'length':>8} " + " ".join(f"{name:>20}" for name in implementations))
+    for name, sql in build_inputs().items():
+        timings = [measure(func, sql, args.repeat, args.budget) for func in implementations.values()]
+        print(f"{name:<36} {len(sql):>8} " + " ".join(f"{timing * 1e6:>18.1f}us" for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
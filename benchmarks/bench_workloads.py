@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""
+Sakila workloads run against the proxy routes to compare their routing strategies.
+
+A workload profile mixes read transactions (rental, film and inventory
+lookups) and write transactions (payment and rental inserts, inventory
+updates) with a given read ratio. Keys are drawn from a Zipf distribution
+whose exponent sets the skew (0 is uniform), so a few customers and films
+get most of the traffic as in a real store. Every profile is sent to each
+route with the same open-loop rate and the json report compares their
+throughput and latency, overall and per transaction. With --parameterized
+the transactions are posted to /query/<route> as templates and values (see
+parameterized.py) instead of literal sql in the url.
+
+Only /normal and /auto commit the writes : on /random and /custom a write
+is rolled back when its connection returns to the pool. The writes of the
+other routes are therefore sent to /normal, so every route compares its
+reads under the same committed write load ("write_route" in the report).
+
+By default a local proxy is started on the in-memory database (see
+bench_chain.py); --url targets a deployed proxy or gatekeeper instead.
+
+Usage: python benchmarks/bench_workloads.py [--profiles mixed] [--routes normal,random,custom] [--url URL]
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import string
+import time
+import urllib.parse
+
+from bench_chain import start_tiers, stop_tiers
+from loadgen import run_open_loop, summarize, summarize_by_label
+
+# number of rows of the sakila tables the keys are drawn from
+SAKILA_SIZES = {'customer': 599, 'film': 1000, 'inventory': 4581, 'rental': 16044, 'staff': 2, 'store': 2}
+
+# name -> (weight within the reads, query template)
+READ_TRANSACTIONS = {
+    'rental_lookup': (4, "SELECT r.rental_id, r.rental_date, r.return_date, f.title FROM rental r "
+                         "JOIN inventory i ON i.inventory_id = r.inventory_id JOIN film f ON f.film_id = i.film_id "
+                         "WHERE r.customer_id = {customer} ORDER BY r.rental_date DESC LIMIT 10"),
+    'film_lookup': (3, "SELECT film_id, title, release_year, rental_rate, length FROM film WHERE film_id = {film}"),
+    'inventory_availability': (2, "SELECT i.inventory_id FROM inventory i LEFT JOIN rental r "
+                                  "ON r.inventory_id = i.inventory_id AND r.return_date IS NULL "
+                                  "WHERE i.film_id = {film} AND i.store_id = {store} AND r.rental_id IS NULL"),
+    'customer_balance': (1, "SELECT SUM(amount) AS total FROM payment WHERE customer_id = {customer}"),
+}
+
+# name -> (weight within the writes, query template)
+WRITE_TRANSACTIONS = {
+    'payment_insert': (4, "INSERT INTO payment (customer_id, staff_id, rental_id, amount, payment_date) "
+                          "VALUES ({customer}, {staff}, {rental}, {amount}, NOW())"),
+    'rental_insert': (2, "INSERT INTO rental (rental_date, inventory_id, customer_id, staff_id) "
+                         "VALUES (NOW(), {inventory}, {customer}, {staff})"),
+    'inventory_update': (3, "UPDATE inventory SET last_update = NOW() WHERE inventory_id = {inventory}"),
+    'rental_return': (1, "UPDATE rental SET return_date = NOW() WHERE rental_id = {rental}"),
+}
+
+# profile name -> fraction of read transactions
+PROFILES = {'read-heavy': 0.95, 'mixed': 0.5, 'write-heavy': 0.2}
+
+ROUTES = ('normal', 'random', 'custom')
+
+# routes that commit the writes, see proxy_app ; the writes of the other routes go to /normal
+COMMITTING_ROUTES = {'normal', 'auto'}
+
+
+class ZipfKeys:
+    """Draws keys 1..n, key k with a probability proportional to 1 / k^skew."""
+
+    def __init__(self, n, skew, rng):
+        self._rng = rng
+        self._cumulative = list(itertools.accumulate(1.0 / k ** skew for k in range(1, n + 1)))
+
+    def draw(self):
+        return bisect.bisect_left(self._cumulative, self._rng.random() * self._cumulative[-1]) + 1
+
+
+def parameterize(template):
+    # turns the {field} markers of a transaction template into ? placeholders, returns the fields in order
+    parts = []
+    fields = []
+    for text, field, _, _ in string.Formatter().parse(template):
+        parts.append(text)
+        if field is not None:
+            parts.append('?')
+            fields.append(field)
+    return ''.join(parts), fields
+
+
+class Workload:
+    """Generates the requests of a profile, as expected by loadgen.run_open_loop."""
+
+    def __init__(self, route, read_ratio, skew, seed=None, parameterized=False, max_staleness=None):
+        self.route = route
+        self.write_route = route if route in COMMITTING_ROUTES else 'normal'
+        self.read_ratio = read_ratio
+        self.parameterized = parameterized
+        # staleness bound sent with every request, see proxy_app.STALENESS_HEADER
+        self.headers = {'X-Max-Staleness': str(max_staleness)} if max_staleness is not None else {}
+        self._rng = random.Random(seed)
+        self._keys = {table: ZipfKeys(size, skew, self._rng) for table, size in SAKILA_SIZES.items()}
+        self._reads = self._weighted(READ_TRANSACTIONS)
+        self._writes = self._weighted(WRITE_TRANSACTIONS)
+        self._parameterized = {name: parameterize(template)
+                               for name, (_, template) in {**READ_TRANSACTIONS, **WRITE_TRANSACTIONS}.items()}
+
+    @staticmethod
+    def _weighted(transactions):
+        names = list(transactions)
+        return names, [transactions[name][0] for name in names], {name: transactions[name][1] for name in names}
+
+    def _next_values(self):
+        read = self._rng.random() < self.read_ratio
+        names, weights, templates = self._reads if read else self._writes
+        name = self._rng.choices(names, weights)[0]
+        values = {table: keys.draw() for table, keys in self._keys.items()}
+        values['amount'] = f"{self._rng.uniform(0.99, 11.99):.2f}"
+        return name, templates[name], values, read
+
+    def next_query(self):
+        name, template, values, read = self._next_values()
+        return name, template.format(**values), read
+
+    def next_parameterized_query(self):
+        name, _, values, read = self._next_values()
+        sql, fields = self._parameterized[name]
+        return name, sql, [values[field] for field in fields], read
+
+    def __call__(self):
+        if self.parameterized:
+            name, sql, params, read = self.next_parameterized_query()
+            route = self.route if read else self.write_route
+            body = json.dumps({"sql": sql, "params": params}).encode()
+            return name, 'POST', f"/query/{route}", body, {'Content-Type': 'application/json', **self.headers}
+        name, sql, read = self.next_query()
+        route = self.route if read else self.write_route
+        return name, 'GET', f"/{route}/{urllib.parse.quote(sql, safe='')}", None, self.headers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default=','.join(PROFILES),
+                        help=f"profiles to run, comma separated ({', '.join(PROFILES)})")
+    parser.add_argument('--read-ratio', type=float, help='fraction of reads, overrides the profiles')
+    parser.add_argument('--skew', type=float, default=1.0, help='zipf exponent of the key distribution, 0 is uniform')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='proxy routes compared, comma separated')
+    parser.add_argument('--rate', type=float, default=100, help='requests per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of measured load per profile and route')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of unmeasured load before each run')
+    parser.add_argument('--workers', type=int, default=64, help='client threads, bounds the requests in flight')
+    parser.add_argument('--seed', type=int, help='seed of the generated workloads')
+    parser.add_argument('--parameterized', action='store_true',
+                        help='send templates and values to /query/<route> instead of literal sql')
+    parser.add_argument('--max-staleness', type=float, help='staleness bound of the requests, in seconds')
+    parser.add_argument('--url', help='base url of a running proxy (or gatekeeper), a local proxy is started otherwise')
+    parser.add_argument('--db-latency-ms', type=float, default=2.0, help='time taken by each fake query (local proxy)')
+    parser.add_argument('--slave-latency-ms', default='',
+                        help='per slave fake latencies (local proxy), e.g. "10,2,2" for slaves 1 to 3')
+    parser.add_argument('--slave-lag-ms', default='',
+                        help='per slave fake replication lags (local proxy), e.g. "2000,0,0" for slaves 1 to 3')
+    parser.add_argument('--base-port', type=int, default=18080, help='port of the local proxy')
+    parser.add_argument('--output', help='file the json report is written to, stdout by default')
+    parser.add_argument('--verbose', action='store_true', help="show the local proxy's output")
+    args = parser.parse_args()
+
+    if args.read_ratio is not None:
+        profiles = {f'read-ratio-{args.read_ratio}': args.read_ratio}
+    else:
+        profiles = {name: PROFILES[name] for name in args.profiles.split(',')}
+
+    processes = {}
+    base_url = args.url
+    if base_url is None:
+        # the slaves are reached on the local ports 3307 to 3309, see proxy_app.SLAVE_CONFIGS
+        slave_latencies = [latency for latency in args.slave_latency_ms.split(',') if latency]
+        os.environ['FAKE_DB_PORT_LATENCY_MS'] = ','.join(f'{3307 + idx}:{latency}'
+                                                         for idx, latency in enumerate(slave_latencies))
+        slave_lags = [lag for lag in args.slave_lag_ms.split(',') if lag]
+        os.environ['FAKE_DB_PORT_LAG_MS'] = ','.join(f'{3307 + idx}:{lag}' for idx, lag in enumerate(slave_lags))
+        ports, processes = start_tiers(('proxy',), args.base_port, args.db_latency_ms, rows=10,
+                                       verbose=args.verbose)
+        base_url = f"http://127.0.0.1:{ports['proxy']}"
+
+    report = {"config": {key: value for key, value in vars(args).items() if key != 'verbose'}, "profiles": {}}
+    try:
+        for profile, read_ratio in profiles.items():
+            report["profiles"][profile] = {"read_ratio": read_ratio, "routes": {}}
+            for route in args.routes.split(','):
+                workload = Workload(route, read_ratio, args.skew, args.seed, args.parameterized,
+                                    args.max_staleness)
+                if args.warmup > 0:
+                    run_open_loop(base_url, workload, args.rate, args.warmup, args.workers)
+                start = time.perf_counter()
+                samples = run_open_loop(base_url, workload, args.rate, args.duration, args.workers)
+                elapsed = time.perf_counter() - start
+                result = summarize(samples, elapsed)
+                result["transactions"] = summarize_by_label(samples, elapsed)
+                result["write_route"] = workload.write_route
+                report["profiles"][profile]["routes"][route] = result
+    finally:
+        stop_tiers(processes)
+
+    rendered = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(rendered + '\n')
+    else:
+        print(rendered)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+"""
+In-memory stand-in for the parts of pymysql the proxy uses, so proxy_app can
+run without a MySQL cluster (see bench_chain.py).
+
+Every query sleeps FAKE_DB_LATENCY_MS milliseconds and a SELECT returns
+FAKE_DB_ROWS synthetic rows, which puts a known, fixed cost in place of the
+database and leaves the time spent in the tiers measurable.
+FAKE_DB_PORT_LATENCY_MS overrides the latency per backend port, e.g.
+"3307:5,3308:1" makes the first slave slower than the others.
+PREPARE, EXECUTE and DEALLOCATE PREPARE keep track of the statements of each
+connection, so the prepared statements of the parameterized queries work.
+The heartbeat table of freshness.py is kept in memory, and
+FAKE_DB_PORT_LAG_MS delays the heartbeats seen through a port, e.g.
+"3307:2000" makes the first slave 2 seconds behind the master.
+"""
+import os
+import sys
+import threading
+import time
+import types
+
+QUERY_LATENCY = float(os.getenv('FAKE_DB_LATENCY_MS', '1')) / 1000
+RESULT_ROWS = int(os.getenv('FAKE_DB_ROWS', '10'))
+PORT_LATENCY = {int(port): float(latency) / 1000
+                for port, _, latency in (item.partition(':')
+                                         for item in os.getenv('FAKE_DB_PORT_LATENCY_MS', '').split(',') if item)}
+PORT_LAG = {int(port): float(lag) / 1000
+            for port, _, lag in (item.partition(':') for item in os.getenv('FAKE_DB_PORT_LAG_MS', '').split(',') if item)}
+
+COLUMNS = ('id', 'name', 'last_update')
+
+# (time written, value) of the heartbeats, shared by the connections of the process
+_heartbeats = []
+_heartbeats_lock = threading.Lock()
+
+
+def _write_heartbeat(value):
+    with _heartbeats_lock:
+        latest = _heartbeats[-1][1] if _heartbeats else value
+        _heartbeats.append((time.time(), max(latest, value)))
+        del _heartbeats[:-1000]
+
+
+def _read_heartbeat(lag):
+    # the latest heartbeat written at least lag seconds ago
+    deadline = time.time() - lag
+    with _heartbeats_lock:
+        for written_at, value in reversed(_heartbeats):
+            if written_at <= deadline:
+                return value
+    return None
+
+
+class MySQLError(Exception):
+    pass
+
+
+class OperationalError(MySQLError):
+    pass
+
+
+class Cursor:
+    """Buffered cursor returning tuples."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self._rows = []
+        self._columns = COLUMNS
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def execute(self, sql, params=None):
+        if not self.connection.open:
+            raise OperationalError(2006, 'MySQL server has gone away')
+        time.sleep(self.connection.latency)
+        words = sql.split()
+        command = words[0].upper() if words else ''
+        if command == 'PREPARE':
+            self.connection.statements[words[1]] = params[0]
+            sql = 'PREPARE'
+        elif command == 'DEALLOCATE':
+            self.connection.statements.pop(words[2], None)
+        elif command == 'EXECUTE':
+            if words[1] not in self.connection.statements:
+                raise MySQLError(1243, f'Unknown prepared statement handler ({words[1]}) given to EXECUTE')
+            sql = self.connection.statements[words[1]]
+        if command == 'INSERT' and 'proxy_heartbeat' in sql:
+            _write_heartbeat(params[0])
+        if command == 'SELECT' and 'proxy_heartbeat' in sql:
+            heartbeat = _read_heartbeat(self.connection.lag)
+            self.description = [('written_at', None, None, None, None, None, None)]
+            self._rows = [(heartbeat,)] if heartbeat is not None else []
+            self._columns = ('written_at',)
+            self.rowcount = len(self._rows)
+        elif sql.lstrip().upper().startswith(('SELECT', 'SHOW', 'DESCRIBE', 'EXPLAIN')):
+            self.description = [(name, None, None, None, None, None, None) for name in COLUMNS]
+            self._rows = [(i, f'row_{i}', '2006-02-15 04:34:33') for i in range(RESULT_ROWS)]
+            self._columns = COLUMNS
+            self.rowcount = len(self._rows)
+        else:
+            self.description = None
+            self._rows = []
+            self.rowcount = 1
+            self.lastrowid = 1
+        return self.rowcount
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return [self._convert(row) for row in rows]
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows))
+
+    def close(self):
+        self._rows = []
+
+    def _convert(self, row):
+        return row
+
+
+class DictCursor(Cursor):
+    def _convert(self, row):
+        return dict(zip(self._columns, row))
+
+
+class SSCursor(Cursor):
+    pass
+
+
+class Connection:
+    def __init__(self, cursorclass=Cursor, port=3306, **kwargs):
+        self.cursorclass = cursorclass
+        self.latency = PORT_LATENCY.get(port, QUERY_LATENCY)
+        self.lag = PORT_LAG.get(port, 0.0)
+        self.open = True
+        self.statements = {}
+
+    def cursor(self, cursorclass=None):
+        return (cursorclass or self.cursorclass)(self)
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise OperationalError(2006, 'MySQL server has gone away')
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def connect(**kwargs):
+    return Connection(**kwargs)
+
+
+def install():
+    """Registers this module as `pymysql` (and `pymysql.cursors`) for the imports that follow."""
+    module = sys.modules[__name__]
+    cursors = types.ModuleType('pymysql.cursors')
+    cursors.Cursor, cursors.DictCursor, cursors.SSCursor = Cursor, DictCursor, SSCursor
+    module.cursors = cursors
+    sys.modules['pymysql'] = module
+    sys.modules['pymysql.cursors'] = cursors
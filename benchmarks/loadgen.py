@@ -0,0 +1,151 @@
+#!/usr/bin/python
+"""
+Open-loop http load generator shared by the benchmarks.
+
+Requests are sent at a fixed rate whatever the response times, and each
+latency is measured from the time the request was scheduled rather than
+sent, so a server that falls behind shows up in the percentiles instead of
+silently slowing the load down (coordinated omission).
+"""
+import http.client
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_server_timing(value):
+    """
+    Parses a Server-Timing header.
+
+    Returns:
+        Dict metric name -> duration in milliseconds.
+    """
+    timings = {}
+    for entry in value.split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, duration = param.strip().partition('=')
+            if key == 'dur' and name:
+                try:
+                    timings[name] = timings.get(name, 0.0) + float(duration)
+                except ValueError:
+                    pass
+    return timings
+
+
+class Sample:
+    __slots__ = ('label', 'latency', 'status', 'server_timing')
+
+    def __init__(self, label, latency, status, server_timing):
+        self.label = label
+        self.latency = latency
+        self.status = status
+        self.server_timing = server_timing
+
+
+class _Client:
+    # one keep-alive connection per worker thread
+
+    def __init__(self, base_url, timeout):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port,
+                                                                             timeout=self.timeout)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            response.read()
+            return response.status, response.getheader('Server-Timing', '')
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            return 0, ''
+
+
+def run_open_loop(base_url, next_request, rate, duration, workers=64, timeout=30.0):
+    """
+    Sends `rate` requests per second for `duration` seconds.
+
+    Args:
+        base_url (str): e.g. http://127.0.0.1:8080.
+        next_request (callable): returns the next request to send, as a tuple
+            (label, method, path, body, headers). The label groups the samples in the report.
+        rate (float): requests per second.
+        duration (float): seconds of load.
+        workers (int): threads sending the requests, bounds the requests in flight.
+        timeout (float): socket timeout of a request.
+
+    Returns:
+        List of Sample, status 0 meaning the request failed without response.
+    """
+    client = _Client(base_url, timeout)
+    samples = []
+    lock = threading.Lock()
+
+    def send(scheduled_at, label, method, path, body, headers):
+        status, server_timing = client.request(method, path, body, headers)
+        sample = Sample(label, time.perf_counter() - scheduled_at, status, parse_server_timing(server_timing))
+        with lock:
+            samples.append(sample)
+
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled_at = start + i * interval
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, scheduled_at, *next_request())
+    return samples
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def _latency_summary(values_ms):
+    values_ms = sorted(values_ms)
+    return {
+        "p50_ms": percentile(values_ms, 0.50),
+        "p95_ms": percentile(values_ms, 0.95),
+        "p99_ms": percentile(values_ms, 0.99),
+        "max_ms": values_ms[-1] if values_ms else None,
+    }
+
+
+def summarize(samples, duration):
+    """
+    Throughput, errors and latency percentiles of a run, plus the
+    percentiles of every Server-Timing entry the tiers reported.
+    """
+    ok = [sample for sample in samples if 200 <= sample.status < 400]
+    server_timing = {}
+    for sample in ok:
+        for name, value in sample.server_timing.items():
+            server_timing.setdefault(name, []).append(value)
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "throughput_rps": len(ok) / duration if duration else None,
+        "latency": _latency_summary([sample.latency * 1000 for sample in ok]),
+        "server_timing": {name: _latency_summary(values) for name, values in sorted(server_timing.items())},
+    }
+
+
+def summarize_by_label(samples, duration):
+    labels = sorted({sample.label for sample in samples})
+    return {label: summarize([sample for sample in samples if sample.label == label], duration)
+            for label in labels}
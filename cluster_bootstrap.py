@@ -0,0 +1,420 @@
+#!/usr/bin/python
+"""
+Installe et configure le cluster MySQL NDB puis déploie les applications, à
+partir des adresses écrites par setup_instance.py dans env_variables.txt.
+
+Les étapes de chaque nœud forment un graphe de dépendances (nœud de gestion
+-> nœuds de données -> nœud SQL -> applications) exécuté sur un nombre
+borné de threads : les étapes indépendantes (par exemple l'installation des
+différents nœuds de données) tournent en même temps. Chaque étape terminée
+est enregistrée dans un fichier de reprise, une nouvelle exécution reprend
+donc là où la précédente s'est arrêtée.
+
+Usage: python cluster_bootstrap.py [--env-file env_variables.txt] [--workers 8] [--reset]
+"""
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+STATE_FILE = '.bootstrap_state.json'
+
+SSH_OPTIONS = ['-o', 'StrictHostKeyChecking=no', '-o', 'ConnectTimeout=5']
+
+INSTALL_MANAGEMENT_NODE = """set -e
+sudo apt-get update && sudo apt-get install -y libncurses5 libaio1 libmecab2
+sudo mkdir -p /opt/mysqlcluster/home /var/lib/mysqlcluster
+wget --progress=bar:force:noscroll https://dev.mysql.com/get/Downloads/MySQL-Cluster-7.6/mysql-cluster-community-management-server_7.6.6-1ubuntu18.04_amd64.deb
+sudo dpkg -i mysql-cluster-community-management-server_7.6.6-1ubuntu18.04_amd64.deb
+wget --progress=bar:force:noscroll http://dev.mysql.com/get/Downloads/MySQL-Cluster-7.2/mysql-cluster-gpl-7.2.1-linux2.6-x86_64.tar.gz
+tar -xf mysql-cluster-gpl-7.2.1-linux2.6-x86_64.tar.gz
+rm -rf mysqlc && mv mysql-cluster-gpl-7.2.1-linux2.6-x86_64 mysqlc
+grep -q 'alias ndb_mgm=' /home/ubuntu/.profile || echo "alias ndb_mgm=/home/ubuntu/mysqlc/bin/ndb_mgm" >> /home/ubuntu/.profile
+"""
+
+INSTALL_DATA_NODE = """set -e
+sudo apt-get update && sudo apt-get install -y libncurses5 libclass-methodmaker-perl
+sudo mkdir -p /opt/mysqlcluster/home /var/lib/mysqlcluster
+cd /opt/mysqlcluster/home
+sudo wget --progress=bar:force:noscroll https://dev.mysql.com/get/Downloads/MySQL-Cluster-7.6/mysql-cluster-community-data-node_7.6.6-1ubuntu18.04_amd64.deb
+sudo dpkg -i mysql-cluster-community-data-node_7.6.6-1ubuntu18.04_amd64.deb
+"""
+
+CONFIGURE_DATA_NODE = """set -e
+sudo mkdir -p /opt/mysqlcluster/deploy/mysqld_data
+sudo cp my.cnf /etc/my.cnf
+sudo cp ndbd.service /etc/systemd/system/
+sudo systemctl daemon-reload
+"""
+
+START_MANAGEMENT_NODE = """set -e
+sudo mkdir -p /opt/mysqlcluster/deploy/conf /opt/mysqlcluster/deploy/ndb_data /opt/mysqlcluster/deploy/mysqld_data /var/lib/mysqlcluster
+sudo cp /home/ubuntu/config.ini /opt/mysqlcluster/deploy/conf/
+sudo pkill ndb_mgmd || true
+sudo ndb_mgmd -f /opt/mysqlcluster/deploy/conf/config.ini --initial --configdir=/opt/mysqlcluster/deploy/conf/
+"""
+
+START_DATA_NODE = """set -e
+sudo systemctl restart ndbd.service
+sudo systemctl status ndbd.service
+"""
+
+INSTALL_SQL_NODE = """set -e
+wget --progress=bar:force:noscroll https://dev.mysql.com/get/Downloads/MySQL-Cluster-8.0/mysql-cluster_8.0.31-1ubuntu20.04_amd64.deb-bundle.tar
+mkdir -p install
+tar -xvf mysql-cluster_8.0.31-1ubuntu20.04_amd64.deb-bundle.tar -C install/
+(cd install && sudo dpkg -i *.deb || sudo apt-get install -y -f)
+grep -q ndbcluster /etc/mysql/my.cnf || sudo bash -c 'cat /home/ubuntu/server_conf.conf >> /etc/mysql/my.cnf'
+sudo systemctl restart mysql
+sleep 1
+sudo mysql -u root --password=mysql -e "CREATE USER IF NOT EXISTS 'user0'@'%' IDENTIFIED BY 'mysql';"
+sudo mysql -u root --password=mysql -e "GRANT ALL PRIVILEGES ON *.* TO 'user0'@'%' WITH GRANT OPTION;"
+sudo mysql -u root --password=mysql -e "FLUSH PRIVILEGES;"
+"""
+
+LOAD_SAKILA = """set -e
+wget --progress=bar:force:noscroll https://downloads.mysql.com/docs/sakila-db.tar.gz
+tar -xvf sakila-db.tar.gz
+mysql -u user0 --password=mysql -e "SOURCE sakila-db/sakila-schema.sql"
+mysql -u user0 --password=mysql -e "SOURCE sakila-db/sakila-data.sql"
+"""
+
+VERIFY_CLUSTER = """set -e
+sudo systemctl restart mysql
+ndb_mgm -e show
+"""
+
+# threads de l'unique processus du proxy : son cache de résultats, ses sessions collantes, sa fusion des requêtes
+# identiques et ses requêtes préparées sont propres au processus et doivent voir toutes les requêtes
+PROXY_THREADS = 32
+
+# modules déployés avec chaque application
+PROXY_FILES = ['proxy_app.py', 'connection_pool.py', 'latency_prober.py', 'result_formats.py', 'query_router.py',
+               'sql_validator.py', 'result_cache.py', 'batch.py', 'load_balancing.py', 'backend_health.py',
+               'metrics.py', 'tracing.py', 'singleflight.py', 'parameterized.py', 'prepared_statements.py',
+               'prefork.py', 'freshness.py']
+GATEKEEPER_FILES = ['gatekeeper_app.py', 'gatekeeper_async.py', 'admission.py', 'forwarding.py', 'metrics.py',
+                    'tracing.py', 'prefork.py']
+TRUSTEDHOST_FILES = ['trustedhost_app.py', 'sql_validator.py', 'forwarding.py', 'batch.py', 'metrics.py',
+                     'tracing.py', 'parameterized.py', 'prefork.py']
+
+
+def app_process_pattern(module):
+    """
+    Motif pkill -f des processus prefork.py d'une application. Ancré au début
+    de la ligne de commande, il ne correspond ni au shell distant exécutant
+    start_app_command (sa ligne contient toute la commande) ni à sudo.
+    """
+    return f'^python3 prefork\\.py {module}:'
+
+
+def start_app_command(app_file, env=None, workers=None, threads=None):
+    """
+    Commande (re)démarrant une application en arrière-plan avec le lanceur multi-processus prefork.py,
+    avec ses variables d'environnement.
+
+    Args:
+        app_file (str): Fichier de l'application.
+        env (dict): Variables d'environnement de l'application.
+        workers (int): Nombre de processus, un par cœur si None.
+        threads (int): Nombre de threads de chaque processus, celui de prefork.py si None.
+    """
+    exports = ''.join(f'{key}={shlex.quote(value)} ' for key, value in (env or {}).items())
+    module = app_file.replace('.py', '')
+    log_file = app_file.replace('.py', '.log')
+    options = ''.join(f' --{name} {value}' for name, value in (('workers', workers), ('threads', threads))
+                      if value is not None)
+    # les connexions en attente chez un processus qui s'arrête passent aux autres au lieu d'être réinitialisées
+    return (f"sudo sysctl -q -w net.ipv4.tcp_migrate_req=1 || true; "
+            f"sudo pkill -f {shlex.quote(app_process_pattern(module))} || true; "
+            f"nohup sudo {exports}python3 prefork.py {module}:app --port 80{options} > {log_file} 2>&1 < /dev/null &")
+
+
+def read_env_file(env_file):
+    """
+    Lit les variables écrites par setup_instance.py.
+
+    Args:
+        env_file (str): Chemin du fichier (lignes CLE=valeur).
+
+    Returns:
+        Dictionnaire des variables.
+    """
+    env = {}
+    with open(env_file) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                env[key] = value
+    return env
+
+
+def data_node_ips(env):
+    """IPs publiques des nœuds de données, dans l'ordre de leur index."""
+    ips = []
+    while f'INSTANCE_IP_CHILD_IP_{len(ips)}' in env:
+        ips.append(env[f'INSTANCE_IP_CHILD_IP_{len(ips)}'])
+    return ips
+
+
+def extra_sql_node_ips(env):
+    """IPs publiques des nœuds SQL autres que le maître, numérotés à partir de 1."""
+    ips = []
+    while f'INSTANCE_IP_SQL_IP_{len(ips) + 1}' in env:
+        ips.append(env[f'INSTANCE_IP_SQL_IP_{len(ips) + 1}'])
+    return ips
+
+
+class Step:
+    """
+    Étape du déploiement exécutée sur un hôte.
+
+    Args:
+        name (str): Nom unique de l'étape, utilisé dans le fichier de reprise.
+        host (str): IP de l'hôte.
+        deps (list of str): Étapes devant être terminées avant celle-ci.
+        uploads (list of str): Fichiers locaux copiés dans le répertoire de l'utilisateur avant le script.
+        script (str): Script bash exécuté sur l'hôte.
+        command (str): Commande exécutée sur l'hôte, après le script.
+    """
+
+    def __init__(self, name, host, deps=(), uploads=(), script=None, command=None):
+        self.name = name
+        self.host = host
+        self.deps = list(deps)
+        self.uploads = list(uploads)
+        self.script = script
+        self.command = command
+
+    def run(self, executor):
+        executor.wait_for_ssh(self.host)
+        if self.uploads:
+            executor.upload(self.host, self.uploads)
+        if self.script is not None:
+            executor.run(self.host, 'bash -s', stdin=self.script)
+        if self.command is not None:
+            executor.run(self.host, self.command)
+
+
+def build_steps(env):
+    """
+    Construit le graphe des étapes du déploiement.
+
+    Args:
+        env (dict): Variables de env_variables.txt.
+
+    Returns:
+        Liste des étapes.
+    """
+    master = env['INSTANCE_IP_MASTER_IP']
+    children = data_node_ips(env)
+    steps = [
+        Step('install_management_node', master, script=INSTALL_MANAGEMENT_NODE),
+        Step('start_management_node', master, deps=['install_management_node'],
+             uploads=['master_node/config.ini'], script=START_MANAGEMENT_NODE),
+    ]
+    for idx, ip in enumerate(children):
+        steps.append(Step(f'install_data_node_{idx}', ip, script=INSTALL_DATA_NODE))
+        steps.append(Step(f'configure_data_node_{idx}', ip, deps=[f'install_data_node_{idx}'],
+                          uploads=['systemd/ndbd.service', 'master_node/my.cnf'], script=CONFIGURE_DATA_NODE))
+        steps.append(Step(f'start_data_node_{idx}', ip, deps=[f'configure_data_node_{idx}', 'start_management_node'],
+                          script=START_DATA_NODE))
+    started_data_nodes = [f'start_data_node_{idx}' for idx in range(len(children))]
+    # les nœuds SQL s'installent en même temps que les nœuds de données,
+    # ils rejoignent le cluster une fois ceux-ci démarrés
+    installed_sql_nodes = ['install_sql_node']
+    for idx, ip in enumerate(extra_sql_node_ips(env), 1):
+        steps.append(Step(f'install_sql_node_{idx}', ip, deps=['start_management_node'],
+                          uploads=['master_node/server_conf.conf'], script=INSTALL_SQL_NODE))
+        installed_sql_nodes.append(f'install_sql_node_{idx}')
+    steps += [
+        Step('install_sql_node', master, deps=['start_management_node'],
+             uploads=['master_node/server_conf.conf'], script=INSTALL_SQL_NODE),
+        Step('verify_cluster', master, deps=installed_sql_nodes + started_data_nodes, script=VERIFY_CLUSTER),
+        Step('load_sakila', master, deps=['verify_cluster'], script=LOAD_SAKILA),
+        Step('deploy_proxy', env['INSTANCE_IP_PROXY_IP'], deps=['load_sakila'], uploads=PROXY_FILES,
+             command=start_app_command('proxy_app.py', workers=1, threads=PROXY_THREADS)),
+        Step('deploy_trustedhost', env['INSTANCE_IP_TRUSTEDHOST_IP'], deps=['deploy_proxy'],
+             uploads=TRUSTEDHOST_FILES,
+             command=start_app_command('trustedhost_app.py', {
+                 'INSTANCE_PRIVATE_IP_PROXY_IP': env['INSTANCE_PRIVATE_IP_PROXY_IP']})),
+        Step('deploy_gatekeeper', env['INSTANCE_IP_GATEKEEPER_IP'], deps=['deploy_trustedhost'],
+             uploads=GATEKEEPER_FILES,
+             command=start_app_command('gatekeeper_app.py', {
+                 'INSTANCE_PRIVATE_IP_TRUSTEDHOST_IP': env['INSTANCE_PRIVATE_IP_TRUSTEDHOST_IP']})),
+    ]
+    return steps
+
+
+class SshExecutor:
+    """
+    Exécute les étapes sur les instances avec ssh et scp.
+
+    Args:
+        private_key_file (str): Clé privée de connexion.
+        user (str): Utilisateur distant.
+        ssh_timeout (float): Secondes d'attente maximale de la disponibilité de ssh sur un hôte.
+    """
+
+    def __init__(self, private_key_file, user='ubuntu', ssh_timeout=600.0):
+        self.private_key_file = private_key_file
+        self.user = user
+        self.ssh_timeout = ssh_timeout
+
+    def wait_for_ssh(self, host):
+        deadline = time.monotonic() + self.ssh_timeout
+        while True:
+            result = subprocess.run(['ssh', *SSH_OPTIONS, '-i', self.private_key_file, f'{self.user}@{host}', 'true'],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode == 0:
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"SSH indisponible sur {host}")
+            print(f"En attente de SSH sur {host}")
+            time.sleep(3)
+
+    def upload(self, host, paths):
+        subprocess.run(['scp', *SSH_OPTIONS, '-i', self.private_key_file, *paths, f'{self.user}@{host}:~'],
+                       check=True)
+
+    def run(self, host, command, stdin=None):
+        subprocess.run(['ssh', *SSH_OPTIONS, '-i', self.private_key_file, f'{self.user}@{host}', command],
+                       input=stdin, text=True, check=True)
+
+
+class FakeExecutor:
+    """
+    Exécuteur local n'ouvrant aucune connexion : il enregistre les appels,
+    pour tester le graphe et la reprise sans instances.
+
+    Args:
+        fail_on (set of tuple): (hôte, commande) dont l'exécution échoue.
+        delay (float): Durée simulée de chaque commande, en secondes.
+    """
+
+    def __init__(self, fail_on=(), delay=0.0):
+        self.fail_on = set(fail_on)
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _record(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def wait_for_ssh(self, host):
+        self._record(('wait_for_ssh', host))
+
+    def upload(self, host, paths):
+        self._record(('upload', host, tuple(paths)))
+
+    def run(self, host, command, stdin=None):
+        time.sleep(self.delay)
+        self._record(('run', host, command, stdin))
+        if (host, stdin or command) in self.fail_on:
+            raise subprocess.CalledProcessError(1, command)
+
+
+class Checkpoint:
+    """
+    Fichier de reprise contenant les noms des étapes terminées.
+
+    Args:
+        path (str): Chemin du fichier, None pour ne rien enregistrer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = set()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.completed = set(json.load(f)['completed'])
+
+    def mark_completed(self, name):
+        with self._lock:
+            self.completed.add(name)
+            if self.path is None:
+                return
+            # remplacement atomique : une exécution interrompue ne laisse jamais un fichier tronqué
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'completed': sorted(self.completed)}, f)
+            os.replace(tmp_path, self.path)
+
+
+def run_steps(steps, executor, checkpoint, max_workers=8):
+    """
+    Exécute les étapes dans l'ordre de leurs dépendances, en parallèle
+    lorsqu'elles sont indépendantes. Les étapes déjà enregistrées dans le
+    fichier de reprise sont sautées. Après un échec, les étapes en cours se
+    terminent mais aucune nouvelle n'est lancée.
+
+    Args:
+        steps (list of Step): Étapes à exécuter.
+        executor: SshExecutor ou FakeExecutor.
+        checkpoint (Checkpoint): Étapes déjà terminées.
+        max_workers (int): Nombre maximal d'étapes simultanées.
+
+    Returns:
+        Dictionnaire nom de l'étape -> exception, pour les étapes ayant échoué.
+    """
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        unknown = [dep for dep in step.deps if dep not in by_name]
+        if unknown:
+            raise ValueError(f"L'étape {step.name} dépend d'étapes inconnues : {unknown}")
+
+    pending = [step for step in steps if step.name not in checkpoint.completed]
+    failures = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            if not failures:
+                for step in [step for step in pending if all(dep in checkpoint.completed for dep in step.deps)]:
+                    print(f"Début de l'étape {step.name} sur {step.host}")
+                    running[pool.submit(step.run, executor)] = step
+                    pending.remove(step)
+            if not running:
+                if pending and not failures:
+                    raise ValueError(f"Dépendances circulaires entre {[step.name for step in pending]}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    checkpoint.mark_completed(step.name)
+                    print(f"Étape {step.name} terminée")
+                else:
+                    failures[step.name] = error
+                    print(f"Échec de l'étape {step.name} : {error}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--env-file', default='env_variables.txt', help='variables écrites par setup_instance.py')
+    parser.add_argument('--state-file', default=STATE_FILE, help='fichier de reprise')
+    parser.add_argument('--workers', type=int, default=8, help="nombre maximal d'étapes simultanées")
+    parser.add_argument('--reset', action='store_true', help='ignore le fichier de reprise et recommence tout')
+    args = parser.parse_args()
+
+    env = read_env_file(args.env_file)
+    if args.reset and os.path.exists(args.state_file):
+        os.remove(args.state_file)
+    checkpoint = Checkpoint(args.state_file)
+    failures = run_steps(build_steps(env), SshExecutor(env['PRIVATE_KEY_FILE']), checkpoint, args.workers)
+    if failures:
+        print(f"Déploiement interrompu, relancez pour reprendre : {', '.join(failures)}")
+        raise SystemExit(1)
+    print("Installation terminée")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Génération des fichiers de configuration du cluster à partir de sa topologie :
+nombre de nœuds de données, nombre de réplicas (les nœuds de données sont
+répartis en groupes de `replicas` nœuds, chaque groupe portant une partition)
+et nombre de nœuds SQL.
+"""
+import constants
+
+# NDB keeps at most 4 copies of each partition
+MAX_REPLICAS = 4
+
+# marks the part of proxy_app_temp.py replaced by the backend list of the cluster
+PROXY_BACKENDS_BEGIN = '# --- cluster backends (generated by setup_instance.generate_proxy_py) ---'
+PROXY_BACKENDS_END = '# --- end of cluster backends ---'
+
+# local port of the ssh tunnel to the first slave, the next slaves use the following ports
+FIRST_SLAVE_PORT = 3307
+
+
+def validate_topology(data_node_count, replicas, sql_node_count):
+    """
+    Vérifie qu'une topologie est réalisable, avant de créer les instances.
+
+    Args:
+        data_node_count (int): Nombre de nœuds de données.
+        replicas (int): Nombre de réplicas.
+        sql_node_count (int): Nombre de nœuds SQL.
+    """
+    if not 1 <= replicas <= MAX_REPLICAS:
+        raise ValueError(f"NoOfReplicas must be between 1 and {MAX_REPLICAS}, got {replicas}")
+    if data_node_count < 1 or data_node_count % replicas:
+        raise ValueError(f"The number of data nodes ({data_node_count}) must be a non zero multiple "
+                         f"of the number of replicas ({replicas})")
+    if sql_node_count < 1:
+        raise ValueError("The cluster needs at least one SQL node")
+
+
+class Topology:
+    """
+    Topologie du cluster.
+
+    Args:
+        management (dict): Informations de l'instance du nœud de gestion (clés 'dns', 'public_ip', 'private_ip').
+        data_nodes (list of dict): Informations des instances des nœuds de données.
+        sql_nodes (list of dict): Informations des instances des nœuds SQL, le premier reçoit les écritures du proxy.
+        replicas (int): Nombre de copies de chaque partition (NoOfReplicas).
+    """
+
+    def __init__(self, management, data_nodes, sql_nodes, replicas):
+        validate_topology(len(data_nodes), replicas, len(sql_nodes))
+        self.management = management
+        self.data_nodes = list(data_nodes)
+        self.sql_nodes = list(sql_nodes)
+        self.replicas = replicas
+
+    def data_node_ids(self):
+        # the management node is node 1, the data nodes follow
+        return list(range(2, 2 + len(self.data_nodes)))
+
+    def sql_node_ids(self):
+        first = 2 + len(self.data_nodes)
+        return list(range(first, first + len(self.sql_nodes)))
+
+
+def topology_from_instances(instance_infos, replicas):
+    """
+    Construit la topologie à partir des informations écrites par setup_instance.
+
+    Args:
+        instance_infos (list of dict): Informations des instances. Le maître est le nœud de gestion et le
+            premier nœud SQL, les nœuds de données ont une clé 'child_idx' et les autres nœuds SQL une clé 'sql_idx'.
+        replicas (int): Nombre de réplicas.
+
+    Returns:
+        Topology.
+    """
+    master = next(info for info in instance_infos if info['name'] == 'Master')
+    data_nodes = sorted((info for info in instance_infos if 'child_idx' in info), key=lambda info: info['child_idx'])
+    sql_nodes = sorted((info for info in instance_infos if 'sql_idx' in info), key=lambda info: info['sql_idx'])
+    return Topology(master, data_nodes, [master] + sql_nodes, replicas)
+
+
+def render_config_ini(topology):
+    """Contenu du config.ini du nœud de gestion."""
+    sections = [constants.TEMPLATE_NDBD_DEFAULT.format(replicas=topology.replicas),
+                constants.TEMPLATE_NDB_MGMD.format(manager_hostname=topology.management['dns'])]
+    for idx, (node, node_id) in enumerate(zip(topology.data_nodes, topology.data_node_ids())):
+        # consecutive data nodes form a node group, each node group holds one partition
+        sections.append(constants.TEMPLATE_NDBD.format(hostname=node['dns'], node_id=node_id,
+                                                       node_group=idx // topology.replicas))
+    for node, node_id in zip(topology.sql_nodes, topology.sql_node_ids()):
+        sections.append(constants.TEMPLATE_MYSQLD.format(hostname=node['dns'], node_id=node_id))
+    return '\n'.join(sections)
+
+
+def render_data_node_cnf(topology):
+    """Contenu du my.cnf des nœuds de données."""
+    return constants.TEMPLATE_SLAVE.format(manager_hostname=topology.management['dns'])
+
+
+def render_sql_node_cnf(topology):
+    """Configuration ajoutée au my.cnf des nœuds SQL."""
+    return constants.TEMPLATE_SQL_SERVER.format(manager_hostname=topology.management['dns'])
+
+
+def render_proxy_backends(topology):
+    """
+    Code python des backends du proxy : le premier nœud SQL reçoit les
+    écritures, chaque nœud de données héberge le tunnel ssh d'un esclave,
+    qui mène lui aussi au premier nœud SQL. Les tables sakila sont créées en
+    InnoDB par LOAD_SAKILA sur ce seul nœud : les autres nœuds SQL n'ont que
+    les tables NDBCLUSTER et ne peuvent pas servir les lectures du proxy.
+    """
+    master = topology.sql_nodes[0]
+    lines = [PROXY_BACKENDS_BEGIN,
+             'MASTER_CONFIG = {',
+             f'    "ip": "{master["public_ip"]}",',
+             '    "port": 3306,',
+             '    "name": "MASTER"',
+             '}',
+             '',
+             'SLAVE_CONFIGS = [']
+    for idx, node in enumerate(topology.data_nodes):
+        lines.append(f'    {{"ip": "{node["public_ip"]}", "port": {FIRST_SLAVE_PORT + idx}, "name": "SLAVE_{idx + 1}", '
+                     f'"sql_node": "{master["private_ip"]}"}},')
+    lines += [']', PROXY_BACKENDS_END]
+    return '\n'.join(lines)
+
+
+def replace_proxy_backends(source, backends):
+    """
+    Remplace le bloc des backends d'un code source du proxy.
+
+    Args:
+        source (str): Code de proxy_app_temp.py.
+        backends (str): Bloc généré par render_proxy_backends.
+
+    Returns:
+        Le code source avec le nouveau bloc.
+    """
+    start = source.index(PROXY_BACKENDS_BEGIN)
+    end = source.index(PROXY_BACKENDS_END, start) + len(PROXY_BACKENDS_END)
+    return source[:start] + backends + source[end:]
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection could be checked out before the timeout."""
+
+
+class _PooledConnection:
+    # a connection along with the timestamps the pool needs for recycling
+    __slots__ = ("connection", "created_at", "last_used")
+
+    def __init__(self, connection):
+        now = time.monotonic()
+        self.connection = connection
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Thread-safe, bounded pool of connections to a single backend.
+
+    Connections are created lazily through `connect` (a callable returning a
+    DB-API connection) up to `max_size`. Idle connections are reused in LIFO
+    order so the least recently used ones age out and get evicted after
+    `max_idle_time` seconds. Every connection is recycled once it is older than
+    `max_lifetime` seconds, and connections that sat idle for more than
+    `validate_after` seconds are pinged before being handed out.
+    """
+
+    def __init__(self, name, connect, max_size=10, checkout_timeout=5.0,
+                 max_idle_time=60.0, max_lifetime=1800.0, validate_after=5.0):
+        self.name = name
+        self._connect = connect
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._metrics = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_s": 0.0,
+            "exhausted": 0,
+            "validation_failures": 0,
+            "evicted_idle": 0,
+            "recycled_lifetime": 0,
+            "connect_errors": 0,
+        }
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Check out a connection for the duration of a `with` block, waiting at
+        most `timeout` seconds (the pool's checkout_timeout by default).
+        """
+        entry = self._checkout(self.checkout_timeout if timeout is None else timeout)
+        try:
+            yield entry.connection
+        finally:
+            self._release(entry)
+
+    def stats(self):
+        """Returns a snapshot of the pool occupancy and counters."""
+        with self._cond:
+            stats = dict(self._metrics)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        return stats
+
+    def drain(self):
+        """Closes the idle connections, e.g. after the path to the backend was rebuilt."""
+        with self._cond:
+            entries = list(self._idle)
+            self._idle.clear()
+            self._size -= len(entries)
+            self._cond.notify(len(entries))
+        for entry in entries:
+            self._close_entry(entry)
+
+    def close(self):
+        """Closes every idle connection; in-use connections are closed on release."""
+        with self._cond:
+            self._closed = True
+            entries = list(self._idle)
+            self._idle.clear()
+            self._size -= len(entries)
+            self._cond.notify_all()
+        for entry in entries:
+            self._close_entry(entry)
+
+    def _checkout(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            entry, create, expired = self._take(deadline)
+            for stale in expired:
+                self._close_entry(stale)
+
+            if create:
+                entry = self._create_entry()
+            elif not self._validate(entry):
+                continue
+            with self._cond:
+                self._metrics["checkouts"] += 1
+            return entry
+
+    def _take(self, deadline):
+        # returns an idle entry, or reserves a slot for a new connection, or
+        # raises once the deadline has passed without either being possible
+        expired = []
+        wait_started = None
+        with self._cond:
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolExhaustedError(f"Pool {self.name} is closed")
+                    now = time.monotonic()
+                    expired.extend(self._pop_expired(now))
+                    if self._idle:
+                        return self._idle.pop(), False, expired
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None, True, expired
+                    if now >= deadline:
+                        self._metrics["exhausted"] += 1
+                        raise PoolExhaustedError(
+                            f"Pool {self.name} exhausted ({self.max_size} connections in use)")
+                    if wait_started is None:
+                        wait_started = now
+                        self._metrics["waits"] += 1
+                    self._cond.wait(deadline - now)
+            finally:
+                if wait_started is not None:
+                    self._metrics["wait_time_s"] += time.monotonic() - wait_started
+
+    def _create_entry(self):
+        try:
+            connection = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._metrics["connect_errors"] += 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._metrics["created"] += 1
+        return _PooledConnection(connection)
+
+    def _validate(self, entry):
+        # only ping connections that have been idle long enough to have gone stale
+        if time.monotonic() - entry.last_used < self.validate_after:
+            return True
+        try:
+            entry.connection.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._cond:
+                self._metrics["validation_failures"] += 1
+            self._discard(entry)
+            return False
+
+    def _release(self, entry):
+        # end whatever transaction the caller left open, like closing would have
+        try:
+            entry.connection.rollback()
+        except Exception:
+            self._discard(entry)
+            return
+
+        now = time.monotonic()
+        entry.last_used = now
+        with self._cond:
+            if not self._closed and now - entry.created_at < self.max_lifetime:
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+            if not self._closed:
+                self._metrics["recycled_lifetime"] += 1
+        self._discard(entry)
+
+    def _pop_expired(self, now):
+        # the oldest idle connections sit on the left of the deque
+        expired = []
+        while self._idle:
+            entry = self._idle[0]
+            if now - entry.created_at >= self.max_lifetime:
+                self._metrics["recycled_lifetime"] += 1
+            elif now - entry.last_used >= self.max_idle_time:
+                self._metrics["evicted_idle"] += 1
+            else:
+                break
+            expired.append(self._idle.popleft())
+            self._size -= 1
+        if expired:
+            self._cond.notify(len(expired))
+        return expired
+
+    def _discard(self, entry):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        self._close_entry(entry)
+
+    def _close_entry(self, entry):
+        try:
+            entry.connection.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._metrics["closed"] += 1
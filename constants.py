@@ -1,7 +1,13 @@
+# tag put on every resource created by setup_instance.py, aws_cleanup_script.py only deletes the tagged ones
+PROJECT_TAG = {'Key': 'Project', 'Value': 'LOG8415E-final-project'}
+
+# security groups created by setup_instance.py
+SECURITY_GROUP_NAMES = ['proxy-sg', 'gatekeeper-sg', 'trustedhost-sg']
+
 USER_DATA_PROXY = """#!/bin/bash
 apt update && \
     apt install -y python3 python3-flask python3-pip && \
-    pip install pymysql sshtunnel pythonping"""
+    pip install pymysql sshtunnel pythonping msgpack"""
 
 USER_DATA_TRUSTEDHOST = """#!/bin/bash
 apt update && \
@@ -11,7 +17,7 @@ apt update && \
 USER_DATA_GATEKEEPER = """#!/bin/bash
 apt update && \
     apt install -y python3 python3-flask python3-pip && \
-    pip install pymysql sshtunnel pythonping"""
+    pip install pymysql sshtunnel pythonping requests aiohttp"""
 
 TEMPLATE_SLAVE = """[mysql_cluster]
 # Options for NDB Cluster processes:
@@ -26,31 +32,34 @@ ndbcluster                      # run NDB storage engine
 # Options for NDB Cluster processes:
 ndb-connectstring={manager_hostname}  # location of management server"""
 
-TEMPLATE_MASTER = """
+# sections of the config.ini of the management node, see cluster_topology.render_config_ini
+TEMPLATE_NDBD_DEFAULT = """
 [ndbd default]
-NoOfReplicas=3	# Number of replicas
+NoOfReplicas={replicas}	# Number of replicas
+"""
 
-[ndb_mgmd]
+TEMPLATE_NDB_MGMD = """[ndb_mgmd]
 # Management process options:
 hostname={manager_hostname} # Hostname of the manager
 datadir=/var/lib/mysqlcluster 	# Directory for the log files
+"""
 
-[ndbd]
-hostname={slave_0_hostname} # Hostname/IP of the first data node
-NodeId=2			# Node ID for this data node
-datadir=/opt/mysqlcluster/deploy/mysqld_data	# Remote directory for the data files
-
-[ndbd]
-hostname={slave_1_hostname} # Hostname/IP of the first data node
-NodeId=3			# Node ID for this data node
-datadir=/opt/mysqlcluster/deploy/mysqld_data	# Remote directory for the data files
-
-[ndbd]
-hostname={slave_2_hostname} # Hostname/IP of the second data node
-NodeId=4			# Node ID for this data node
+TEMPLATE_NDBD = """[ndbd]
+hostname={hostname} # Hostname/IP of the data node
+NodeId={node_id}			# Node ID for this data node
+NodeGroup={node_group}		# Node group (partition) of this data node
 datadir=/opt/mysqlcluster/deploy/mysqld_data	# Remote directory for the data files
+"""
 
-[mysqld]
+TEMPLATE_MYSQLD = """[mysqld]
 # SQL node options:
-hostname={manager_hostname}
-"""
\ No newline at end of file
+hostname={hostname}
+NodeId={node_id}
+"""
+
+# default topology of the cluster : the data nodes form CLUSTER_DATA_NODES / CLUSTER_REPLICAS node groups,
+# the master is the first SQL node and the others are extra SQL front ends. The sakila tables are InnoDB tables
+# of the master, so the extra SQL nodes only serve NDBCLUSTER tables and the proxy reads all go through the master
+CLUSTER_DATA_NODES = 3
+CLUSTER_REPLICAS = 3
+CLUSTER_SQL_NODES = 1
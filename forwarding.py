@@ -0,0 +1,68 @@
+#!/usr/bin/python
+"""Helpers shared by the tiers that forward requests to the next hop."""
+
+# headers that only apply to a single connection and must not be forwarded (RFC 7230, section 6.1)
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'}
+
+# headers of an upstream response that no longer describe its body once `requests` decoded and buffered it
+BUFFERED_SKIPPED_HEADERS = {'content-encoding', 'content-length'}
+
+# size of the chunks relayed while streaming, bounds the memory used per request
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def end_to_end_headers(headers, skip=()):
+    """
+    Filters the hop-by-hop headers out of a list of headers.
+
+    Besides the standard ones, the headers named in the `Connection` header
+    are dropped too.
+
+    Args:
+        headers (iterable of tuples): (name, value) pairs.
+        skip (iterable of str): other header names to drop, in lower case.
+
+    Returns:
+        List of the (name, value) pairs to forward.
+    """
+    headers = list(headers)
+    dropped = HOP_BY_HOP_HEADERS.union(skip)
+    for key, value in headers:
+        if key.lower() == 'connection':
+            dropped = dropped.union(option.strip().lower() for option in value.split(','))
+    return [(key, value) for (key, value) in headers if key.lower() not in dropped]
+
+
+def with_query_string(url, query_string):
+    """
+    Appends the raw (still percent-encoded) query string of the incoming
+    request to the url of the next hop, so options such as ?format= or
+    ?max_staleness= reach the proxy.
+    """
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('latin-1')
+    return f"{url}?{query_string}" if query_string else url
+
+
+def allowed_headers(headers, allowed):
+    """
+    Keeps only the headers whose name is in `allowed` (lower case), used at
+    the edge so clients can't inject headers meant for the inner tiers.
+    """
+    return [(key, value) for (key, value) in headers if key.lower() in allowed]
+
+
+def stream_upstream(response, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Relays the body of a streamed `requests` response chunk by chunk.
+
+    The bytes are relayed as received (no decompression) so the upstream
+    `Content-Encoding` and `Content-Length` stay valid, and the upstream
+    connection is released once the body is consumed or the client goes away.
+    """
+    try:
+        for chunk in response.raw.stream(chunk_size, decode_content=False):
+            yield chunk
+    finally:
+        response.close()
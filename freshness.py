@@ -0,0 +1,162 @@
+#!/usr/bin/python
+"""
+Freshness of the backends, measured with a heartbeat table.
+
+The proxy writes its clock into a one-row NDB table on the master every
+`interval` seconds, and reads it back from every other backend on the same
+period. A backend that returned the heartbeat h holds every write committed
+before h, so at time t its data is at most t - h seconds stale. The value is
+written when the write starts, so the bound errs on the side of staleness.
+
+A backend that can't be read (its SQL node lost the data nodes, its tunnel
+is down) keeps its last heartbeat : its staleness keeps growing and it drops
+out of the bounded reads without a separate health check. The master
+receives the writes and is never stale.
+"""
+import threading
+import time
+
+HEARTBEAT_TABLE = 'proxy_heartbeat'
+
+
+class BackendFreshness:
+    """Latest heartbeat read from one backend."""
+
+    __slots__ = ("name", "heartbeat", "consecutive_failures", "last_poll", "last_error")
+
+    def __init__(self, name):
+        self.name = name
+        self.heartbeat = None
+        self.consecutive_failures = 0
+        self.last_poll = None
+        self.last_error = None
+
+    def as_dict(self, now):
+        return {
+            "heartbeat": self.heartbeat,
+            "staleness_s": now - self.heartbeat if self.heartbeat is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "last_poll": self.last_poll,
+            "last_error": self.last_error,
+        }
+
+
+class FreshnessTracker:
+    """
+    Writes the heartbeat on the master and polls it on the other backends,
+    each from its own daemon thread through its connection pool.
+
+    Args:
+        pools (dict): connection pool of each backend, by name.
+        master (str): name of the backend receiving the writes.
+        interval (float): seconds between two heartbeats, and between two polls of a backend.
+        table (str): heartbeat table, created on the master if needed.
+    """
+
+    def __init__(self, pools, master, interval=0.5, table=HEARTBEAT_TABLE):
+        self._pools = pools
+        self.master = master
+        self.interval = interval
+        self.table = table
+
+        self._states = {name: BackendFreshness(name) for name in pools if name != master}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.last_written = None
+        self.write_error = None
+
+    def start(self):
+        targets = [(self._run_writer, (), "heartbeat-writer")]
+        targets += [(self._run_poller, (name,), f"heartbeat-{name}") for name in self._states]
+        for target, args, thread_name in targets:
+            thread = threading.Thread(target=target, args=args, name=thread_name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def staleness(self, name):
+        """Upper bound of the staleness of a backend in seconds, None until its first heartbeat."""
+        if name == self.master:
+            return 0.0
+        heartbeat = self._states[name].heartbeat
+        return None if heartbeat is None else max(0.0, time.time() - heartbeat)
+
+    def is_fresh(self, name, max_staleness):
+        staleness = self.staleness(name)
+        return staleness is not None and staleness <= max_staleness
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            snapshot = {name: state.as_dict(now) for name, state in self._states.items()}
+        snapshot[self.master] = {"heartbeat": self.last_written, "staleness_s": 0.0, "last_error": self.write_error}
+        return snapshot
+
+    def create_table(self):
+        with self._pools[self.master].connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                               f"(id INT PRIMARY KEY, written_at DOUBLE NOT NULL) ENGINE=NDBCLUSTER")
+            connection.commit()
+
+    def write(self):
+        """Writes the current time as the heartbeat on the master."""
+        now = time.time()
+        with self._pools[self.master].connection() as connection:
+            with connection.cursor() as cursor:
+                # every proxy worker writes the same row, it only moves forward
+                cursor.execute(f"INSERT INTO {self.table} (id, written_at) VALUES (1, %s) "
+                               f"ON DUPLICATE KEY UPDATE written_at = GREATEST(written_at, VALUES(written_at))",
+                               (now,))
+            connection.commit()
+        self.last_written = now
+
+    def poll(self, name):
+        """Reads the heartbeat of a backend and records it."""
+        try:
+            with self._pools[name].connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT written_at FROM {self.table} WHERE id = 1")
+                    row = cursor.fetchone()
+            if row is None:
+                raise LookupError("No heartbeat yet")
+            heartbeat = float(row["written_at"] if isinstance(row, dict) else row[0])
+        except Exception as e:
+            with self._lock:
+                state = self._states[name]
+                state.consecutive_failures += 1
+                state.last_poll = time.time()
+                state.last_error = repr(e)
+            return
+        with self._lock:
+            state = self._states[name]
+            state.heartbeat = heartbeat if state.heartbeat is None else max(state.heartbeat, heartbeat)
+            state.consecutive_failures = 0
+            state.last_poll = time.time()
+            state.last_error = None
+
+    def _run_writer(self):
+        while not self._stop.is_set():
+            try:
+                self.create_table()
+                break
+            except Exception as e:
+                self.write_error = repr(e)
+                self._stop.wait(self.interval)
+        while not self._stop.is_set():
+            try:
+                self.write()
+                self.write_error = None
+            except Exception as e:
+                self.write_error = repr(e)
+            self._stop.wait(self.interval)
+
+    def _run_poller(self, name):
+        while not self._stop.is_set():
+            self.poll(name)
+            self._stop.wait(self.interval)
@@ -1,30 +1,168 @@
 #!/usr/bin/python
 import os
+import time
+from urllib.parse import quote
 
-from flask import Flask, request
+from flask import Flask, Response, g, request
 import requests
 
+from admission import AdaptiveConcurrencyLimit, AdmissionController, ClientRateLimiter
+from forwarding import BUFFERED_SKIPPED_HEADERS, allowed_headers, end_to_end_headers, stream_upstream, with_query_string
+from metrics import CONTENT_TYPE, HttpMetrics, Registry, instrument_flask, route_label
+import tracing
+
 app = Flask(__name__)
 
 # Get the trusted host's private IP from an environment variable
 TRUSTED_HOST_PRIVATE_IP = os.getenv('INSTANCE_PRIVATE_IP_TRUSTEDHOST_IP')  # Replace 'default_private_ip' with a default or error handling
-TRUSTED_HOST_PRIVATE_URL = f"http://{TRUSTED_HOST_PRIVATE_IP}:80"
+TRUSTED_HOST_PRIVATE_URL = os.getenv('GATEKEEPER_UPSTREAM_URL', f"http://{TRUSTED_HOST_PRIVATE_IP}:80")
+# port the gatekeeper listens on
+PORT = int(os.getenv('GATEKEEPER_PORT', '80'))
 
-@app.route('/<path>/<sql>', methods=['GET', 'POST', 'PUT', 'DELETE'])
-def forward_request(path,sql):
+# forwarding engine : 'sync' (flask + requests) or 'async' (aiohttp, see gatekeeper_async.py)
+GATEKEEPER_MODE = os.getenv('GATEKEEPER_MODE', 'sync')
+# size of the keep-alive connection pool to the trusted host
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('GATEKEEPER_UPSTREAM_MAX_CONNECTIONS', '100'))
+# maximum number of requests forwarded at the same time in async mode, the others wait for a slot
+MAX_CONCURRENCY = int(os.getenv('GATEKEEPER_MAX_CONCURRENCY', '1000'))
+# timeouts (seconds) to connect to the trusted host and to receive its whole response
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('GATEKEEPER_UPSTREAM_CONNECT_TIMEOUT', '3'))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('GATEKEEPER_UPSTREAM_READ_TIMEOUT', '30'))
+# relay the trusted host's response as it arrives instead of buffering it whole
+STREAM_RESPONSES = os.getenv('GATEKEEPER_STREAM_RESPONSES', '1') == '1'
+# fraction of the requests whose trace is logged by every tier
+TRACE_SAMPLE_RATE = float(os.getenv('GATEKEEPER_TRACE_SAMPLE_RATE', '0'))
+
+# admission control, see admission.py : requests per second and burst allowed to each client
+# (0 disables the per-client limit), and bounds of the adaptive limit of requests in progress (0 disables it)
+CLIENT_RATE = float(os.getenv('GATEKEEPER_CLIENT_RATE', '0'))
+CLIENT_BURST = float(os.getenv('GATEKEEPER_CLIENT_BURST', '50'))
+CONCURRENCY_LIMIT_INITIAL = int(os.getenv('GATEKEEPER_CONCURRENCY_LIMIT_INITIAL', '100'))
+CONCURRENCY_LIMIT_MIN = int(os.getenv('GATEKEEPER_CONCURRENCY_LIMIT_MIN', '10'))
+CONCURRENCY_LIMIT_MAX = int(os.getenv('GATEKEEPER_CONCURRENCY_LIMIT_MAX', str(MAX_CONCURRENCY)))
+# paths never rejected
+ADMISSION_EXEMPT_PATHS = {'/metrics'}
+
+# client headers forwarded to the trusted host, the others are dropped (the tracing ones are set by the gatekeeper)
+FORWARDED_HEADERS = {'accept', 'accept-encoding', 'content-type', 'user-agent', 'x-session-id', 'x-max-staleness'}
+
+# the session keeps the connections to the trusted host alive between requests
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1,
+                                                       pool_maxsize=UPSTREAM_MAX_CONNECTIONS))
+
+
+# forwards the current request, query string included, to a url of the trusted host and relays its response
+def forward(url):
     try:
+        url = with_query_string(url, request.query_string)
         method = request.method
         data = request.get_data()
-        headers = {key: value for (key, value) in request.headers if key != 'Host'}
-
-        url = f"{TRUSTED_HOST_PRIVATE_URL}/{path}/{sql}"
+        headers = dict(allowed_headers(request.headers.items(), FORWARDED_HEADERS))
+        headers.update(g.trace.outgoing_headers())
 
-        response = requests.request(method, url, headers=headers, data=data, allow_redirects=False)
+        # until the response headers (or the whole body when not streaming) are received
+        upstream_start = time.perf_counter()
+        response = session.request(method, url, headers=headers, data=data, allow_redirects=False,
+                                   timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT),
+                                   stream=STREAM_RESPONSES)
+        elapsed = time.perf_counter() - upstream_start
+        phase_latency.observe(elapsed, route=route_label(request.path), backend='trustedhost', phase='upstream')
+        g.trace.add('forward', elapsed)
 
-        return (response.content, response.status_code, response.headers.items())
+        if STREAM_RESPONSES:
+            return Response(stream_upstream(response), response.status_code,
+                            end_to_end_headers(response.headers.items()))
+        # the buffered body is decoded, its encoding and length no longer apply
+        return (response.content, response.status_code,
+                end_to_end_headers(response.headers.items(), skip=BUFFERED_SKIPPED_HEADERS))
     except requests.RequestException as e:
         print(f"Erreur lors de la transmission de la requête : {e}")
         return "Internal Server Error", 500
 
+admission = AdmissionController(
+    ClientRateLimiter(CLIENT_RATE, CLIENT_BURST) if CLIENT_RATE > 0 else None,
+    AdaptiveConcurrencyLimit(CONCURRENCY_LIMIT_INITIAL, CONCURRENCY_LIMIT_MIN, CONCURRENCY_LIMIT_MAX)
+    if CONCURRENCY_LIMIT_MAX > 0 else None)
+
+# request and upstream timings, exported on /metrics
+registry = Registry()
+http_metrics = HttpMetrics(registry, 'gatekeeper')
+phase_latency = registry.histogram('gatekeeper_phase_duration_seconds',
+                                   'Time spent in each phase of a request.', ('route', 'backend', 'phase'))
+instrument_flask(app, http_metrics, lambda: route_label(request.path))
+# request IDs and Server-Timing breakdown, see tracing.py
+tracing.instrument_flask(app, 'gatekeeper', lambda: route_label(request.path), edge=True,
+                         sample_rate=TRACE_SAMPLE_RATE)
+
+admission_rejections = registry.counter('gatekeeper_admission_rejected_total',
+                                        'Requests rejected by the admission control.', ('reason',))
+
+
+def collect_admission_metrics():
+    state = admission.snapshot()
+    if not state:
+        return []
+    return [('gauge', 'gatekeeper_concurrency_limit', 'Current adaptive limit of requests in progress.', (),
+             [({}, state["limit"])]),
+            ('gauge', 'gatekeeper_admitted_in_flight', 'Admitted requests in progress.', (),
+             [({}, state["in_flight"])])]
+
+
+registry.add_collector(collect_admission_metrics)
+
+
+@app.before_request
+def admit_request():
+    if request.path in ADMISSION_EXEMPT_PATHS:
+        return None
+    rejection = admission.admit(request.remote_addr)
+    if rejection is not None:
+        admission_rejections.inc(reason=rejection.reason)
+        return Response("Too Many Requests" if rejection.status == 429 else "Service Unavailable",
+                        rejection.status, rejection.headers())
+    g.admitted_at = time.perf_counter()
+
+
+@app.after_request
+def release_admission(response):
+    # the slot is held until the body is sent, a streamed response included, so the limit counts the
+    # transfers in progress and its latency samples cover them
+    if 'admitted_at' in g:
+        admitted_at = g.pop('admitted_at')
+        failed = response.status_code >= 500
+        response.call_on_close(lambda: admission.release(time.perf_counter() - admitted_at, failed=failed))
+    return response
+
+
+@app.teardown_request
+def release_failed_admission(error):
+    # after_request is skipped when the view raised an unhandled exception
+    if 'admitted_at' in g:
+        admission.release(time.perf_counter() - g.pop('admitted_at'), failed=True)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/<path>/<sql>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def forward_request(path,sql):
+    # the statement was decoded by the routing, quoted again so that ?, # and % reach the trusted host as part of it
+    return forward(f"{TRUSTED_HOST_PRIVATE_URL}/{path}/{quote(sql, safe='')}")
+
+@app.route('/batch', methods=['POST'])
+def forward_batch():
+    # the statements travel in the json body, see batch.py
+    return forward(f"{TRUSTED_HOST_PRIVATE_URL}/batch")
+
+@app.route('/query/<path>', methods=['POST'])
+def forward_query(path):
+    # parameterized query, the template and its values travel in the json body, see parameterized.py
+    return forward(f"{TRUSTED_HOST_PRIVATE_URL}/query/{path}")
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80)
\ No newline at end of file
+    if GATEKEEPER_MODE == 'async':
+        import gatekeeper_async
+        gatekeeper_async.run(host='0.0.0.0', port=PORT)
+    else:
+        app.run(host='0.0.0.0', port=PORT, threaded=True)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+import asyncio
+import time
+from urllib.parse import quote
+
+import aiohttp
+from aiohttp import web
+
+from forwarding import STREAM_CHUNK_SIZE, allowed_headers, end_to_end_headers, with_query_string
+from gatekeeper_app import (TRUSTED_HOST_PRIVATE_URL, UPSTREAM_MAX_CONNECTIONS, MAX_CONCURRENCY,
+                            UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT, STREAM_RESPONSES,
+                            TRACE_SAMPLE_RATE, FORWARDED_HEADERS, ADMISSION_EXEMPT_PATHS, registry, http_metrics,
+                            phase_latency, admission, admission_rejections)
+from metrics import CONTENT_TYPE, route_label
+from tracing import start_trace
+
+# pending connections the listening socket accepts before refusing new clients
+LISTEN_BACKLOG = 4096
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    # same request metrics as the flask mode
+    route = route_label(request.path)
+    start = http_metrics.start(route)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        http_metrics.finish(route, status, start)
+
+
+@web.middleware
+async def tracing_middleware(request, handler):
+    # same request ID and Server-Timing headers as the flask mode, see tracing.py
+    trace = request['trace'] = start_trace('gatekeeper', request.headers, edge=True,
+                                           sample_rate=TRACE_SAMPLE_RATE)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        if not response.prepared:
+            # streamed responses got their headers in forward(), before being sent
+            trace.apply(response.headers)
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        trace.apply(e.headers)
+        raise
+    finally:
+        trace.log(route_label(request.path), status)
+
+
+@web.middleware
+async def admission_middleware(request, handler):
+    # same admission control as the flask mode, rejections are answered before any queueing
+    if request.path in ADMISSION_EXEMPT_PATHS:
+        return await handler(request)
+    rejection = admission.admit(request.remote)
+    if rejection is not None:
+        admission_rejections.inc(reason=rejection.reason)
+        return web.Response(status=rejection.status, headers=rejection.headers(),
+                            text="Too Many Requests" if rejection.status == 429 else "Service Unavailable")
+    admitted_at = time.perf_counter()
+    failed = True
+    try:
+        response = await handler(request)
+        failed = response.status >= 500
+        return response
+    finally:
+        admission.release(time.perf_counter() - admitted_at, failed)
+
+
+async def metrics_endpoint(request):
+    return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def forward_request(request):
+    path = request.match_info['path']
+    # the statement is decoded in match_info, quoted again like the flask forwarding does
+    sql = quote(request.match_info['sql'], safe='')
+    return await forward(request, f"{TRUSTED_HOST_PRIVATE_URL}/{path}/{sql}")
+
+
+async def forward_batch(request):
+    # the statements travel in the json body, see batch.py
+    return await forward(request, f"{TRUSTED_HOST_PRIVATE_URL}/batch")
+
+
+async def forward_query(request):
+    # parameterized query, the template and its values travel in the json body, see parameterized.py
+    path = request.match_info['path']
+    return await forward(request, f"{TRUSTED_HOST_PRIVATE_URL}/query/{path}")
+
+
+async def forward(request, url):
+    """
+    Forwards a request, query string included, to a url of the trusted host through the shared keep-alive pool.
+
+    The upstream body is relayed untouched (no decompression) along with its
+    status code and end-to-end headers, like the flask forwarding does. In
+    streaming mode it is written to the client chunk by chunk as it arrives.
+    """
+    trace = request['trace']
+    url = with_query_string(url, request.rel_url.raw_query_string)
+    data = await request.read()
+    headers = dict(allowed_headers(request.headers.items(), FORWARDED_HEADERS))
+    headers.update(trace.outgoing_headers())
+
+    client_response = None
+    try:
+        queue_start = time.perf_counter()
+        async with request.app['concurrency']:
+            upstream_start = time.perf_counter()
+            trace.add('queue', upstream_start - queue_start)
+            async with request.app['session'].request(request.method, url, headers=headers, data=data,
+                                                      allow_redirects=False) as response:
+                elapsed = time.perf_counter() - upstream_start
+                phase_latency.observe(elapsed, route=route_label(request.path),
+                                      backend='trustedhost', phase='upstream')
+                trace.add('forward', elapsed)
+                response_headers = end_to_end_headers(response.headers.items())
+                if not STREAM_RESPONSES:
+                    body = await response.read()
+                    # aiohttp computes the length of the buffered body itself
+                    response_headers = [(key, value) for (key, value) in response_headers
+                                        if key.lower() != 'content-length']
+                    return web.Response(body=body, status=response.status, headers=response_headers)
+
+                client_response = web.StreamResponse(status=response.status, headers=response_headers)
+                trace.apply(client_response.headers)
+                await client_response.prepare(request)
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    await client_response.write(chunk)
+                await client_response.write_eof()
+                return client_response
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Erreur lors de la transmission de la requête : {e}")
+        if client_response is not None and client_response.prepared:
+            # the status line is already sent, drop the connection to signal the truncated body
+            raise
+        return web.Response(status=500, text="Internal Server Error")
+
+
+async def open_upstream(app):
+    # the connector is the bounded keep-alive pool to the trusted host
+    connector = aiohttp.TCPConnector(limit=UPSTREAM_MAX_CONNECTIONS, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=UPSTREAM_READ_TIMEOUT, sock_connect=UPSTREAM_CONNECT_TIMEOUT)
+    app['session'] = aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False)
+    app['concurrency'] = asyncio.Semaphore(MAX_CONCURRENCY)
+
+
+async def close_upstream(app):
+    await app['session'].close()
+
+
+def create_app():
+    app = web.Application(middlewares=[metrics_middleware, tracing_middleware, admission_middleware])
+    app.on_startup.append(open_upstream)
+    app.on_cleanup.append(close_upstream)
+    # routes are matched in order, /query/{path} has to come before the generic one
+    app.router.add_route('POST', '/query/{path}', forward_query)
+    for method in ['GET', 'POST', 'PUT', 'DELETE']:
+        app.router.add_route(method, '/{path}/{sql}', forward_request)
+    app.router.add_route('POST', '/batch', forward_batch)
+    app.router.add_route('GET', '/metrics', metrics_endpoint)
+    return app
+
+
+def run(host, port):
+    web.run_app(create_app(), host=host, port=port, backlog=LISTEN_BACKLOG)
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+import threading
+import time
+
+from backend_health import is_connection_error
+
+
+class BackendLatency:
+    """Latency and health state of one backend, as seen by the prober."""
+
+    __slots__ = ("name", "latency_ms", "healthy", "consecutive_failures", "last_probe", "last_error")
+
+    def __init__(self, name):
+        self.name = name
+        self.latency_ms = None
+        self.healthy = False
+        self.consecutive_failures = 0
+        self.last_probe = None
+        self.last_error = None
+
+    def as_dict(self):
+        return {
+            "latency_ms": self.latency_ms,
+            "healthy": self.healthy,
+            "consecutive_failures": self.consecutive_failures,
+            "last_probe": self.last_probe,
+            "last_error": self.last_error,
+        }
+
+
+class LatencyProber:
+    """
+    Keeps an EWMA of the `SELECT 1` round trip of every backend pool.
+
+    Each backend is probed from its own daemon thread through its connection
+    pool, so the measured latency includes the SSH tunnel hop the queries take.
+    After every probe the fastest healthy backend is recomputed, which lets
+    `fastest()` answer in constant time from the request path. Backends are
+    passed in preference order: on a tie the earliest one wins, and the first
+    one is returned when no backend is healthy. `on_probe(name, error)`,
+    when given, is called after every probe with its error, None on success.
+
+    Only the errors for which `is_failure` is true count against a backend :
+    a probe that waited more than `checkout_timeout` seconds for a connection
+    of a busy pool is skipped, the backend being loaded rather than down.
+    """
+
+    def __init__(self, pools, interval=1.0, alpha=0.3, failure_threshold=3, on_probe=None, checkout_timeout=None,
+                 is_failure=is_connection_error):
+        self._pools = pools
+        self._on_probe = on_probe
+        self.interval = interval
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.checkout_timeout = checkout_timeout
+        self._is_failure = is_failure
+
+        self._order = list(pools)
+        self._states = {name: BackendLatency(name) for name in self._order}
+        self._fastest = self._order[0]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for name in self._order:
+            thread = threading.Thread(target=self._run, args=(name,), name=f"prober-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def fastest(self):
+        """Name of the healthy backend with the lowest EWMA latency."""
+        return self._fastest
+
+    def is_healthy(self, name):
+        return self._states[name].healthy
+
+    def latency_ms(self, name):
+        """EWMA latency of a backend, None until its first successful probe."""
+        return self._states[name].latency_ms
+
+    def snapshot(self):
+        with self._lock:
+            return {name: state.as_dict() for name, state in self._states.items()}
+
+    def probe(self, name):
+        """Runs one `SELECT 1` probe against a backend and records the result."""
+        start = time.perf_counter()
+        try:
+            with self._pools[name].connection(timeout=self.checkout_timeout) as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchall()
+        except Exception as e:
+            if self._is_failure(e):
+                self._record_failure(name, e)
+            else:
+                self._record_skipped(name, e)
+            if self._on_probe is not None:
+                self._on_probe(name, e)
+            return
+        self._record_success(name, (time.perf_counter() - start) * 1000)
+        if self._on_probe is not None:
+            self._on_probe(name, None)
+
+    def _run(self, name):
+        while not self._stop.is_set():
+            self.probe(name)
+            self._stop.wait(self.interval)
+
+    def _record_success(self, name, rtt_ms):
+        with self._lock:
+            state = self._states[name]
+            if state.latency_ms is None:
+                state.latency_ms = rtt_ms
+            else:
+                state.latency_ms += self.alpha * (rtt_ms - state.latency_ms)
+            state.healthy = True
+            state.consecutive_failures = 0
+            state.last_probe = time.time()
+            state.last_error = None
+            self._update_fastest()
+
+    def _record_failure(self, name, error):
+        with self._lock:
+            state = self._states[name]
+            state.consecutive_failures += 1
+            if state.consecutive_failures >= self.failure_threshold:
+                state.healthy = False
+            state.last_probe = time.time()
+            state.last_error = str(error)
+            self._update_fastest()
+
+    def _record_skipped(self, name, error):
+        # the probe couldn't tell whether the backend is up, its state is kept
+        with self._lock:
+            state = self._states[name]
+            state.last_probe = time.time()
+            state.last_error = str(error)
+
+    def _update_fastest(self):
+        fastest = self._order[0]
+        fastest_latency = None
+        for name in self._order:
+            state = self._states[name]
+            if not state.healthy:
+                continue
+            if fastest_latency is None or state.latency_ms < fastest_latency:
+                fastest, fastest_latency = name, state.latency_ms
+        self._fastest = fastest
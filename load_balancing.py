@@ -0,0 +1,166 @@
+#!/usr/bin/python
+import random
+import threading
+from contextlib import contextmanager
+
+
+class InFlightTracker:
+    """Counts the requests in progress on each backend."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, name):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._counts[name] -= 1
+
+    def count(self, name):
+        return self._counts.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class Strategy:
+    """
+    Backend selection strategy.
+
+    `select` receives the names of the candidate backends, in preference
+    order, and returns the one to send the query to.
+    """
+
+    name = None
+
+    def select(self, candidates):
+        raise NotImplementedError
+
+
+class RandomStrategy(Strategy):
+    name = 'random'
+
+    def select(self, candidates):
+        return random.choice(candidates)
+
+
+class FastestStrategy(Strategy):
+    """Lowest EWMA latency measured by the prober, the first candidate on ties or without data."""
+
+    name = 'fastest'
+
+    def __init__(self, prober):
+        self._prober = prober
+
+    def select(self, candidates):
+        fastest = self._prober.fastest()
+        if fastest in candidates:
+            return fastest
+        best, best_latency = candidates[0], None
+        for name in candidates:
+            latency = self._prober.latency_ms(name)
+            if latency is not None and (best_latency is None or latency < best_latency):
+                best, best_latency = name, latency
+        return best
+
+
+class LeastOutstandingStrategy(Strategy):
+    """Backend with the fewest requests in flight, the first candidate on ties."""
+
+    name = 'least_outstanding'
+
+    def __init__(self, tracker):
+        self._tracker = tracker
+
+    def select(self, candidates):
+        return min(candidates, key=self._tracker.count)
+
+
+class PowerOfTwoChoicesStrategy(Strategy):
+    """Least loaded of two backends picked at random, avoids herding on the same idle backend."""
+
+    name = 'power_of_two'
+
+    def __init__(self, tracker):
+        self._tracker = tracker
+
+    def select(self, candidates):
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if self._tracker.count(first) <= self._tracker.count(second) else second
+
+
+class WeightedRoundRobinStrategy(Strategy):
+    """
+    Smooth weighted round robin : over a cycle each backend is chosen
+    proportionally to its weight, without sending bursts to the heaviest one.
+    Backends without a configured weight weigh 1.
+    """
+
+    name = 'weighted_round_robin'
+
+    def __init__(self, weights):
+        self._weights = dict(weights)
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def select(self, candidates):
+        with self._lock:
+            total = 0
+            best = None
+            for name in candidates:
+                weight = self._weights.get(name, 1)
+                self._current[name] = self._current.get(name, 0) + weight
+                total += weight
+                if best is None or self._current[name] > self._current[best]:
+                    best = name
+            self._current[best] -= total
+            return best
+
+
+class LatencyWeightedStrategy(Strategy):
+    """
+    Random choice weighted by the inverse of the EWMA latency, so faster
+    backends get proportionally more traffic while slower ones keep enough
+    to be measured. Backends without a measure get the average weight.
+    """
+
+    name = 'latency_weighted'
+
+    def __init__(self, prober):
+        self._prober = prober
+
+    def select(self, candidates):
+        weights = []
+        for name in candidates:
+            latency = self._prober.latency_ms(name)
+            weights.append(1.0 / max(latency, 0.001) if latency is not None else None)
+        known = [weight for weight in weights if weight is not None]
+        default = sum(known) / len(known) if known else 1.0
+        weights = [default if weight is None else weight for weight in weights]
+        return random.choices(candidates, weights=weights)[0]
+
+
+def create_strategies(tracker, prober, weights):
+    """
+    Builds one instance of every built-in strategy.
+
+    Returns:
+        Dict strategy name -> strategy.
+    """
+    strategies = [
+        RandomStrategy(),
+        FastestStrategy(prober),
+        LeastOutstandingStrategy(tracker),
+        PowerOfTwoChoicesStrategy(tracker),
+        WeightedRoundRobinStrategy(weights),
+        LatencyWeightedStrategy(prober),
+    ]
+    return {strategy.name: strategy for strategy in strategies}
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+"""
+Minimal Prometheus instrumentation shared by the three apps.
+
+Metrics are kept in process and rendered in the Prometheus text format by
+`Registry.render`. Histograms use fixed buckets, so recording a value is a
+binary search and a few additions under a lock.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# latency buckets (seconds), from sub-millisecond forwarding to multi-second queries
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# routes used as label values, any other path is reported as 'other' to bound the number of series
+ROUTES = ('normal', 'random', 'custom', 'auto', 'batch', 'query', 'metrics')
+
+
+def route_label(path):
+    """Route label of a request path, from its first segment."""
+    segment = path.strip('/').split('/', 1)[0]
+    return segment if segment in ROUTES else 'other'
+
+
+def _format_labels(label_names, label_values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}']
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per bucket counts (not cumulative, the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {count}')
+        return lines
+
+
+class Registry:
+    """
+    Set of metrics rendered together.
+
+    Collectors are callables run at render time, for values such as pool
+    occupancy that are cheaper to read on scrape than to keep up to date.
+    They return a list of (type, name, documentation, label names, samples)
+    tuples, samples being a list of (labels dict, value).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for metric_type, name, documentation, label_names, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    label_values = [labels[label] for label in label_names]
+                    lines.append(f'{name}{_format_labels(label_names, label_values)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class HttpMetrics:
+    """
+    Request count, errors, in-flight and latency metrics of an http app,
+    labelled by route (and status code for the counts).
+    """
+
+    def __init__(self, registry, prefix):
+        self.requests = registry.counter(f'{prefix}_requests_total', 'Requests handled.', ('route', 'status'))
+        self.errors = registry.counter(f'{prefix}_request_errors_total',
+                                       'Requests answered with a 5xx status.', ('route',))
+        self.in_flight = registry.gauge(f'{prefix}_requests_in_flight', 'Requests being handled.', ('route',))
+        self.latency = registry.histogram(f'{prefix}_request_duration_seconds',
+                                          'Time to produce the response (excluding streamed bodies).', ('route',))
+
+    def start(self, route):
+        self.in_flight.inc(route=route)
+        return time.perf_counter()
+
+    def finish(self, route, status, start):
+        self.in_flight.dec(route=route)
+        self.latency.observe(time.perf_counter() - start, route=route)
+        self.requests.inc(route=route, status=status)
+        if status >= 500:
+            self.errors.inc(route=route)
+
+
+def instrument_flask(app, http_metrics, route_label):
+    """
+    Records the `HttpMetrics` of every request of a flask app.
+
+    Args:
+        app (Flask): the application.
+        http_metrics (HttpMetrics): metrics to record.
+        route_label (callable): returns the route label of the current request.
+    """
+    from flask import g
+
+    @app.before_request
+    def start_timer():
+        g.metrics_route = route_label()
+        g.metrics_start = http_metrics.start(g.metrics_route)
+
+    @app.after_request
+    def record_response(response):
+        if 'metrics_start' in g:
+            http_metrics.finish(g.metrics_route, response.status_code, g.pop('metrics_start'))
+        return response
+
+    @app.teardown_request
+    def record_failure(error):
+        # after_request is skipped when the view raised an unhandled exception
+        if 'metrics_start' in g:
+            http_metrics.finish(g.metrics_route, 500, g.pop('metrics_start'))
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""
+Format of the parameterized queries accepted by the POST /query/<route> endpoints.
+
+The body is a json object :
+    {"sql": "SELECT * FROM actor WHERE actor_id = ?", "params": [42]}
+The statement is a template with `?` placeholders, the values are sent
+apart as a list of strings, numbers, booleans or nulls. The trusted host
+validates the template, not the values, and the proxy runs it as a server
+side prepared statement (see prepared_statements.py), so a template is
+checked and parsed once however many values it is sent with.
+"""
+import json
+from functools import lru_cache
+
+from sql_validator import InvalidSql, tokenize
+
+PLACEHOLDER = '?'
+
+# values accepted in a single query
+MAX_PARAMS = 1000
+
+
+class InvalidQuery(ValueError):
+    """Raised when a parameterized query body doesn't follow the expected format."""
+
+
+@lru_cache(maxsize=4096)
+def placeholder_count(sql):
+    """Number of `?` placeholders of a template, None when it can't be tokenized."""
+    try:
+        return sum(1 for kind, text in tokenize(sql) if kind == 'punct' and text == PLACEHOLDER)
+    except InvalidSql:
+        return None
+
+
+def parse_query(body):
+    """
+    Parses and checks the shape of a parameterized query body.
+
+    Args:
+        body (bytes or str): json request body.
+
+    Returns:
+        Tuple (sql, params), params being a tuple of values.
+    """
+    try:
+        query = json.loads(body)
+    except ValueError as e:
+        raise InvalidQuery(f"Invalid json body: {e}")
+    if not isinstance(query, dict) or not isinstance(query.get('sql'), str):
+        raise InvalidQuery("The body must be a json object with a 'sql' string")
+
+    sql = query['sql']
+    params = query.get('params', [])
+    if not isinstance(params, list):
+        raise InvalidQuery("'params' must be a list")
+    if len(params) > MAX_PARAMS:
+        raise InvalidQuery(f"Too many params ({len(params)} > {MAX_PARAMS})")
+    for idx, value in enumerate(params):
+        if value is not None and not isinstance(value, (str, int, float, bool)):
+            raise InvalidQuery(f"Param {idx} must be a string, a number, a boolean or null")
+
+    expected = placeholder_count(sql)
+    if expected is not None and expected != len(params):
+        raise InvalidQuery(f"The statement has {expected} placeholders but {len(params)} params were given")
+    return sql, tuple(params)
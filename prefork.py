@@ -0,0 +1,361 @@
+#!/usr/bin/python
+"""
+Pre-forking launcher for the flask apps.
+
+    python3 prefork.py gatekeeper_app:app --port 80 --workers 4 --threads 16
+
+The master process never imports the app : it forks the workers, and each
+worker binds its own listening socket with SO_REUSEPORT (the kernel spreads
+the connections over them), then imports the app. Everything an app creates
+at import time (connection pools, ssh tunnels, background threads) therefore
+belongs to a single worker. Each worker serves its requests with a bounded
+pool of threads and only accepts a connection when one of them is free, the
+others wait in the backlog of its socket. The werkzeug server closes every
+connection after its response (werkzeug doesn't support keep-alive), so a
+thread is only held by a request in progress.
+
+Signals of the master :
+    SIGHUP           graceful restart, a new generation of workers is started
+                     (importing the app code again) and the old one is stopped
+                     once every new worker is ready
+    SIGTERM, SIGINT  graceful stop, the workers finish their requests in
+                     progress, for at most --graceful-timeout seconds
+
+A worker that served --max-requests requests (plus a random jitter, so they
+don't all recycle together) asks to be replaced : the master starts its
+replacement and stops it once the replacement is ready. A worker that dies
+is restarted.
+
+The workers share nothing : an app whose correctness depends on state kept
+in its process has to run with --workers 1 (and more --threads). That is
+the case of the proxy, whose result cache is only invalidated by the writes
+of its own process, and whose sticky sessions, request coalescing and
+prepared statements only see its own requests.
+
+The connections still waiting in the queue of a socket when its worker stops
+are reset, unless the kernel moves them to the other sockets of the port
+(net.ipv4.tcp_migrate_req=1, linux 5.14 and later).
+"""
+import argparse
+import importlib
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# messages of a worker to the master, on its status pipe
+READY = b'r'
+RETIRE = b'x'
+
+# exit code of a worker that couldn't bind its socket or import the app, the master doesn't restart it
+BOOT_ERROR = 3
+
+# seconds a thread waits for a client that stopped sending its request, so that a silent connection can't hold
+# a thread, nor delay a graceful stop, forever
+CLIENT_TIMEOUT = 30.0
+
+
+def load_target(target):
+    # 'module:attribute' -> the wsgi application
+    module_name, _, attribute = target.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+
+def create_listener(host, port, backlog):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def create_server(host, port, app, sock, threads, access_log=False, on_request=None):
+    """
+    WSGI server of a worker, serving `app` on an already listening socket
+    with `threads` threads.
+
+    Args:
+        on_request (callable): called after each request.
+    """
+    # werkzeug comes with flask, it is only needed by the workers
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class RequestHandler(WSGIRequestHandler):
+        # chunked transfer of the streamed responses
+        protocol_version = 'HTTP/1.1'
+        timeout = CLIENT_TIMEOUT
+
+        def handle_one_request(self):
+            super().handle_one_request()
+            if on_request is not None and self.raw_requestline:
+                on_request()
+
+        def log_request(self, code='-', size='-'):
+            if access_log:
+                super().log_request(code, size)
+
+    class PooledWSGIServer(BaseWSGIServer):
+        multithread = True
+
+        def __init__(self):
+            super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+            self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+            # one per thread, so that no connection waits in the executor queue
+            self.slots = threading.BoundedSemaphore(threads)
+
+        def get_request(self):
+            # a busy worker stops accepting, the connections wait in the kernel backlog instead
+            self.slots.acquire()
+            try:
+                return super().get_request()
+            except BaseException:
+                self.slots.release()
+                raise
+
+        def process_request(self, request, client_address):
+            try:
+                self.executor.submit(self._process, request, client_address)
+            except BaseException:
+                self.slots.release()
+                raise
+
+        def _process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.slots.release()
+
+    return PooledWSGIServer()
+
+
+class Arbiter:
+    """
+    Master process : starts, restarts and stops the workers.
+
+    Args:
+        target (str): app to serve, as 'module:attribute'.
+        host (str), port (int): address every worker listens on.
+        workers (int): number of worker processes.
+        threads (int): request threads of each worker.
+        max_requests (int): requests after which a worker is replaced, 0 to never replace them.
+        max_requests_jitter (int): random extra requests added to max_requests for each worker.
+        graceful_timeout (float): seconds a stopping worker has to finish its requests before being killed.
+        backlog (int): listen backlog of each worker socket.
+        access_log (bool): log every request.
+    """
+
+    def __init__(self, target, host, port, workers, threads=8, max_requests=0, max_requests_jitter=0,
+                 graceful_timeout=30.0, backlog=1024, access_log=False):
+        self.target = target
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.access_log = access_log
+
+        # pid -> status pipe of the workers serving or booting
+        self.workers = {}
+        # pid -> replaced pids : the workers starting in place of others, stopped once the new one is ready
+        self.replacements = {}
+        # pid -> time at which the worker was asked to stop
+        self.stopping = {}
+        self._signals = []
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        print(f"[prefork] master {os.getpid()} serving {self.target} on {self.host}:{self.port} "
+              f"with {self.worker_count} workers of {self.threads} threads", flush=True)
+        for _ in range(self.worker_count):
+            self.spawn()
+
+        while True:
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                else:
+                    return self.stop()
+            self.read_status()
+            if self.reap():
+                return self.stop(exit_code=1)
+            self.kill_overdue()
+
+    def spawn(self, replaces=()):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for fd in self.workers.values():
+                os.close(fd)
+            self.run_worker(write_fd)
+        os.close(write_fd)
+        self.workers[pid] = read_fd
+        if replaces:
+            self.replacements[pid] = tuple(replaces)
+        return pid
+
+    def reload(self):
+        # the current workers are replaced by new ones, importing the app again
+        print(f"[prefork] reloading {len(self.serving())} workers", flush=True)
+        old = self.serving()
+        for idx in range(self.worker_count):
+            self.spawn(old[idx::self.worker_count])
+
+    def serving(self):
+        replaced = {pid for pids in self.replacements.values() for pid in pids}
+        return [pid for pid in self.workers if pid not in self.stopping and pid not in replaced]
+
+    def read_status(self):
+        fds = {fd: pid for pid, fd in self.workers.items()}
+        try:
+            readable, _, _ = select.select(list(fds), [], [], 0.5)
+        except InterruptedError:
+            return
+        for fd in readable:
+            pid = fds[fd]
+            message = os.read(fd, 1)
+            if message == READY:
+                for replaced in self.replacements.pop(pid, ()):
+                    self.terminate(replaced)
+            elif message == RETIRE and pid not in self.stopping:
+                self.spawn(replaces=(pid,))
+
+    def reap(self):
+        """Forgets the workers that exited and restarts them. Returns True when a worker failed to boot."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return False
+            if pid == 0:
+                return False
+            fd = self.workers.pop(pid, None)
+            if fd is None:
+                continue
+            os.close(fd)
+            expected = self.stopping.pop(pid, None) is not None
+            replacing = pid in self.replacements
+            replaced = self.replacements.pop(pid, ())
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == BOOT_ERROR:
+                print(f"[prefork] worker {pid} failed to boot", flush=True)
+                if replacing:
+                    # a reload with a broken app : the previous workers keep serving
+                    continue
+                return True
+            if not expected:
+                print(f"[prefork] worker {pid} exited unexpectedly ({status}), restarting it", flush=True)
+                self.spawn(replaced)
+
+    def terminate(self, pid):
+        if pid in self.workers and pid not in self.stopping:
+            self.stopping[pid] = time.monotonic()
+            os.kill(pid, signal.SIGTERM)
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, since in list(self.stopping.items()):
+            if now - since > self.graceful_timeout:
+                print(f"[prefork] worker {pid} didn't stop in time, killing it", flush=True)
+                os.kill(pid, signal.SIGKILL)
+                self.stopping[pid] = float('inf')
+
+    def stop(self, exit_code=0):
+        print(f"[prefork] stopping {len(self.workers)} workers", flush=True)
+        self.replacements.clear()
+        for pid in list(self.workers):
+            self.terminate(pid)
+        while self.workers:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.1)
+        return exit_code
+
+    def run_worker(self, status_fd):
+        # in the forked worker : never returns
+        exit_code = 0
+        try:
+            for signum in (signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            random.seed()
+            try:
+                sock = create_listener(self.host, self.port, self.backlog)
+                app = load_target(self.target)
+            except Exception as e:
+                print(f"[prefork] worker {os.getpid()} : {e!r}", file=sys.stderr, flush=True)
+                os._exit(BOOT_ERROR)
+
+            limit = self.max_requests + random.randint(0, self.max_requests_jitter) if self.max_requests else 0
+            served = [0]
+            lock = threading.Lock()
+
+            def on_request():
+                with lock:
+                    served[0] += 1
+                    if served[0] == limit:
+                        os.write(status_fd, RETIRE)
+
+            server = create_server(self.host, self.port, app, sock, self.threads, self.access_log,
+                                   on_request if limit else None)
+            sock.close()
+
+            def shutdown(signum, frame):
+                # serve_forever can only be stopped from another thread
+                threading.Thread(target=server.shutdown, daemon=True).start()
+
+            signal.signal(signal.SIGTERM, shutdown)
+            os.write(status_fd, READY)
+            server.serve_forever()
+            # the listening socket is closed, finish the requests in progress
+            server.executor.shutdown(wait=True)
+        except Exception as e:
+            print(f"[prefork] worker {os.getpid()} : {e!r}", file=sys.stderr, flush=True)
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('target', help="app to serve, e.g. proxy_app:app")
+    parser.add_argument('--host', default=os.getenv('PREFORK_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PREFORK_PORT', '80')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('PREFORK_WORKERS', os.cpu_count() or 1)),
+                        help='worker processes, one per core by default')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('PREFORK_THREADS', '8')),
+                        help='request threads of each worker')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('PREFORK_MAX_REQUESTS', '0')),
+                        help='requests after which a worker is replaced, 0 to keep them')
+    parser.add_argument('--max-requests-jitter', type=int,
+                        default=int(os.getenv('PREFORK_MAX_REQUESTS_JITTER', '0')))
+    parser.add_argument('--graceful-timeout', type=float, default=float(os.getenv('PREFORK_GRACEFUL_TIMEOUT', '30')))
+    parser.add_argument('--backlog', type=int, default=int(os.getenv('PREFORK_BACKLOG', '1024')))
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    # the app modules are found next to this file, as when they are run directly
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    arbiter = Arbiter(args.target, args.host, args.port, max(1, args.workers), max(1, args.threads),
+                      args.max_requests, args.max_requests_jitter, args.graceful_timeout, args.backlog,
+                      args.access_log)
+    sys.exit(arbiter.run())
+
+
+if __name__ == '__main__':
+    main()
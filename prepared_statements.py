@@ -0,0 +1,110 @@
+#!/usr/bin/python
+"""
+Server side prepared statements over pymysql connections.
+
+pymysql only speaks the text protocol, so statements are prepared in SQL :
+`PREPARE ps_<n> FROM '<template>'` the first time a connection runs a
+template, then every execution is `SET @p0 = ..., @p1 = ...` followed by
+`EXECUTE ps_<n> USING @p0, @p1`. The SQL node parses the template once per
+connection, the values go through two trivial statements instead of the
+whole query text.
+
+Each connection keeps its statements in an LRU : beyond `max_statements`
+the least recently used one is deallocated, which bounds the statements
+held by the server (max_prepared_stmt_count) to pool size * max_statements.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+
+# MySQL error of EXECUTE when the server doesn't know the statement
+ER_UNKNOWN_STMT_HANDLER = 1243
+
+
+class _ConnectionStatements:
+    # the statements prepared on one connection, only used by the thread holding it
+    __slots__ = ("names", "next_id")
+
+    def __init__(self):
+        self.names = OrderedDict()
+        self.next_id = 0
+
+
+class PreparedStatementCache:
+    """
+    Prepares the templates on the connections that run them and reuses them.
+
+    The statements of a connection are forgotten along with it, the pool
+    already guarantees that a connection is used by one thread at a time.
+    """
+
+    def __init__(self, max_statements=64):
+        self.max_statements = max_statements
+        self._connections = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._metrics = {"prepared": 0, "hits": 0, "deallocated": 0}
+
+    def execute(self, connection, cursor, sql, params):
+        """
+        Runs a template with its values on a cursor of the connection, the
+        rows are then read from the cursor as usual.
+
+        Args:
+            connection: pymysql connection the cursor belongs to.
+            cursor: pymysql cursor.
+            sql (str): template with `?` placeholders.
+            params (sequence): values of the placeholders.
+        """
+        statements = self._statements(connection)
+        name = statements.names.get(sql)
+        if name is not None:
+            statements.names.move_to_end(sql)
+            self._count("hits")
+        else:
+            name = self._prepare(cursor, statements, sql)
+        try:
+            self._execute(cursor, name, params)
+        except Exception as e:
+            if not e.args or e.args[0] != ER_UNKNOWN_STMT_HANDLER:
+                raise
+            # the server lost the statement, prepare it again once
+            statements.names.pop(sql, None)
+            self._execute(cursor, self._prepare(cursor, statements, sql), params)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats["statements"] = sum(len(statements.names) for statements in self._connections.values())
+        return stats
+
+    def _statements(self, connection):
+        with self._lock:
+            statements = self._connections.get(connection)
+            if statements is None:
+                statements = self._connections[connection] = _ConnectionStatements()
+            return statements
+
+    def _prepare(self, cursor, statements, sql):
+        while len(statements.names) >= self.max_statements:
+            _, evicted = statements.names.popitem(last=False)
+            cursor.execute(f"DEALLOCATE PREPARE {evicted}")
+            self._count("deallocated")
+
+        statements.next_id += 1
+        name = f"ps_{statements.next_id}"
+        cursor.execute(f"PREPARE {name} FROM %s", (sql,))
+        statements.names[sql] = name
+        self._count("prepared")
+        return name
+
+    def _execute(self, cursor, name, params):
+        if not params:
+            cursor.execute(f"EXECUTE {name}")
+            return
+        variables = [f"@p{idx}" for idx in range(len(params))]
+        cursor.execute("SET " + ", ".join(f"{variable} = %s" for variable in variables), tuple(params))
+        cursor.execute(f"EXECUTE {name} USING {', '.join(variables)}")
+
+    def _count(self, event):
+        with self._lock:
+            self._metrics[event] += 1
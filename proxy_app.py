@@ -1,12 +1,30 @@
 #!/usr/bin/python
-from flask import Flask
-import pymysql.cursors
-import random
-from sshtunnel import SSHTunnelForwarder
-from pythonping import ping
+import json
+import os
+import time
 
+from flask import Flask, Response, abort, g, has_request_context, jsonify, request
+import pymysql.cursors
 
-# master and slaves configurations
+from batch import InvalidBatch, parse_batch
+from backend_health import CircuitBreaker, TunnelSupervisor, is_connection_error
+from connection_pool import ConnectionPool, PoolExhaustedError
+from freshness import FreshnessTracker
+from latency_prober import LatencyProber
+from load_balancing import InFlightTracker, create_strategies
+from metrics import CONTENT_TYPE, HttpMetrics, Registry, instrument_flask, route_label
+from parameterized import InvalidQuery, parse_query
+from prepared_statements import PreparedStatementCache
+from query_router import StickySessions, is_read_query
+from result_cache import QueryResultCache, read_key, written_tables
+from result_formats import STREAM_FORMATS, iter_batches
+from singleflight import SingleFlight
+import tracing
+
+
+# master and slaves configurations : the master receives the writes, each slave is an ssh tunnel
+# through a data node to a SQL node ("sql_node", the master by default)
+# --- cluster backends (generated by setup_instance.generate_proxy_py) ---
 MASTER_CONFIG = {
     "ip": "18.209.8.218",
     "port": 3306,
@@ -18,128 +36,584 @@ SLAVE_CONFIGS = [
     {"ip": "54.91.169.38", "port": 3308, "name": "SLAVE_2"},
     {"ip": "3.91.227.191", "port": 3309, "name": "SLAVE_3"},
 ]
-
-
+# --- end of cluster backends ---
+
+# database credentials shared by every backend
+DB_USER = 'user0'
+DB_PASSWORD = 'mysql'
+DB_NAME = 'sakila'
+DB_CONNECT_TIMEOUT = 2
+
+# connection pool settings, applied to each backend pool
+POOL_MAX_SIZE = 10
+POOL_CHECKOUT_TIMEOUT = 5.0
+POOL_MAX_IDLE_TIME = 60.0
+POOL_MAX_LIFETIME = 1800.0
+POOL_VALIDATE_AFTER = 5.0
+
+# background latency probing settings (SELECT 1 round trip through each pool)
+PROBE_INTERVAL = 1.0
+PROBE_EWMA_ALPHA = 0.3
+PROBE_FAILURE_THRESHOLD = 3
+# seconds a probe waits for a connection of a busy pool before being skipped
+PROBE_CHECKOUT_TIMEOUT = 0.2
+
+# circuit breakers : consecutive connection failures that open a backend's breaker,
+# and seconds before a trial request is let through again
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 5.0
+# seconds between two checks of the ssh tunnels, dead tunnels are rebuilt
+TUNNEL_CHECK_INTERVAL = 2.0
+# the tunnels can be turned off when the slave ports are served locally (e.g. benchmarks/bench_chain.py)
+SSH_TUNNELS = os.getenv('PROXY_SSH_TUNNELS', '1') == '1'
+# port the proxy listens on
+PORT = int(os.getenv('PROXY_PORT', '80'))
+
+# heartbeat written on the master and read from the other backends to bound their staleness (see freshness.py),
+# a backend that is caught up shows a staleness of up to about two intervals
+FRESHNESS_INTERVAL = 0.5
+# staleness bound of a read in seconds, as a header or ?max_staleness= : only the backends known to hold
+# every write older than the bound may serve it, the master when none does. No bound by default
+STALENESS_HEADER = 'X-Max-Staleness'
+
+# backend selection strategy of each route, overridable per request with ?strategy=<name>
+# (random, fastest, least_outstanding, power_of_two, weighted_round_robin, latency_weighted)
+ROUTE_STRATEGIES = {"random": "random", "custom": "fastest", "auto": "power_of_two"}
+# relative weights for the weighted_round_robin strategy, backends not listed weigh 1
+BACKEND_WEIGHTS = {}
+
+# read-your-writes on the auto route : a session (identified by the header) that wrote
+# less than STICKY_WINDOW seconds ago reads from the master
+SESSION_HEADER = 'X-Session-Id'
+STICKY_WINDOW = 5.0
+
+# result cache of the html responses : total size of the cached results and their time to live
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL = 30.0
+
+# routes whose identical concurrent reads on a backend share a single execution (see singleflight.py)
+COALESCED_ROUTES = {"normal", "custom", "random", "auto"}
+
+# server side prepared statements kept by each connection for the parameterized queries (POST /query/<route>)
+PREPARED_STATEMENTS_PER_CONNECTION = 64
+
+# rows fetched at a time from the server-side cursor when streaming results (any format but html)
+FETCH_BATCH_SIZE = 500
 
 # simple html template response
 RESPONSE_TEMPLATE = """
 <h1>{_ROUTE_TYPE_} route</h1><h2>Received from {_IP_} ({_NAME_})</h2>
 <p>{_CONTENT_}</p>"""
 
-# setup sshtunnels
-servers = []
-for idx, slave_config in enumerate(SLAVE_CONFIGS):
-    print(f"Starting forwarding for {slave_config['ip']} -> 127.0.0.1:{slave_config['port']}")
+# local port each slave is reached on : the fixed port of its config, or with the ssh tunnels the port
+# the system gave to its tunnel, so that every worker process (see prefork.py) has tunnels of its own
+LOCAL_PORTS = {slave_config["name"]: slave_config["port"] for slave_config in SLAVE_CONFIGS}
+
+
+# creates and starts the ssh tunnel forwarding a local port to the slave's sql node
+def create_tunnel(slave_config):
+    from sshtunnel import SSHTunnelForwarder
+
     server = SSHTunnelForwarder(
         (slave_config["ip"], 22),
         ssh_pkey="/home/ubuntu/private_key_PROJET_KEY.pem",
         ssh_username="ubuntu",
-        local_bind_address=('127.0.0.1', slave_config["port"]),
+        local_bind_address=('127.0.0.1', 0),
         allow_agent=False,
-        remote_bind_address=(MASTER_CONFIG["ip"], MASTER_CONFIG["port"]))
+        remote_bind_address=(slave_config.get("sql_node", MASTER_CONFIG["ip"]), MASTER_CONFIG["port"]))
     server.start()
-    servers.append(server)
+    LOCAL_PORTS[slave_config["name"]] = server.local_bind_port
+    print(f"Started forwarding for {slave_config['ip']} -> 127.0.0.1:{server.local_bind_port}")
+    return server
+
+
+# creates the connection pool of a backend, connections are opened lazily
+def create_pool(name, host, port):
+    def connect():
+        return pymysql.connect(host=host,
+                               port=LOCAL_PORTS.get(name, port),
+                               user=DB_USER,
+                               password=DB_PASSWORD,
+                               database=DB_NAME,
+                               charset='utf8mb4',
+                               connect_timeout=DB_CONNECT_TIMEOUT,
+                               cursorclass=pymysql.cursors.DictCursor)
+
+    return ConnectionPool(name, connect,
+                          max_size=POOL_MAX_SIZE,
+                          checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                          max_idle_time=POOL_MAX_IDLE_TIME,
+                          max_lifetime=POOL_MAX_LIFETIME,
+                          validate_after=POOL_VALIDATE_AFTER)
+
+
+# one connection pool per backend : the master directly, the slaves through their local tunnel port
+POOLS = {MASTER_CONFIG["name"]: create_pool(MASTER_CONFIG["name"], MASTER_CONFIG["ip"], MASTER_CONFIG["port"])}
+for slave_config in SLAVE_CONFIGS:
+    POOLS[slave_config["name"]] = create_pool(slave_config["name"], "127.0.0.1", slave_config["port"])
+
+
+# address at which each backend is reached by the proxy
+BACKEND_CONFIGS = {MASTER_CONFIG["name"]: MASTER_CONFIG}
+for slave_config in SLAVE_CONFIGS:
+    BACKEND_CONFIGS[slave_config["name"]] = {"ip": "127.0.0.1", "port": slave_config["port"], "name": slave_config["name"]}
+
+
+# the connections opened through a dead tunnel are dropped once it is rebuilt
+def tunnel_rebuilt(name):
+    print(f"Rebuilt the tunnel to {name}")
+    POOLS[name].drain()
+
+
+# setup sshtunnels, then keep them up
+tunnel_supervisor = TunnelSupervisor({slave_config["name"]: (lambda config=slave_config: create_tunnel(config))
+                                      for slave_config in SLAVE_CONFIGS if SSH_TUNNELS},
+                                     interval=TUNNEL_CHECK_INTERVAL,
+                                     on_rebuild=tunnel_rebuilt)
+tunnel_supervisor.start()
+
+# one circuit breaker per backend, fed by the queries and the probes
+BREAKERS = {name: CircuitBreaker(name,
+                                 failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                                 reset_timeout=BREAKER_RESET_TIMEOUT) for name in POOLS}
+
+
+# the probes feed the breakers with the same errors as the queries, a busy pool says nothing of the backend
+def record_probe(name, error):
+    if error is None:
+        BREAKERS[name].record_success()
+    elif is_connection_error(error):
+        BREAKERS[name].record_failure()
+
+
+# measure the latency of every backend in the background, the master is preferred on ties
+prober = LatencyProber(POOLS,
+                       interval=PROBE_INTERVAL,
+                       alpha=PROBE_EWMA_ALPHA,
+                       failure_threshold=PROBE_FAILURE_THRESHOLD,
+                       on_probe=record_probe,
+                       checkout_timeout=PROBE_CHECKOUT_TIMEOUT)
+prober.start()
+
+freshness = FreshnessTracker(POOLS, MASTER_CONFIG["name"], interval=FRESHNESS_INTERVAL)
+freshness.start()
+
+sticky_sessions = StickySessions(window=STICKY_WINDOW)
+result_cache = QueryResultCache(max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL)
+coalescer = SingleFlight()
+prepared_statements = PreparedStatementCache(max_statements=PREPARED_STATEMENTS_PER_CONNECTION)
+
+# requests in flight on each backend, used by the load-aware strategies
+in_flight = InFlightTracker()
+STRATEGIES = create_strategies(in_flight, prober, BACKEND_WEIGHTS)
+SLAVE_CONFIGS_BY_NAME = {slave_config["name"]: slave_config for slave_config in SLAVE_CONFIGS}
+
+
+# picks one of the candidate backends (names, in preference order) with the route's strategy,
+# skipping the ones whose circuit breaker is open. Returns None when none is available.
+# The breaker of the selected backend is acquired for the request, see acquired_breaker
+def select_backend(route, candidates):
+    strategy_name = request.args.get('strategy', ROUTE_STRATEGIES[route])
+    if strategy_name not in STRATEGIES:
+        abort(400, description=f"Unknown strategy {strategy_name}")
+
+    available = [name for name in candidates if BREAKERS[name].available()]
+    while available:
+        name = STRATEGIES[strategy_name].select(available)
+        if BREAKERS[name].acquire():
+            g.acquired_breaker = name
+            return name
+        available.remove(name)
+    return None
+
+
+# whether the request acquired the breaker of a backend : only then may it release the half-open trial,
+# the requests sent to the master without a selection never hold it
+def acquired_breaker(name):
+    return g.get('acquired_breaker') == name
+
+
+# staleness bound of the request in seconds, None when it has none
+def max_staleness():
+    bound = request.args.get('max_staleness', request.headers.get(STALENESS_HEADER))
+    if bound is None:
+        return None
+    try:
+        value = float(bound)
+    except ValueError:
+        value = float('nan')
+    if not value >= 0:
+        abort(400, description=f"Invalid max staleness {bound}")
+    return value
 
-
-# simple function that pings a host and returns the average
-def ping_instance(host):
-    ping_result = ping(target=host, count=5, timeout=2)
-    avg_ping = ping_result.rtt_avg_ms
-    print(f"{host} ping : {avg_ping}ms")
-    return avg_ping
+
+# the candidate backends whose data is fresh enough for the bound
+def fresh_candidates(candidates, bound):
+    if bound is None:
+        return candidates
+    return [name for name in candidates if freshness.is_fresh(name, bound)]
 
 
 # flask Application : defines our endpoints and their logic
 app = Flask(__name__)
 
+# request and per-backend phase timings, exported on /metrics with the pools, breakers and cache state
+registry = Registry()
+http_metrics = HttpMetrics(registry, 'proxy')
+phase_latency = registry.histogram('proxy_phase_duration_seconds',
+                                   'Time spent in each phase of a query.', ('route', 'backend', 'phase'))
+instrument_flask(app, http_metrics, lambda: route_label(request.path))
+# request IDs and Server-Timing breakdown, propagated from the trusted host, see tracing.py
+tracing.instrument_flask(app, 'proxy', lambda: route_label(request.path))
+
+# Server-Timing name of each query phase : waiting for a pooled connection, running the query, rendering the page,
+# and waiting for the identical query of another request
+TRACE_PHASES = {'connect': 'queue', 'query': 'db', 'serialization': 'render', 'coalesced': 'coalesced'}
+
+
+def collect_backend_metrics():
+    pool_stats = {name: pool.stats() for name, pool in POOLS.items()}
+    breaker_states = {name: breaker.snapshot()["state"] for name, breaker in BREAKERS.items()}
+    cache_stats = result_cache.stats()
+    staleness = {name: freshness.staleness(name) for name in POOLS}
+    coalescing_stats = coalescer.stats()
+    statement_stats = prepared_statements.stats()
+    return [
+        ('gauge', 'proxy_pool_connections', 'Open connections of each backend pool.', ('backend', 'state'),
+         [({"backend": name, "state": state}, stats[state]) for name, stats in pool_stats.items()
+          for state in ("idle", "in_use")]),
+        ('counter', 'proxy_pool_exhausted_total', 'Checkouts that timed out on a full pool.', ('backend',),
+         [({"backend": name}, stats["exhausted"]) for name, stats in pool_stats.items()]),
+        ('gauge', 'proxy_backend_in_flight', 'Queries running on each backend.', ('backend',),
+         [({"backend": name}, in_flight.count(name)) for name in POOLS]),
+        ('gauge', 'proxy_backend_breaker_open', 'Whether the circuit breaker of a backend is not closed.',
+         ('backend',), [({"backend": name}, int(state != "closed")) for name, state in breaker_states.items()]),
+        ('counter', 'proxy_result_cache_total', 'Result cache lookups and evictions.', ('event',),
+         [({"event": event}, cache_stats[event])
+          for event in ("hits", "misses", "evictions", "invalidations", "too_stale")]),
+        ('counter', 'proxy_coalesced_queries_total', 'Read queries executed, and joined to an identical execution.',
+         ('event',), [({"event": event}, coalescing_stats[event]) for event in ("executions", "joined")]),
+        ('counter', 'proxy_prepared_statements_total', 'Statements prepared, reused and deallocated.', ('event',),
+         [({"event": event}, statement_stats[event]) for event in ("prepared", "hits", "deallocated")]),
+        ('gauge', 'proxy_backend_staleness_seconds', 'Upper bound of the staleness of each backend.', ('backend',),
+         [({"backend": name}, value) for name, value in staleness.items() if value is not None]),
+    ]
+
+
+registry.add_collector(collect_backend_metrics)
+
+
+# records the time spent in a phase of a query since start, returns the end of the phase
+def observe_phase(route, backend, phase, start):
+    now = time.perf_counter()
+    phase_latency.observe(now - start, route=route, backend=backend, phase=phase)
+    # the rows of a streamed response are sent after the headers, out of the request context
+    if has_request_context() and 'trace' in g:
+        g.trace.add(TRACE_PHASES[phase], now - start)
+    return now
+
+
+# output format of each mimetype, for the negotiation on the Accept header
+FORMAT_MIMETYPES = {'text/html': 'html', **{mimetype: name for name, (_, mimetype) in STREAM_FORMATS.items()}}
+
+
+# output format of the request : ?format=<name> when given, otherwise the best match of the Accept header,
+# the html page by default
+def requested_format():
+    if 'format' in request.args:
+        return request.args['format']
+    return FORMAT_MIMETYPES[request.accept_mimetypes.best_match(list(FORMAT_MIMETYPES), default='text/html')]
+
+
+# runs a statement on a cursor : the raw text, or a template and its values as a prepared statement
+def execute_statement(connection, cursor, sql, params):
+    if params is None:
+        cursor.execute(sql)
+    else:
+        prepared_statements.execute(connection, cursor, sql, params)
+
+
+# runs a query on a backend and renders the result, either as the html page or streamed in a row format.
+# params are the values of a parameterized query, None for a raw one
+def run_query(route_type, config, sql, commit=False, params=None):
+    pool = POOLS[config["name"]]
+    breaker = BREAKERS[config["name"]]
+    acquired = acquired_breaker(config["name"])
+    # reads may be answered from the result cache, writes invalidate the tables they touch
+    read = is_read_query(sql)
+
+    def invalidate_cache():
+        if not read:
+            result_cache.invalidate(written_tables(sql))
+
+    output_format = requested_format()
+    if output_format in STREAM_FORMATS:
+        batch_size = request.args.get('batch_size', FETCH_BATCH_SIZE, type=int)
+        return stream_query(route_type.lower(), config["name"], sql, output_format, max(1, batch_size), commit,
+                            invalidate_cache, params, acquired)
+    if output_format != 'html':
+        breaker.release(acquired)
+        return f"Unknown format {output_format}", 400
+
+    content = None
+    cache_key = read_key(sql) if read else None
+    if cache_key is not None:
+        key, names = cache_key
+        # a result is only served again for the backend it was read from, and only when it is as fresh as the
+        # request's staleness bound
+        key = (config["name"], key, params)
+        content = result_cache.get(key, max_staleness=max_staleness())
+        generation = result_cache.generation(names)
+    route = route_type.lower()
+
+    def execute():
+        # the data read holds every write older than the backend's staleness, unknown until its first heartbeat
+        staleness = freshness.staleness(config["name"])
+        read_at = time.time()
+        start = time.perf_counter()
+        with breaker.guard(acquired), in_flight.track(config["name"]), pool.connection() as connection:
+            start = observe_phase(route, config["name"], 'connect', start)
+            with connection.cursor() as cursor:
+                execute_statement(connection, cursor, sql, params)
+                if commit:
+                    connection.commit()
+
+                result = cursor.fetchall()
+                print(result)
+            observe_phase(route, config["name"], 'query', start)
+        invalidate_cache()
+
+        content = str(result)
+        if cache_key is not None and staleness is not None:
+            result_cache.put(key, names, content, generation, as_of=read_at - staleness)
+        return content
+
+    if content is None and read and route in COALESCED_ROUTES:
+        # the requests joining a running execution wait for its result (or its error) instead of querying,
+        # the cache generation in the key keeps a read issued after a write from joining an older execution
+        flight_key = (key, generation) if cache_key is not None else (config["name"], sql, params)
+        joined_at = []
+
+        def join():
+            # no query is sent by this request, a half-open backend keeps its trial
+            breaker.release(acquired)
+            joined_at.append(time.perf_counter())
+
+        content = coalescer.do(flight_key, execute, on_join=join)
+        start = observe_phase(route, config["name"], 'coalesced', joined_at[0]) if joined_at else time.perf_counter()
+    elif content is None:
+        content = execute()
+        start = time.perf_counter()
+    else:
+        # no query was sent, a half-open backend keeps its trial for the next request
+        breaker.release(acquired)
+        start = time.perf_counter()
+
+    page = RESPONSE_TEMPLATE.format(_ROUTE_TYPE_=route_type,
+                                    _IP_=config['ip'],
+                                    _NAME_=config['name'],
+                                    _CONTENT_=content)
+    observe_phase(route, config["name"], 'serialization', start)
+    return page, {'Vary': 'Accept'}
+
+
+# streams the rows of a query from an unbuffered server-side cursor, batch_size rows at a time
+def stream_query(route, name, sql, output_format, batch_size, commit, on_complete, params=None, acquired=False):
+    encoder, mimetype = STREAM_FORMATS[output_format]
+
+    def generate():
+        start = time.perf_counter()
+        with BREAKERS[name].guard(acquired), in_flight.track(name), POOLS[name].connection() as connection:
+            start = observe_phase(route, name, 'connect', start)
+            with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+                execute_statement(connection, cursor, sql, params)
+                # only the execution, the rows are fetched while the response is sent
+                observe_phase(route, name, 'query', start)
+                # signals that the query ran, so errors are reported before the response starts
+                yield ''
+                if cursor.description is not None:
+                    columns = [column[0] for column in cursor.description]
+                    yield from encoder(columns, iter_batches(cursor, batch_size))
+            # the whole result set has to be read before the connection accepts a commit
+            if commit:
+                connection.commit()
+        on_complete()
+
+    chunks = generate()
+    next(chunks)
+    return Response(chunks, mimetype=mimetype, headers={'Vary': 'Accept'})
+
+
+# the statement of a request : the sql of the url, or the template and values of a parameterized
+# query posted to /query/<route> (see parameterized.py)
+def query_arguments(sql):
+    if sql is not None:
+        return sql, None
+    try:
+        return parse_query(request.get_data())
+    except InvalidQuery as e:
+        abort(400, description=f"Invalid Request: {e}")
+
 
 @app.route('/normal/<sql>')
-def normal_endpoint(sql):
+@app.route('/query/normal', methods=['POST'])
+def normal_endpoint(sql=None):
     # forward the request directly to the master
-    connection = pymysql.connect(host=MASTER_CONFIG["ip"],
-                                 port=MASTER_CONFIG["port"],
-                                 user='user0',
-                                 password='mysql',
-                                 database='sakila',
-                                 charset='utf8mb4',
-                                 cursorclass=pymysql.cursors.DictCursor)
-
-    with connection:
+    sql, params = query_arguments(sql)
+    return run_query("Normal", MASTER_CONFIG, sql, commit=True, params=params)
+
+
+@app.route('/custom/<sql>')
+@app.route('/query/custom', methods=['POST'])
+def custom_endpoint(sql=None):
+    # forward to the backend with the lowest measured latency by default, the master if none is healthy
+    sql, params = query_arguments(sql)
+    candidates = fresh_candidates(list(BACKEND_CONFIGS), max_staleness())
+    min_ping_config = BACKEND_CONFIGS[select_backend("custom", candidates) or MASTER_CONFIG["name"]]
+
+    print(f"Redirecting to instance: {min_ping_config}")
+
+    return run_query("Custom", min_ping_config, sql, params=params)
+
+
+@app.route('/random/<sql>')
+@app.route('/query/random', methods=['POST'])
+def random_endpoint(sql=None):
+    # choose a slave (at random by default), queried through its ssh tunnel
+    sql, params = query_arguments(sql)
+    bound = max_staleness()
+    name = select_backend("random", fresh_candidates(list(SLAVE_CONFIGS_BY_NAME), bound))
+    if name is None and bound is not None:
+        # no slave is fresh enough, the master always is
+        return run_query("Random", MASTER_CONFIG, sql, params=params)
+    if name is None:
+        return "Service Unavailable: no slave available", 503
+    config = SLAVE_CONFIGS_BY_NAME[name]
+
+    return run_query("Random", config, sql, params=params)
+
+
+@app.route('/auto/<sql>')
+@app.route('/query/auto', methods=['POST'])
+def auto_endpoint(sql=None):
+    # writes and transactions go to the master, reads are spread over the healthy slaves
+    sql, params = query_arguments(sql)
+    session_id = request.headers.get(SESSION_HEADER)
+    if not is_read_query(sql):
+        sticky_sessions.record_write(session_id)
+        return run_query("Auto", MASTER_CONFIG, sql, commit=True, params=params)
+
+    # a session that just wrote reads its own writes from the master
+    if sticky_sessions.is_sticky(session_id):
+        return run_query("Auto", MASTER_CONFIG, sql, params=params)
+
+    healthy_slaves = [config["name"] for config in SLAVE_CONFIGS if prober.is_healthy(config["name"])]
+    name = select_backend("auto", fresh_candidates(healthy_slaves, max_staleness()))
+    if name is None:
+        return run_query("Auto", MASTER_CONFIG, sql, params=params)
+    return run_query("Auto", SLAVE_CONFIGS_BY_NAME[name], sql, params=params)
+
+
+@app.route('/batch', methods=['POST'])
+def batch_endpoint():
+    # runs a list of statements on a single master connection, see batch.py for the format
+    try:
+        mode, statements = parse_batch(request.get_data())
+    except InvalidBatch as e:
+        return f"Invalid Request: {e}", 400
+
+    results = []
+    written = []
+    committed = True
+    with POOLS[MASTER_CONFIG["name"]].connection() as connection:
         with connection.cursor() as cursor:
-            cursor.execute(sql)
+            for sql, params in statements:
+                try:
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall()
+                    if mode == 'autocommit':
+                        connection.commit()
+                # pymysql interpolates the params client side, a malformed template fails before reaching mysql
+                except (pymysql.MySQLError, ValueError, TypeError) as e:
+                    results.append({"error": str(e)})
+                    connection.rollback()
+                    # a failed statement aborts the whole transaction, the next statements are not run
+                    if mode == 'transaction':
+                        committed = False
+                        break
+                    continue
+
+                results.append({"rows": rows, "rowcount": cursor.rowcount, "lastrowid": cursor.lastrowid})
+                if not is_read_query(sql):
+                    written.append(sql)
+        if mode == 'transaction' and committed:
             connection.commit()
 
-            result = cursor.fetchall()
-            print(result)
+    if committed:
+        for sql in written:
+            result_cache.invalidate(written_tables(sql))
 
-    return RESPONSE_TEMPLATE.format(_ROUTE_TYPE_="Normal",
-                                    _IP_=MASTER_CONFIG['ip'],
-                                    _NAME_=MASTER_CONFIG['name'],
-                                    _CONTENT_=result)
+    body = json.dumps({"mode": mode, "committed": committed, "results": results}, default=str)
+    return Response(body, mimetype='application/json')
 
 
-@app.route('/custom/<sql>')
-def custom_endpoint(sql):
-    # default to master
-    min_ping_config = MASTER_CONFIG
-    min_ping = ping_instance(MASTER_CONFIG["ip"])
-
-    # ping the endpoints, and forward to the right one
-    for slave_config in SLAVE_CONFIGS:
-        instance_ping = ping_instance(slave_config["ip"])
-        if instance_ping < min_ping:
-            min_ping = instance_ping
-            min_ping_config = {"ip": "127.0.0.1", "port": slave_config["port"], "name": slave_config["name"]}
+@app.errorhandler(PoolExhaustedError)
+def pool_exhausted(error):
+    print(error)
+    return "Service Unavailable", 503
 
-    print(f"Redirecting to instance: {min_ping_config}")
 
-    connection = pymysql.connect(host=min_ping_config["ip"],
-                                 port=min_ping_config["port"],
-                                 user='user0',
-                                 password='mysql',
-                                 database='sakila',
-                                 charset='utf8mb4',
-                                 cursorclass=pymysql.cursors.DictCursor)
+@app.route('/pools')
+def pools_endpoint():
+    # occupancy and exhaustion counters of every backend pool
+    return jsonify({name: pool.stats() for name, pool in POOLS.items()})
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(sql)
 
-            result = cursor.fetchall()
-            print(result)
+@app.route('/latency')
+def latency_endpoint():
+    # latest EWMA latency, health state and requests in flight of every backend
+    snapshot = prober.snapshot()
+    for name, in_flight_count in in_flight.snapshot().items():
+        snapshot[name]["in_flight"] = in_flight_count
+    return jsonify(snapshot)
 
-    return RESPONSE_TEMPLATE.format(_ROUTE_TYPE_="Custom",
-                                    _IP_=min_ping_config['ip'],
-                                    _NAME_=min_ping_config['name'],
-                                    _CONTENT_=result)
 
+@app.route('/freshness')
+def freshness_endpoint():
+    # latest heartbeat and staleness bound of every backend
+    return jsonify(freshness.snapshot())
 
-@app.route('/random/<sql>')
-def random_endpoint(sql):
-    # choose a random slave
-    config = random.choice(SLAVE_CONFIGS)
-
-    # connect to the database through ssh tunnelling
-    connection = pymysql.connect(host="127.0.0.1",
-                                 port=config["port"],
-                                 user='user0',
-                                 password='mysql',
-                                 database='sakila',
-                                 charset='utf8mb4',
-                                 cursorclass=pymysql.cursors.DictCursor)
-
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(sql)
-            result = cursor.fetchall()
-            print(result)
 
-    return RESPONSE_TEMPLATE.format(_ROUTE_TYPE_="Random",
-                                    _IP_=config['ip'],
-                                    _NAME_=config['name'],
-                                    _CONTENT_=result)
+@app.route('/cache')
+def cache_endpoint():
+    # hit, miss and eviction counters of the result cache
+    return jsonify(result_cache.stats())
+
+
+@app.route('/coalescing')
+def coalescing_endpoint():
+    # reads executed, reads that joined an identical execution instead of querying, and executions running
+    return jsonify(coalescer.stats())
+
+
+@app.route('/prepared')
+def prepared_endpoint():
+    # statements prepared, reused and deallocated, and statements currently held by the connections
+    return jsonify(prepared_statements.stats())
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/health')
+def health_endpoint():
+    # circuit breaker of every backend and state of the ssh tunnels
+    return jsonify({"breakers": {name: breaker.snapshot() for name, breaker in BREAKERS.items()},
+                    "tunnels": tunnel_supervisor.snapshot()})
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80)
+    app.run(host='0.0.0.0', port=PORT)
 
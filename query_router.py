@@ -0,0 +1,67 @@
+#!/usr/bin/python
+import threading
+import time
+from collections import OrderedDict
+
+from sql_validator import InvalidSql, fingerprint
+
+# statements that never modify data, as long as they don't lock rows or write into a table/file
+READ_STATEMENTS = {'SELECT', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN'}
+
+
+def is_read_query(sql):
+    """
+    Tells whether a query can be served by a replica.
+
+    Anything that isn't clearly a plain read (writes, DDL, transaction
+    control, locking reads, SELECT ... INTO, unparsable text) is treated as
+    a write so that it goes to the master.
+    """
+    try:
+        tokens = fingerprint(sql)
+    except InvalidSql:
+        return False
+    if not tokens or tokens[0] not in READ_STATEMENTS:
+        return False
+    if tokens[0] == 'SELECT':
+        for idx, token in enumerate(tokens):
+            if token == 'INTO':
+                return False
+            if token == 'FOR' and tokens[idx + 1:idx + 2] in (('UPDATE',), ('SHARE',)):
+                return False
+            if token == 'LOCK' and tokens[idx + 1:idx + 4] == ('IN', 'SHARE', 'MODE'):
+                return False
+    return True
+
+
+class StickySessions:
+    """
+    Remembers which sessions wrote recently, for read-your-writes consistency.
+
+    A session that wrote less than `window` seconds ago keeps reading from the
+    master until its writes have had time to reach the replicas. At most
+    `max_sessions` sessions are tracked, the least recently written ones are
+    forgotten first.
+    """
+
+    def __init__(self, window=5.0, max_sessions=10000):
+        self.window = window
+        self.max_sessions = max_sessions
+        self._last_write = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_write(self, session_id):
+        if not session_id:
+            return
+        with self._lock:
+            self._last_write[session_id] = time.monotonic()
+            self._last_write.move_to_end(session_id)
+            while len(self._last_write) > self.max_sessions:
+                self._last_write.popitem(last=False)
+
+    def is_sticky(self, session_id):
+        if not session_id:
+            return False
+        with self._lock:
+            last_write = self._last_write.get(session_id)
+        return last_write is not None and time.monotonic() - last_write < self.window
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+import threading
+import time
+from collections import OrderedDict
+
+from sql_validator import InvalidSql, normalize, referenced_tables, tokenize
+
+# functions whose result changes between executions, queries calling them are never cached
+NON_DETERMINISTIC_FUNCTIONS = {'NOW', 'SYSDATE', 'CURDATE', 'CURTIME', 'CURRENT_DATE', 'CURRENT_TIME',
+                               'CURRENT_TIMESTAMP', 'LOCALTIME', 'LOCALTIMESTAMP', 'UTC_DATE', 'UTC_TIME',
+                               'UTC_TIMESTAMP', 'UNIX_TIMESTAMP', 'RAND', 'UUID', 'UUID_SHORT',
+                               'CONNECTION_ID', 'LAST_INSERT_ID', 'FOUND_ROWS', 'ROW_COUNT', 'USER',
+                               'CURRENT_USER', 'SESSION_USER', 'SYSTEM_USER', 'DATABASE', 'SCHEMA', 'SLEEP'}
+
+# base tables read by the sakila views and stored functions, a query naming one of them depends on these tables too
+READ_DEPENDENCIES = {
+    'actor_info': {'actor', 'film_actor', 'film_category', 'category', 'film'},
+    'customer_list': {'customer', 'address', 'city', 'country'},
+    'film_list': {'film', 'film_category', 'category', 'film_actor', 'actor'},
+    'nicer_but_slower_film_list': {'film', 'film_category', 'category', 'film_actor', 'actor'},
+    'sales_by_film_category': {'payment', 'rental', 'inventory', 'film', 'film_category', 'category'},
+    'sales_by_store': {'payment', 'rental', 'inventory', 'store', 'address', 'city', 'country', 'staff'},
+    'staff_list': {'staff', 'address', 'city', 'country'},
+    'get_customer_balance': {'film', 'inventory', 'rental', 'payment'},
+    'inventory_held_by_customer': {'rental'},
+    'inventory_in_stock': {'inventory', 'rental'},
+}
+
+# tables also modified by a write on a sakila table: the film triggers keep film_text in sync and the
+# foreign keys cascade key updates (and payment.rental_id is set to null on delete) to the referencing tables
+WRITE_SIDE_EFFECTS = {
+    'actor': {'film_actor'},
+    'address': {'customer', 'staff', 'store'},
+    'category': {'film_category'},
+    'city': {'address'},
+    'country': {'city'},
+    'customer': {'payment', 'rental'},
+    'film': {'film_text', 'film_actor', 'film_category', 'inventory'},
+    'inventory': {'rental'},
+    'language': {'film'},
+    'rental': {'payment'},
+    'staff': {'payment', 'rental', 'store'},
+    'store': {'customer', 'inventory', 'staff'},
+}
+
+
+def read_key(sql):
+    """
+    Computes the cache key of a read query and the names it depends on.
+
+    The key is the normalized query text. Every identifier of the query is
+    considered a table it may read : the superset can only cause extra
+    invalidations, never a stale hit. The views and functions of the schema
+    add the base tables they read.
+
+    Returns:
+        Tuple (key, names), or None when the query can't be cached.
+    """
+    try:
+        tokens = tokenize(sql)
+    except InvalidSql:
+        return None
+    names = set()
+    for kind, text in tokens:
+        if kind == 'word' and text in NON_DETERMINISTIC_FUNCTIONS:
+            return None
+        if kind in ('word', 'quoted'):
+            names.add(text.strip('`').lower())
+    for name in list(names):
+        names.update(READ_DEPENDENCIES.get(name, ()))
+    return normalize(tokens), frozenset(names)
+
+
+def written_tables(sql):
+    """
+    Names of the tables a write may modify, or None when they can't be determined.
+
+    A write through a view modifies its base tables, and a write on a table
+    may modify others through the triggers and cascading foreign keys.
+    """
+    try:
+        tables = referenced_tables(tokenize(sql))
+    except InvalidSql:
+        return None
+    for name in list(tables):
+        tables.update(READ_DEPENDENCIES.get(name, ()))
+    for name in list(tables):
+        tables.update(WRITE_SIDE_EFFECTS.get(name, ()))
+    return tables or None
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "names", "as_of")
+
+    def __init__(self, value, size, expires_at, names, as_of):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.names = names
+        self.as_of = as_of
+
+
+class QueryResultCache:
+    """
+    In-process cache of rendered read results with table-level invalidation.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the cached values exceed `max_bytes`. Writes invalidate every
+    entry depending on one of the tables they touch. Each table has a
+    generation number bumped on invalidation: a result computed while a write
+    on one of its tables went through is not stored, since it may predate it.
+    Each entry also keeps the wall-clock time its data is known to be current
+    as of, so that a read bounding the staleness of its data can refuse the
+    entries that are too old.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=30.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._by_name = {}
+        self._generations = {}
+        self._global_generation = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "stale_stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "too_stale": 0,
+        }
+
+    def get(self, key, max_staleness=None):
+        """
+        Returns the cached value of a key, or None. With `max_staleness`, an
+        entry whose data is older than that many seconds is a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._metrics["misses"] += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self._metrics["expirations"] += 1
+                self._metrics["misses"] += 1
+                return None
+            if max_staleness is not None and time.time() - entry.as_of > max_staleness:
+                self._metrics["too_stale"] += 1
+                self._metrics["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._metrics["hits"] += 1
+            return entry.value
+
+    def generation(self, names):
+        """Snapshot to take before running a query, and to give back to `put`."""
+        with self._lock:
+            return self._global_generation, tuple(self._generations.get(name, 0) for name in names)
+
+    def put(self, key, names, value, generation, as_of=None):
+        """
+        Stores the value of a read, unless one of its tables was written since `generation`.
+        `as_of` is the time.time() its data is current as of, now by default.
+        """
+        as_of = time.time() if as_of is None else as_of
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            current = self._global_generation, tuple(self._generations.get(name, 0) for name in names)
+            if current != generation:
+                self._metrics["stale_stores"] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, size, time.monotonic() + self.ttl, names, as_of)
+            self._bytes += size
+            for name in names:
+                self._by_name.setdefault(name, set()).add(key)
+            self._metrics["stores"] += 1
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._metrics["evictions"] += 1
+
+    def invalidate(self, tables):
+        """Drops the entries depending on the given tables, or every entry when tables is None."""
+        with self._lock:
+            if tables is None:
+                self._global_generation += 1
+                self._metrics["invalidations"] += len(self._entries)
+                self._entries.clear()
+                self._by_name.clear()
+                self._bytes = 0
+                return
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                for key in list(self._by_name.get(table, ())):
+                    self._remove(key)
+                    self._metrics["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for name in entry.names:
+            keys = self._by_name.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_name[name]
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+"""
+Incremental encoders used to stream query results out of the proxy, and the
+decoders of the binary formats for the clients.
+
+The columnar format (application/vnd.log8415e.columnar) is little endian :
+    header : magic b'LGC1', u16 column count, then per column a u16 length
+             and the utf-8 name
+    block  : u32 row count, then per column a u8 type, a null bitmap of
+             ceil(rows / 8) bytes (bit i set when row i is null) and the values
+    end    : a block of 0 rows
+Types are chosen per block from the values : int64 and float64 columns are
+packed arrays, text and bytes columns are u32 offsets (rows + 1) followed
+by the concatenated values. A text column with few distinct values is sent
+as a dictionary instead : u32 entry count, the entries as offsets and
+values, a u8 index width (1, 2 or 4 bytes) and one index per row. Values of
+other types (dates, decimals) are sent as text, like ndjson does. Every block holds one fetched batch, so the
+column names are sent once and the values of a column are contiguous.
+
+The msgpack format (application/vnd.msgpack) is a MessagePack array of the
+column names followed by one array per row. It needs the optional msgpack
+package and is only offered when it is installed.
+"""
+import csv
+import io
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def iter_batches(cursor, batch_size):
+    """Yields the remaining rows of a cursor as lists of at most `batch_size` rows."""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def encode_ndjson(columns, batches):
+    # one json object per row, values json can't represent (dates, decimals) are written as strings
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+
+
+def encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # the header alone when the result is empty
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+COLUMNAR_MAGIC = b'LGC1'
+
+# type of a column block
+COLUMN_NULL = 0
+COLUMN_INT = 1
+COLUMN_FLOAT = 2
+COLUMN_TEXT = 3
+COLUMN_BYTES = 4
+COLUMN_TEXT_DICT = 5
+
+# a text column is dictionary encoded when its distinct values are at most this fraction of its rows
+DICT_MAX_RATIO = 0.5
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _column_type(values):
+    # the narrowest type holding every non null value of a block
+    present = [value for value in values if value is not None]
+    if not present:
+        return COLUMN_NULL
+    if all(isinstance(value, int) and _INT64_MIN <= value <= _INT64_MAX for value in present):
+        return COLUMN_INT
+    if all(isinstance(value, (int, float)) for value in present):
+        return COLUMN_FLOAT
+    if all(isinstance(value, (bytes, bytearray)) for value in present):
+        return COLUMN_BYTES
+    return COLUMN_TEXT
+
+
+def _encode_column(values):
+    count = len(values)
+    column_type = _column_type(values)
+    nulls = bytearray((count + 7) // 8)
+    for idx, value in enumerate(values):
+        if value is None:
+            nulls[idx >> 3] |= 1 << (idx & 7)
+
+    parts = [bytes((column_type,)), bytes(nulls)]
+    if column_type == COLUMN_INT:
+        parts.append(struct.pack(f'<{count}q', *(0 if value is None else value for value in values)))
+    elif column_type == COLUMN_FLOAT:
+        parts.append(struct.pack(f'<{count}d', *(0.0 if value is None else value for value in values)))
+    elif column_type == COLUMN_BYTES:
+        parts.extend(_encode_values([b'' if value is None else bytes(value) for value in values]))
+    elif column_type == COLUMN_TEXT:
+        texts = ['' if value is None else value if isinstance(value, str) else str(value) for value in values]
+        entries = {}
+        indexes = [entries.setdefault(text, len(entries)) for text in texts]
+        if len(entries) <= count * DICT_MAX_RATIO:
+            width, code = (1, 'B') if len(entries) <= 0x100 else (2, 'H') if len(entries) <= 0x10000 else (4, 'I')
+            parts[0] = bytes((COLUMN_TEXT_DICT,))
+            parts.append(struct.pack('<I', len(entries)))
+            parts.extend(_encode_values([text.encode() for text in entries]))
+            parts.append(bytes((width,)) + struct.pack(f'<{count}{code}', *indexes))
+        else:
+            parts.extend(_encode_values([text.encode() for text in texts]))
+    return b''.join(parts)
+
+
+def _encode_values(encoded):
+    # variable length values : u32 offsets then the concatenated values
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return [struct.pack(f'<{len(encoded) + 1}I', *offsets)] + encoded
+
+
+def encode_columnar(columns, batches):
+    names = [str(column).encode() for column in columns]
+    yield COLUMNAR_MAGIC + struct.pack('<H', len(names)) + b''.join(struct.pack('<H', len(name)) + name
+                                                                     for name in names)
+    for rows in batches:
+        values = list(zip(*rows))
+        yield struct.pack('<I', len(rows)) + b''.join(_encode_column(list(column)) for column in values)
+    yield struct.pack('<I', 0)
+
+
+def decode_columnar(data):
+    """
+    Decodes a whole columnar response.
+
+    Args:
+        data (bytes): response body.
+
+    Returns:
+        Tuple (columns, rows), rows being a list of tuples.
+    """
+    view = memoryview(data)
+    if bytes(view[:4]) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar result")
+    (column_count,), offset = struct.unpack_from('<H', view, 4), 6
+    columns = []
+    for _ in range(column_count):
+        (length,) = struct.unpack_from('<H', view, offset)
+        columns.append(bytes(view[offset + 2:offset + 2 + length]).decode())
+        offset += 2 + length
+
+    rows = []
+    while True:
+        (count,) = struct.unpack_from('<I', view, offset)
+        offset += 4
+        if count == 0:
+            return columns, rows
+        values = []
+        for _ in range(column_count):
+            column, offset = _decode_column(view, offset, count)
+            values.append(column)
+        rows.extend(zip(*values))
+
+
+def _decode_column(view, offset, count):
+    column_type = view[offset]
+    nulls = view[offset + 1:offset + 1 + (count + 7) // 8]
+    offset += 1 + len(nulls)
+
+    if column_type == COLUMN_NULL:
+        return [None] * count, offset
+    if column_type in (COLUMN_INT, COLUMN_FLOAT):
+        code = 'q' if column_type == COLUMN_INT else 'd'
+        values = list(struct.unpack_from(f'<{count}{code}', view, offset))
+        offset += 8 * count
+    elif column_type in (COLUMN_TEXT, COLUMN_BYTES):
+        values, offset = _decode_values(view, offset, count)
+        if column_type == COLUMN_TEXT:
+            values = [value.decode() for value in values]
+    elif column_type == COLUMN_TEXT_DICT:
+        (entry_count,) = struct.unpack_from('<I', view, offset)
+        entries, offset = _decode_values(view, offset + 4, entry_count)
+        entries = [entry.decode() for entry in entries]
+        width = view[offset]
+        code = {1: 'B', 2: 'H', 4: 'I'}[width]
+        values = [entries[idx] for idx in struct.unpack_from(f'<{count}{code}', view, offset + 1)]
+        offset += 1 + width * count
+    else:
+        raise ValueError(f"Unknown column type {column_type}")
+
+    for idx in range(count):
+        if nulls[idx >> 3] & (1 << (idx & 7)):
+            values[idx] = None
+    return values, offset
+
+
+def _decode_values(view, offset, count):
+    offsets = struct.unpack_from(f'<{count + 1}I', view, offset)
+    offset += 4 * (count + 1)
+    data = bytes(view[offset:offset + offsets[-1]])
+    return [data[start:end] for start, end in zip(offsets, offsets[1:])], offset + offsets[-1]
+
+
+def encode_msgpack(columns, batches):
+    # dates and decimals are sent as strings
+    packer = msgpack.Packer(default=str)
+    yield packer.pack(list(columns))
+    for rows in batches:
+        yield b''.join(packer.pack(row) for row in rows)
+
+
+def decode_msgpack(data):
+    """
+    Decodes a whole msgpack response.
+
+    Returns:
+        Tuple (columns, rows), rows being a list of lists.
+    """
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(data)
+    columns = next(unpacker)
+    return columns, list(unpacker)
+
+
+# streaming output formats : name -> (encoder, mimetype)
+STREAM_FORMATS = {
+    'ndjson': (encode_ndjson, 'application/x-ndjson'),
+    'csv': (encode_csv, 'text/csv'),
+    'columnar': (encode_columnar, 'application/vnd.log8415e.columnar'),
+}
+if msgpack is not None:
+    STREAM_FORMATS['msgpack'] = (encode_msgpack, 'application/vnd.msgpack')
@@ -1,6 +1,8 @@
 import boto3
 from botocore.exceptions import ClientError
-from os import path
+from concurrent.futures import ThreadPoolExecutor
+from os import path, getenv, makedirs
+import cluster_topology
 import constants
 
 
@@ -39,6 +41,7 @@ def create_ec2(instance_type, sg_id, key_name, user_data, instance_name):
                         'Key': 'Name',
                         'Value': instance_name
                     },
+                    constants.PROJECT_TAG,
                 ]
             },
         ]
@@ -61,7 +64,8 @@ def create_security_group(sg_name):
     try:
         response = EC2_CLIENT.create_security_group(
             GroupName=sg_name,
-            Description=f'Security group for {sg_name}'
+            Description=f'Security group for {sg_name}',
+            TagSpecifications=[{'ResourceType': 'security-group', 'Tags': [constants.PROJECT_TAG]}]
         )
         security_group_id = response['GroupId']
         print(f'Successfully created security group {security_group_id}')
@@ -234,42 +238,133 @@ def start_instance(instance_type, sg_id, user_data, instance_name):
     return instance_ip, instance_private_ip, instance_dns_name, instance_name
 
 
-def generate_cluster_config_file(instance_infos):
+def create_ec2_batch(instance_type, sg_id, key_name, user_data, instance_names, ec2_client=None):
     """
-    Génère les fichiers de configuration nécessaires pour le cluster.
+    Crée en un seul appel plusieurs instances EC2 partageant la même configuration,
+    puis donne à chacune son nom. Seul le client EC2 est utilisé : contrairement aux
+    ressources boto3, il peut être partagé entre les threads de start_instances.
+
+    Args:
+        instance_type (str): Type des instances.
+        sg_id (str): ID du groupe de sécurité.
+        key_name (str): Nom de la clé SSH.
+        user_data (str): Données utilisateur communes aux instances.
+        instance_names (list of str): Nom de chaque instance, une instance par nom.
+        ec2_client: Client EC2 à utiliser (EC2_CLIENT par défaut, injectable pour les tests).
+
+    Returns:
+        Dictionnaire nom de l'instance -> ID de l'instance.
+    """
+    ec2_client = ec2_client or EC2_CLIENT
+    instances = ec2_client.run_instances(
+        ImageId='ami-0149b2da6ceec4bb0',
+        MinCount=len(instance_names),
+        MaxCount=len(instance_names),
+        UserData=user_data,
+        InstanceType=instance_type,
+        Monitoring={'Enabled': True},
+        SecurityGroupIds=[sg_id],
+        KeyName=key_name,
+        TagSpecifications=[{'ResourceType': 'instance', 'Tags': [constants.PROJECT_TAG]}],
+    )['Instances']
+    instance_ids = {}
+    for instance, instance_name in zip(instances, instance_names):
+        instance_id = instance['InstanceId']
+        ec2_client.create_tags(Resources=[instance_id], Tags=[{'Key': 'Name', 'Value': instance_name}])
+        instance_ids[instance_name] = instance_id
+        print(f'{instance_name} ({instance_id}) is starting')
+    return instance_ids
+
+
+def retrieve_instances_ip_dns(instance_ids, ec2_client=None):
+    """
+    Récupère en un seul appel l'IP publique, l'IP privée et le DNS privé de plusieurs instances.
 
     Args:
-        instance_infos (list of dict): Informations de configuration des instances.
+        instance_ids (list of str): IDs des instances.
+        ec2_client: Client EC2 à utiliser (EC2_CLIENT par défaut).
+
+    Returns:
+        Dictionnaire ID de l'instance -> (IP publique, IP privée, DNS privé).
     """
-    template_master = constants.TEMPLATE_MASTER
+    ec2_client = ec2_client or EC2_CLIENT
+    addresses = {}
+    paginator = ec2_client.get_paginator('describe_instances')
+    for page in paginator.paginate(InstanceIds=list(instance_ids)):
+        for reservation in page['Reservations']:
+            for instance_data in reservation['Instances']:
+                addresses[instance_data['InstanceId']] = (instance_data.get('PublicIpAddress'),
+                                                          instance_data['PrivateIpAddress'],
+                                                          instance_data['PrivateDnsName'])
+    return addresses
+
+
+def start_instances(role_specs, key_name, ec2_client=None):
+    """
+    Démarre toutes les instances en parallèle : les rôles ayant la même configuration
+    (type, groupe de sécurité, données utilisateur) sont créés par un seul appel
+    à create_instances, les différents appels sont lancés en même temps, puis un seul
+    waiter attend que toutes les instances soient démarrées.
 
-    template_slave = constants.TEMPLATE_SLAVE
+    Args:
+        role_specs (dict): Rôle -> (type de l'instance, ID du groupe de sécurité, données utilisateur).
+        key_name (str): Nom de la clé SSH.
+        ec2_client: Client EC2 à utiliser (EC2_CLIENT par défaut, injectable pour les tests).
 
-    template_sql_server = constants.TEMPLATE_SQL_SERVER
+    Returns:
+        Dictionnaire rôle -> (IP publique, IP privée, DNS privé, nom de l'instance).
+    """
+    ec2_client = ec2_client or EC2_CLIENT
+    batches = {}
+    for role, spec in role_specs.items():
+        batches.setdefault(spec, []).append(role)
+
+    with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+        futures = [executor.submit(create_ec2_batch, instance_type, sg_id, key_name, user_data, roles, ec2_client)
+                   for (instance_type, sg_id, user_data), roles in batches.items()]
+        instance_ids = {}
+        for future in futures:
+            instance_ids.update(future.result())
+
+    print(f'Waiting for {len(instance_ids)} instances to be running...')
+    ec2_client.get_waiter('instance_running').wait(InstanceIds=list(instance_ids.values()))
+    addresses = retrieve_instances_ip_dns(instance_ids.values(), ec2_client)
+
+    started = {}
+    for role, instance_id in instance_ids.items():
+        instance_ip, instance_private_ip, instance_dns_name = addresses[instance_id]
+        print(f'{role} ({instance_id}) started. Public IP: {instance_ip}, Private IP: {instance_private_ip}, '
+              f'Private DNS: {instance_dns_name}')
+        started[role] = (instance_ip, instance_private_ip, instance_dns_name, role)
+    return started
+
+
+def generate_cluster_config_file(topology):
+    """
+    Génère les fichiers de configuration nécessaires pour le cluster.
 
+    Args:
+        topology (cluster_topology.Topology): Topologie du cluster.
+    """
+    makedirs('master_node', exist_ok=True)
     with open('master_node/config.ini', 'w+') as f:
-        f.write(template_master.format(manager_hostname=instance_infos[0]['dns'],
-                                slave_0_hostname=instance_infos[1]['dns'],
-                                slave_1_hostname=instance_infos[2]['dns'],
-                                slave_2_hostname=instance_infos[3]['dns']))
+        f.write(cluster_topology.render_config_ini(topology))
     with open('master_node/my.cnf', 'w+') as f:
-        f.write(template_slave.format(manager_hostname=instance_infos[0]['dns']))
+        f.write(cluster_topology.render_data_node_cnf(topology))
     with open('master_node/server_conf.conf', 'w+') as f:
-        f.write(template_sql_server.format(manager_hostname=instance_infos[0]['dns']))
+        f.write(cluster_topology.render_sql_node_cnf(topology))
 
-def generate_proxy_py(instance_infos):
+def generate_proxy_py(topology):
     """
-    Génère le fichier Python pour le proxy utilisé dans le modèle de cloud proxy.
+    Génère le fichier Python pour le proxy utilisé dans le modèle de cloud proxy,
+    en remplaçant le bloc des backends de proxy_app_temp.py par ceux de la topologie.
 
     Args:
-        instance_infos (list of dicts): Informations de configuration des instances.
+        topology (cluster_topology.Topology): Topologie du cluster.
     """
     with open('proxy_app_temp.py', 'r') as f:
         lines = f.read()
-    formatted_lines = lines.replace('_MASTER_HOSTNAME_', instance_infos[0]['ip']) \
-                            .replace("_SLAVE_1_HOSTNAME_", instance_infos[1]['ip']) \
-                            .replace("_SLAVE_2_HOSTNAME_", instance_infos[2]['ip']) \
-                            .replace("_SLAVE_3_HOSTNAME_", instance_infos[3]['ip'])
+    formatted_lines = cluster_topology.replace_proxy_backends(lines, cluster_topology.render_proxy_backends(topology))
     with open('proxy_app.py', 'w+') as f_api:
         f_api.write(formatted_lines)
 
@@ -289,24 +384,32 @@ if __name__ == "__main__":
     instance_infos = []
 
     # Define instance roles and their corresponding types
-    instance_configurations = {
-        "Master": "t2.micro",
-        "Child_1": "t2.micro",
-        "Child_2": "t2.micro",
-        "Child_3": "t2.micro",
+    # cluster topology, overridable from the environment
+    data_node_count = int(getenv('CLUSTER_DATA_NODES', constants.CLUSTER_DATA_NODES))
+    replicas = int(getenv('CLUSTER_REPLICAS', constants.CLUSTER_REPLICAS))
+    sql_node_count = int(getenv('CLUSTER_SQL_NODES', constants.CLUSTER_SQL_NODES))
+    cluster_topology.validate_topology(data_node_count, replicas, sql_node_count)
+
+    instance_configurations = {"Master": "t2.micro"}
+    for idx in range(1, data_node_count + 1):
+        instance_configurations[f"Child_{idx}"] = "t2.micro"
+    # the master is the first SQL node
+    for idx in range(1, sql_node_count):
+        instance_configurations[f"SqlNode_{idx}"] = "t2.micro"
+    instance_configurations.update({
         "Proxy": "t2.large",
         "Standalone": "t2.micro",
         "Trustedhost": "t2.large",
         "Gatekeeper": "t2.large"
-    }
+    })
 
     child_counter = 0  # Counter for child instances
 
     gatekeeper_private_ip = None
     trustedhost_private_ip = None
     proxy_private_ip = None
-    proxy_private_ip = None
 
+    role_specs = {}
     for role, instance_type in instance_configurations.items():
         if role == "Proxy":
             sg_id = proxy_sg_id
@@ -320,18 +423,32 @@ if __name__ == "__main__":
         else:
             sg_id = proxy_sg_id  # Define a default security group for other roles
             user_data = ""
-        instance_ip, instance_private_ip, instance_dns_name, instance_name = start_instance(instance_type, sg_id, user_data, role)
+        role_specs[role] = (instance_type, sg_id, user_data)
+
+    # 'parallel' starts every instance at once, 'serial' one after the other
+    if getenv('PROVISIONING_MODE', 'parallel') == 'serial':
+        started = {role: start_instance(instance_type, sg_id, user_data, role)
+                   for role, (instance_type, sg_id, user_data) in role_specs.items()}
+    else:
+        started = start_instances(role_specs, key_name)
+
+    for role in instance_configurations:
+        instance_ip, instance_private_ip, instance_dns_name, instance_name = started[role]
         if role == 'Gatekeeper':
             gatekeeper_private_ip = instance_private_ip
         elif role == 'Trustedhost':
             trustedhost_private_ip = instance_private_ip
-        elif role == 'proxy':
+        elif role == 'Proxy':
             proxy_private_ip = instance_private_ip
         if 'Child' in role:
             # This is a child instance
             instance_infos.append(
                 {'public_ip': instance_ip, 'private_ip': instance_private_ip, 'dns': instance_dns_name, 'name': instance_name, 'child_idx': child_counter})
             child_counter += 1
+        elif 'SqlNode' in role:
+            # An extra SQL node, numbered from 1 (the master is the first one)
+            instance_infos.append(
+                {'public_ip': instance_ip, 'private_ip': instance_private_ip, 'dns': instance_dns_name, 'name': instance_name, 'sql_idx': int(role.split('_')[1])})
         else:
             # Other instances
             instance_infos.append({'public_ip': instance_ip, 'private_ip': instance_private_ip, 'dns': instance_dns_name, 'name': instance_name})
@@ -364,6 +481,10 @@ if __name__ == "__main__":
                 f.write(f'INSTANCE_IP_CHILD_IP_{instance_info["child_idx"]}={instance_info["public_ip"]}\n')
                 f.write(f'INSTANCE_PRIVATE_IP_CHILD_IP_{instance_info["child_idx"]}={instance_info["private_ip"]}\n')
                 f.write(f'INSTANCE_IP_CHILD_DNS_{instance_info["child_idx"]}={instance_info["dns"]}\n')
+            elif 'sql_idx' in instance_info:
+                f.write(f'INSTANCE_IP_SQL_IP_{instance_info["sql_idx"]}={instance_info["public_ip"]}\n')
+                f.write(f'INSTANCE_PRIVATE_IP_SQL_IP_{instance_info["sql_idx"]}={instance_info["private_ip"]}\n')
+                f.write(f'INSTANCE_IP_SQL_DNS_{instance_info["sql_idx"]}={instance_info["dns"]}\n')
         f.write(f'PRIVATE_KEY_FILE={private_key_filename}\n')
     print('Wrote instance\'s IP and private key filename to env_variables.txt')
 
@@ -375,6 +496,7 @@ if __name__ == "__main__":
         update_security_group(proxy_sg_id, 'tcp', 80, 80, f'{trustedhost_private_ip}/32')
 
     # generate the various configuration files for the cluster : my.cnf, config.ini, server_conf.conf
-    generate_cluster_config_file(instance_infos)
+    topology = cluster_topology.topology_from_instances(instance_infos, replicas)
+    generate_cluster_config_file(topology)
     # generate the proxy python file (flask API) : app.py
-    generate_proxy_py(instance_infos)
+    generate_proxy_py(topology)
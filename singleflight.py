@@ -0,0 +1,68 @@
+#!/usr/bin/python
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent executions of the same work.
+
+    The first caller of `do` for a key runs the function, the callers that
+    arrive while it runs wait for it and get the same result, or the same
+    exception. Nothing is kept once the execution is over, a later call
+    runs the function again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.joined = 0
+
+    def do(self, key, func, on_join=None):
+        """
+        Args:
+            key: hashable identifying the work.
+            func (callable): the work, called without arguments.
+            on_join (callable): called before waiting when joining the execution of another caller.
+
+        Returns:
+            The result of func.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.joined += 1
+
+        if not leader:
+            if on_join is not None:
+                on_join()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {"executions": self.executions, "joined": self.joined, "in_flight": len(self._calls)}
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+import re
+from functools import lru_cache
+
+# single pass lexer : every alternative is unambiguous, so scanning is linear in the query length
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+    (?P<comment>--|\#|/\*)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<quoted>`(?:[^`]|``)*`)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[^\W\d][\w$]*)
+  | (?P<punct>\S)
+  | $)
+""", re.VERBOSE | re.DOTALL)
+
+# placeholder standing for every literal in a fingerprint
+LITERAL = '?'
+
+STATEMENT_TYPES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+class InvalidSql(ValueError):
+    """Raised when a query can't be tokenized (comments, unterminated quotes)."""
+
+
+def fingerprint(sql):
+    """
+    Tokenizes a query into its normalized fingerprint.
+
+    Keywords and identifiers are upper-cased and every string or number
+    literal is replaced by `LITERAL`, so queries that only differ by their
+    values or their spacing share the same fingerprint. Comments are rejected
+    since MySQL executes the content of `/*! ... */` comments.
+
+    Returns:
+        Tuple of tokens.
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind is None:
+            break
+        if kind == 'word':
+            tokens.append(match.group(kind).upper())
+        elif kind == 'string' or kind == 'number':
+            tokens.append(LITERAL)
+        elif kind == 'quoted':
+            tokens.append(match.group(kind))
+        elif kind == 'punct' and match.group(kind) not in '\'"`':
+            tokens.append(match.group(kind))
+        else:
+            raise InvalidSql(f"Unsupported SQL near position {match.start()}")
+    return tuple(tokens)
+
+
+def tokenize(sql):
+    """
+    Splits a query into (kind, text) tokens, kind being one of 'word',
+    'string', 'quoted', 'number' or 'punct'.
+
+    Keywords and identifiers are upper-cased, literals are kept verbatim.
+    Comments are rejected, like in `fingerprint`.
+
+    Returns:
+        List of tuples.
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind is None:
+            break
+        text = match.group(kind)
+        if kind == 'word':
+            tokens.append((kind, text.upper()))
+        elif kind == 'comment' or (kind == 'punct' and text in '\'"`'):
+            raise InvalidSql(f"Unsupported SQL near position {match.start()}")
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+def normalize(tokens):
+    """Joins tokens back into a query with canonical spacing and keyword case."""
+    return ' '.join(text for (kind, text) in tokens)
+
+
+# keywords followed by a table name, or a comma separated list of them
+_TABLE_KEYWORDS = {'FROM', 'JOIN', 'INTO', 'UPDATE', 'TABLE', 'TRUNCATE'}
+# keywords that end a table reference, so they can't be mistaken for an alias
+_CLAUSE_KEYWORDS = {'WHERE', 'SET', 'VALUES', 'VALUE', 'ON', 'USING', 'JOIN', 'INNER', 'OUTER', 'LEFT', 'RIGHT',
+                    'CROSS', 'NATURAL', 'STRAIGHT_JOIN', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'UNION', 'FOR',
+                    'LOCK', 'WINDOW', 'PARTITION', 'SELECT', 'INTO', 'USE', 'FORCE', 'IGNORE'}
+
+
+def referenced_tables(tokens):
+    """
+    Collects the names of the tables a tokenized query reads or writes.
+
+    Schema qualifiers and backquotes are dropped and names are lower-cased,
+    so a name may stand for more than one table; that is fine for cache
+    invalidation, which only has to err on the side of too many tables.
+
+    Returns:
+        Set of table names.
+    """
+    tables = set()
+    idx = 0
+    while idx < len(tokens):
+        kind, text = tokens[idx]
+        idx += 1
+        if kind != 'word' or text not in _TABLE_KEYWORDS:
+            continue
+        while True:
+            idx, name = _read_table_name(tokens, idx)
+            if name is None:
+                break
+            tables.add(name)
+            # skip the alias, then carry on if more tables are listed
+            if idx < len(tokens) and tokens[idx] == ('word', 'AS'):
+                idx += 1
+            if idx < len(tokens) and tokens[idx][0] in ('word', 'quoted') and tokens[idx][1] not in _CLAUSE_KEYWORDS:
+                idx += 1
+            if idx < len(tokens) and tokens[idx] == ('punct', ','):
+                idx += 1
+                continue
+            break
+    return tables
+
+
+def _read_table_name(tokens, idx):
+    # reads `table` or `schema.table` at idx, returns the index following it and the table name
+    if idx >= len(tokens) or tokens[idx][0] not in ('word', 'quoted') or tokens[idx][1] in _CLAUSE_KEYWORDS:
+        return idx, None
+    name = tokens[idx][1]
+    idx += 1
+    if idx + 1 < len(tokens) and tokens[idx] == ('punct', '.') and tokens[idx + 1][0] in ('word', 'quoted'):
+        name = tokens[idx + 1][1]
+        idx += 2
+    return idx, name.strip('`').lower()
+
+
+def classify_tokens(tokens):
+    """
+    Classifies a fingerprint as one of `STATEMENT_TYPES`.
+
+    A single statement is accepted, optionally followed by a semicolon, with
+    balanced parentheses and the following shapes:
+    SELECT ... FROM ..., INSERT INTO ... VALUES (...), UPDATE ... SET ...
+    and DELETE FROM ...
+
+    Returns:
+        The statement type, or None when the statement isn't allowed.
+    """
+    if tokens and tokens[-1] == ';':
+        tokens = tokens[:-1]
+    if len(tokens) < 3:
+        return None
+
+    depth = 0
+    for token in tokens:
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth < 0:
+                return None
+        elif token == ';':
+            return None
+    if depth != 0:
+        return None
+
+    statement = tokens[0]
+    if statement == 'SELECT':
+        if 'FROM' in tokens[2:-1]:
+            return statement
+    elif statement == 'INSERT':
+        if tokens[1] == 'INTO' and 'VALUES' in tokens[3:]:
+            values = tokens.index('VALUES', 3)
+            if tokens[values + 1:values + 2] == ('(',) and len(tokens) - values >= 4 and tokens[-1] == ')':
+                return statement
+    elif statement == 'UPDATE':
+        if 'SET' in tokens[2:-1]:
+            return statement
+    elif statement == 'DELETE':
+        if tokens[1] == 'FROM':
+            return statement
+    return None
+
+
+class SqlValidator:
+    """
+    Validates queries with a linear-time tokenizer and LRU caches of verdicts.
+
+    The verdict only depends on the fingerprint of a query, so it is cached
+    under the fingerprint : queries that only differ by their values are
+    classified once. Exact repeats of a query, the bulk of the traffic from
+    the app servers, are answered from a second cache keyed on the raw text
+    without being tokenized again.
+    """
+
+    def __init__(self, cache_size=4096):
+        self._classify_tokens = lru_cache(maxsize=cache_size)(classify_tokens)
+        self._classify_text = lru_cache(maxsize=cache_size)(self._classify_uncached)
+
+    def classify(self, sql):
+        """Returns the statement type of a query, or None when it isn't allowed."""
+        return self._classify_text(sql)
+
+    def is_valid(self, sql):
+        return self._classify_text(sql) is not None
+
+    def cache_info(self):
+        return {'text': self._classify_text.cache_info(), 'fingerprint': self._classify_tokens.cache_info()}
+
+    def _classify_uncached(self, sql):
+        try:
+            tokens = fingerprint(sql)
+        except InvalidSql:
+            return None
+        return self._classify_tokens(tokens)
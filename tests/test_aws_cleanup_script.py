@@ -0,0 +1,137 @@
+import boto3
+import pytest
+
+moto = pytest.importorskip('moto')
+
+import aws_cleanup_script
+import constants
+
+OTHER_TAG = {'Key': 'Project', 'Value': 'another-project'}
+
+
+@pytest.fixture
+def ec2_client(monkeypatch):
+    monkeypatch.setattr(aws_cleanup_script, 'DELETE_RETRY_DELAY', 0)
+    with moto.mock_aws():
+        yield boto3.client('ec2', region_name='us-east-1')
+
+
+def create_group(ec2_client, name, tag=None):
+    kwargs = {'TagSpecifications': [{'ResourceType': 'security-group', 'Tags': [tag]}]} if tag else {}
+    return ec2_client.create_security_group(GroupName=name, Description=name, **kwargs)['GroupId']
+
+
+def allow_from(ec2_client, group_id, source_group_id):
+    ec2_client.authorize_security_group_ingress(GroupId=group_id, IpPermissions=[
+        {'IpProtocol': 'tcp', 'FromPort': 3306, 'ToPort': 3306, 'UserIdGroupPairs': [{'GroupId': source_group_id}]}])
+
+
+def run_instances(ec2_client, count, group_id, tag):
+    response = ec2_client.run_instances(ImageId='ami-12345678', MinCount=count, MaxCount=count,
+                                        InstanceType='t2.micro', SecurityGroupIds=[group_id],
+                                        TagSpecifications=[{'ResourceType': 'instance', 'Tags': [tag]}])
+    return [instance['InstanceId'] for instance in response['Instances']]
+
+
+def instance_states(ec2_client):
+    return {instance['InstanceId']: instance['State']['Name']
+            for reservation in ec2_client.describe_instances()['Reservations']
+            for instance in reservation['Instances']}
+
+
+def group_ids(ec2_client):
+    return {group['GroupId'] for group in ec2_client.describe_security_groups()['SecurityGroups']}
+
+
+@pytest.fixture
+def fleet(ec2_client):
+    # the project's tagged groups (the proxy's rules reference the gatekeeper's), an untagged group with a
+    # project name and another project's group, each with instances
+    proxy_sg = create_group(ec2_client, 'proxy-sg', constants.PROJECT_TAG)
+    gatekeeper_sg = create_group(ec2_client, 'gatekeeper-sg', constants.PROJECT_TAG)
+    allow_from(ec2_client, proxy_sg, gatekeeper_sg)
+    untagged_sg = create_group(ec2_client, 'trustedhost-sg')
+    other_sg = create_group(ec2_client, 'other-sg', OTHER_TAG)
+    return {
+        'project_groups': {proxy_sg, gatekeeper_sg},
+        'untagged_group': untagged_sg,
+        'other_group': other_sg,
+        'project_instances': run_instances(ec2_client, 3, proxy_sg, constants.PROJECT_TAG),
+        'other_instances': run_instances(ec2_client, 2, other_sg, OTHER_TAG),
+    }
+
+
+def test_find_instances_reads_every_page(ec2_client):
+    group_id = create_group(ec2_client, 'proxy-sg', constants.PROJECT_TAG)
+    instance_ids = run_instances(ec2_client, 12, group_id, constants.PROJECT_TAG)
+    paginate = ec2_client.get_paginator('describe_instances').paginate
+
+    def small_pages(**kwargs):
+        return paginate(PaginationConfig={'PageSize': 5}, **kwargs)
+
+    paginator = ec2_client.get_paginator('describe_instances')
+    paginator.paginate = small_pages
+    ec2_client.get_paginator = lambda name: paginator
+
+    assert sorted(aws_cleanup_script.find_instances(ec2_client, constants.PROJECT_TAG)) == sorted(instance_ids)
+
+
+def test_deletion_levels_delete_the_referencing_groups_first():
+    groups = {
+        'sg-a': {'GroupId': 'sg-a', 'IpPermissions': [{'UserIdGroupPairs': [{'GroupId': 'sg-b'}]}]},
+        'sg-b': {'GroupId': 'sg-b', 'IpPermissions': [{'UserIdGroupPairs': [{'GroupId': 'sg-c'}]}]},
+        'sg-c': {'GroupId': 'sg-c'},
+        'sg-d': {'GroupId': 'sg-d', 'IpPermissionsEgress': [{'UserIdGroupPairs': [{'GroupId': 'sg-e'}]}]},
+        'sg-e': {'GroupId': 'sg-e', 'IpPermissionsEgress': [{'UserIdGroupPairs': [{'GroupId': 'sg-d'}]}]},
+    }
+
+    levels, cyclic = aws_cleanup_script.deletion_levels(groups)
+
+    assert levels == [['sg-a'], ['sg-b'], ['sg-c']]
+    assert cyclic == ['sg-d', 'sg-e']
+
+
+def test_dry_run_deletes_nothing(ec2_client, fleet, capsys):
+    states = instance_states(ec2_client)
+    groups = group_ids(ec2_client)
+
+    aws_cleanup_script.cleanup(ec2_client, dry_run=True)
+
+    assert instance_states(ec2_client) == states
+    assert group_ids(ec2_client) == groups
+    plan = capsys.readouterr().out
+    assert 'Dry run' in plan
+    assert all(instance_id in plan for instance_id in fleet['project_instances'])
+    assert all(group_id in plan for group_id in fleet['project_groups'])
+    assert fleet['untagged_group'] not in plan
+    assert not any(instance_id in plan for instance_id in fleet['other_instances'])
+
+
+def test_cleanup_only_deletes_the_tagged_resources(ec2_client, fleet):
+    aws_cleanup_script.cleanup(ec2_client)
+
+    states = instance_states(ec2_client)
+    assert {states[instance_id] for instance_id in fleet['project_instances']} == {'terminated'}
+    assert {states[instance_id] for instance_id in fleet['other_instances']} == {'running'}
+    remaining = group_ids(ec2_client)
+    assert not fleet['project_groups'] & remaining
+    assert {fleet['untagged_group'], fleet['other_group']} <= remaining
+
+
+def test_cleanup_deletes_the_untagged_project_groups_on_request(ec2_client, fleet):
+    aws_cleanup_script.cleanup(ec2_client, untagged_names=constants.SECURITY_GROUP_NAMES)
+
+    remaining = group_ids(ec2_client)
+    assert fleet['untagged_group'] not in remaining
+    assert fleet['other_group'] in remaining
+
+
+def test_cleanup_with_another_tag_leaves_the_project_alone(ec2_client, fleet):
+    aws_cleanup_script.cleanup(ec2_client, tag=OTHER_TAG)
+
+    states = instance_states(ec2_client)
+    assert {states[instance_id] for instance_id in fleet['other_instances']} == {'terminated'}
+    assert {states[instance_id] for instance_id in fleet['project_instances']} == {'running'}
+    remaining = group_ids(ec2_client)
+    assert fleet['other_group'] not in remaining
+    assert fleet['project_groups'] | {fleet['untagged_group']} <= remaining
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from batch import InvalidBatch, parse_batch
+
+
+def batch(sql, params):
+    return json.dumps({"statements": [{"sql": sql, "params": params}]})
+
+
+def test_params_matching_the_placeholders_are_accepted():
+    mode, statements = parse_batch(batch("UPDATE film SET title = %s WHERE title LIKE 'A%%' AND film_id = %s",
+                                         ['ACADEMY', 1]))
+
+    assert mode == 'transaction'
+    assert statements == [("UPDATE film SET title = %s WHERE title LIKE 'A%%' AND film_id = %s", ['ACADEMY', 1])]
+
+
+def test_named_params_are_accepted():
+    _, statements = parse_batch(batch("SELECT * FROM actor WHERE actor_id = %(id)s", {"id": 1}))
+
+    assert statements == [("SELECT * FROM actor WHERE actor_id = %(id)s", {"id": 1})]
+
+
+@pytest.mark.parametrize('sql, params', [
+    ("SELECT * FROM actor WHERE actor_id = %s", []),
+    ("SELECT * FROM actor WHERE actor_id = %s", [1, 2]),
+    ("SELECT * FROM film WHERE title LIKE 'A%' AND film_id = %s", [1]),
+    ("SELECT * FROM actor WHERE actor_id = %d", [1]),
+    ("SELECT * FROM actor WHERE actor_id = %s", {"id": 1}),
+    ("SELECT * FROM actor WHERE actor_id = %(id)s", {"other": 1}),
+    ("SELECT * FROM actor WHERE actor_id = %(id)s", [1]),
+    ("SELECT * FROM actor WHERE actor_id = %s", [[1]]),
+])
+def test_params_not_matching_the_placeholders_are_rejected(sql, params):
+    with pytest.raises(InvalidBatch):
+        parse_batch(batch(sql, params))
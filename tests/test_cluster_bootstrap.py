@@ -0,0 +1,209 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import cluster_bootstrap
+from cluster_bootstrap import Checkpoint, FakeExecutor, Step, build_steps, run_steps
+
+ENV = {
+    'INSTANCE_IP_MASTER_IP': '10.0.0.1',
+    'INSTANCE_IP_CHILD_IP_0': '10.0.1.0',
+    'INSTANCE_IP_CHILD_IP_1': '10.0.1.1',
+    'INSTANCE_IP_CHILD_IP_2': '10.0.1.2',
+    'INSTANCE_IP_SQL_IP_1': '10.0.2.1',
+    'INSTANCE_IP_PROXY_IP': '10.0.3.1',
+    'INSTANCE_PRIVATE_IP_PROXY_IP': '172.31.0.10',
+    'INSTANCE_IP_TRUSTEDHOST_IP': '10.0.3.2',
+    'INSTANCE_PRIVATE_IP_TRUSTEDHOST_IP': '172.31.0.11',
+    'INSTANCE_IP_GATEKEEPER_IP': '10.0.3.3',
+}
+
+
+def completed_steps(state_file):
+    with open(state_file) as f:
+        return set(json.load(f)['completed'])
+
+
+def executed(executor, step):
+    # index of the call running the step's script, or its command when it has none
+    for idx, call in enumerate(executor.calls):
+        if call[0] == 'run' and call[1] == step.host and (call[3] or call[2]) == (step.script or step.command):
+            return idx
+    return None
+
+
+def test_read_env_file(tmp_path):
+    env_file = tmp_path / 'env_variables.txt'
+    env_file.write_text('# comment\nINSTANCE_IP_MASTER_IP=10.0.0.1\n\nPRIVATE_KEY_FILE=key=1.pem\n')
+
+    assert cluster_bootstrap.read_env_file(str(env_file)) == {'INSTANCE_IP_MASTER_IP': '10.0.0.1',
+                                                              'PRIVATE_KEY_FILE': 'key=1.pem'}
+
+
+def test_build_steps_graph():
+    steps = {step.name: step for step in build_steps(ENV)}
+
+    for idx in range(3):
+        assert steps[f'install_data_node_{idx}'].host == ENV[f'INSTANCE_IP_CHILD_IP_{idx}']
+        assert steps[f'install_data_node_{idx}'].deps == []
+        assert set(steps[f'start_data_node_{idx}'].deps) == {f'configure_data_node_{idx}', 'start_management_node'}
+    assert steps['install_sql_node_1'].host == ENV['INSTANCE_IP_SQL_IP_1']
+    assert set(steps['verify_cluster'].deps) == {'install_sql_node', 'install_sql_node_1', 'start_data_node_0',
+                                                 'start_data_node_1', 'start_data_node_2'}
+    assert steps['deploy_proxy'].deps == ['load_sakila']
+    assert steps['deploy_trustedhost'].deps == ['deploy_proxy']
+    assert steps['deploy_gatekeeper'].deps == ['deploy_trustedhost']
+    assert 'proxy_app.py' in steps['deploy_proxy'].uploads
+    assert 'INSTANCE_PRIVATE_IP_PROXY_IP=172.31.0.10' in steps['deploy_trustedhost'].command
+    assert 'INSTANCE_PRIVATE_IP_TRUSTEDHOST_IP=172.31.0.11' in steps['deploy_gatekeeper'].command
+
+
+def test_deployed_modules_exist():
+    repo_dir = os.path.dirname(os.path.abspath(cluster_bootstrap.__file__))
+    deployed = cluster_bootstrap.PROXY_FILES + cluster_bootstrap.GATEKEEPER_FILES + cluster_bootstrap.TRUSTEDHOST_FILES
+    for path in deployed:
+        assert os.path.exists(os.path.join(repo_dir, path)), path
+
+
+def test_run_steps_follows_the_dependencies():
+    steps = build_steps(ENV)
+    executor = FakeExecutor()
+
+    assert run_steps(steps, executor, Checkpoint(None)) == {}
+
+    by_name = {step.name: step for step in steps}
+    for step in steps:
+        assert executed(executor, step) is not None, step.name
+        for dep in step.deps:
+            assert executed(executor, by_name[dep]) < executed(executor, step), (dep, step.name)
+    # the files of a step are uploaded to its host before its script runs
+    upload = executor.calls.index(('upload', ENV['INSTANCE_IP_MASTER_IP'], ('master_node/config.ini',)))
+    assert upload < executed(executor, by_name['start_management_node'])
+
+
+def test_run_steps_runs_independent_steps_concurrently():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    class CountingExecutor(FakeExecutor):
+        def run(self, host, command, stdin=None):
+            with lock:
+                running.append(host)
+                peak.append(len(running))
+            try:
+                super().run(host, command, stdin)
+            finally:
+                with lock:
+                    running.remove(host)
+
+    steps = [Step(f'install_{idx}', f'10.0.1.{idx}', script='install') for idx in range(4)]
+    steps.append(Step('start', '10.0.0.1', deps=[step.name for step in steps], script='start'))
+
+    assert run_steps(steps, CountingExecutor(delay=0.2), Checkpoint(None), max_workers=4) == {}
+    assert max(peak) == 4
+
+
+def test_run_steps_resumes_from_the_checkpoint(tmp_path):
+    state_file = str(tmp_path / 'state.json')
+    steps = build_steps(ENV)
+    by_name = {step.name: step for step in steps}
+    failing = by_name['configure_data_node_1']
+
+    first = FakeExecutor(fail_on={(failing.host, failing.script)})
+    failures = run_steps(steps, first, Checkpoint(state_file))
+
+    assert list(failures) == ['configure_data_node_1']
+    completed = completed_steps(state_file)
+    assert 'install_management_node' in completed
+    assert 'configure_data_node_1' not in completed
+    # nothing depending on the failed step was started
+    assert executed(first, by_name['start_data_node_1']) is None
+    assert executed(first, by_name['deploy_proxy']) is None
+
+    second = FakeExecutor()
+    assert run_steps(steps, second, Checkpoint(state_file)) == {}
+    for step in steps:
+        assert (executed(second, step) is None) == (step.name in completed), step.name
+    assert completed_steps(state_file) == set(by_name)
+
+
+def test_run_steps_rejects_invalid_graphs():
+    with pytest.raises(ValueError):
+        run_steps([Step('a', 'host', deps=['missing'])], FakeExecutor(), Checkpoint(None))
+    with pytest.raises(ValueError):
+        run_steps([Step('a', 'host', deps=['b']), Step('b', 'host', deps=['a'])], FakeExecutor(), Checkpoint(None))
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.mark.skipif(shutil.which('pkill') is None or shutil.which('python3') is None,
+                    reason='needs pkill and python3')
+def test_deploy_command_restarts_the_app_without_killing_its_shell(tmp_path):
+    # every step but the deployment of the trusted host already ran
+    executor = FakeExecutor()
+    steps = build_steps(ENV)
+    checkpoint = Checkpoint(None)
+    checkpoint.completed = {step.name for step in steps if step.name != 'deploy_trustedhost'}
+    assert run_steps(steps, executor, checkpoint) == {}
+    command = next(call[2] for call in executor.calls if call[0] == 'run')
+
+    # stand-in for the app : same command line as the deployed one, records each start
+    (tmp_path / 'prefork.py').write_text(
+        "import os, time\n"
+        "with open('starts', 'a') as f:\n"
+        "    f.write(str(os.getpid()) + '\\n')\n"
+        "time.sleep(60)\n")
+    old = subprocess.Popen(['python3', 'prefork.py', 'trustedhost_app:app', '--port', '80'], cwd=tmp_path)
+    starts = tmp_path / 'starts'
+    assert wait_until(lambda: starts.exists())
+    try:
+        # run by the remote shell as given to ssh, without sudo (env passes the variables as sudo does)
+        local_command = command.replace('nohup sudo ', 'nohup env ').replace('sudo ', '')
+        result = subprocess.run(['bash', '-c', local_command + '\necho deployed'], cwd=tmp_path,
+                                capture_output=True, text=True, timeout=30)
+
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == 'deployed'
+        assert old.wait(timeout=10) is not None
+        assert wait_until(lambda: len(starts.read_text().split()) == 2)
+    finally:
+        old.kill()
+        for pid in starts.read_text().split():
+            try:
+                os.kill(int(pid), 9)
+            except ProcessLookupError:
+                pass
+
+
+def test_app_process_pattern_only_matches_the_app():
+    pattern = re.compile(cluster_bootstrap.app_process_pattern('proxy_app'))
+    command = cluster_bootstrap.start_app_command('proxy_app.py')
+
+    assert pattern.search('python3 prefork.py proxy_app:app --port 80')
+    assert not pattern.search(f'bash -c {command}')
+    assert not pattern.search(command)
+    assert not pattern.search('python3 prefork.py trustedhost_app:app --port 80')
+
+
+def test_proxy_runs_in_a_single_worker():
+    # its result cache, sticky sessions, coalescing and prepared statements are per process
+    step = next(step for step in build_steps(ENV) if step.name == 'deploy_proxy')
+    start = re.search(r'python3 prefork\.py proxy_app:app [^>]*', step.command).group(0).split()
+
+    assert start[start.index('--workers') + 1] == '1'
+    assert int(start[start.index('--threads') + 1]) > 1
@@ -0,0 +1,38 @@
+import pytest
+
+import cluster_topology
+from cluster_topology import Topology
+
+
+def node(idx):
+    return {'dns': f'ip-10-0-0-{idx}.ec2.internal', 'public_ip': f'54.0.0.{idx}', 'private_ip': f'10.0.0.{idx}',
+            'name': f'node-{idx}'}
+
+
+@pytest.mark.parametrize('data_nodes, replicas, sql_nodes', [(3, 0, 1), (3, 5, 1), (4, 3, 1), (0, 1, 1), (2, 2, 0)])
+def test_validate_topology_rejects_impossible_clusters(data_nodes, replicas, sql_nodes):
+    with pytest.raises(ValueError):
+        cluster_topology.validate_topology(data_nodes, replicas, sql_nodes)
+
+
+def test_config_ini_groups_the_data_nodes_by_replicas():
+    topology = Topology(node(0), [node(idx) for idx in range(1, 5)], [node(0), node(9)], replicas=2)
+
+    config = cluster_topology.render_config_ini(topology)
+
+    assert 'NoOfReplicas=2' in config
+    assert [line.split('=')[1].split()[0] for line in config.splitlines() if line.startswith('NodeGroup=')] == \
+        ['0', '0', '1', '1']
+    assert config.count('[mysqld]') == 2
+
+
+def test_proxy_backends_read_from_the_sql_node_holding_sakila():
+    master = node(0)
+    topology = Topology(master, [node(idx) for idx in range(1, 4)], [master, node(8), node(9)], replicas=3)
+
+    namespace = {}
+    exec(cluster_topology.render_proxy_backends(topology), namespace)
+
+    assert namespace['MASTER_CONFIG']['ip'] == master['public_ip']
+    assert [slave['ip'] for slave in namespace['SLAVE_CONFIGS']] == ['54.0.0.1', '54.0.0.2', '54.0.0.3']
+    assert {slave['sql_node'] for slave in namespace['SLAVE_CONFIGS']} == {master['private_ip']}
@@ -0,0 +1,64 @@
+import asyncio
+from urllib.parse import quote, unquote
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import gatekeeper_app
+import gatekeeper_async
+import trustedhost_app
+
+# ?, # and % would cut the statement short or be decoded a second time if they were not quoted again
+SQL = "SELECT * FROM film WHERE title LIKE '%100%' AND description <> '?#'"
+PATH = f"/normal/{quote(SQL, safe='')}"
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {'Content-Type': 'application/json'}
+    content = b'[]'
+
+
+def test_trustedhost_forwards_the_statement_quoted(monkeypatch):
+    urls = []
+    monkeypatch.setattr(trustedhost_app, 'STREAM_RESPONSES', False)
+    monkeypatch.setattr(trustedhost_app.requests, 'request',
+                        lambda method, url, **kwargs: urls.append(url) or FakeResponse())
+
+    response = trustedhost_app.app.test_client().get(PATH + '?max_staleness=1')
+
+    assert response.status_code == 200
+    assert urls == [f"{trustedhost_app.PROXY_INSTANCE_PRIVATE_URL}{PATH}?max_staleness=1"]
+    assert unquote(urls[0].split('/')[-1].split('?')[0]) == SQL
+
+
+def test_gatekeeper_forwards_the_statement_quoted(monkeypatch):
+    urls = []
+    monkeypatch.setattr(gatekeeper_app, 'STREAM_RESPONSES', False)
+    monkeypatch.setattr(gatekeeper_app.session, 'request',
+                        lambda method, url, **kwargs: urls.append(url) or FakeResponse())
+
+    response = gatekeeper_app.app.test_client().get(PATH)
+
+    assert response.status_code == 200
+    assert urls == [f"{gatekeeper_app.TRUSTED_HOST_PRIVATE_URL}{PATH}"]
+
+
+def test_async_gatekeeper_forwards_the_statement_quoted(monkeypatch):
+    received = []
+
+    async def upstream_handler(request):
+        received.append(request.match_info['sql'])
+        return web.json_response([])
+
+    async def scenario():
+        upstream_app = web.Application()
+        upstream_app.router.add_get('/{path}/{sql}', upstream_handler)
+        async with TestServer(upstream_app) as upstream:
+            monkeypatch.setattr(gatekeeper_async, 'TRUSTED_HOST_PRIVATE_URL', str(upstream.make_url('')).rstrip('/'))
+            async with TestClient(TestServer(gatekeeper_async.create_app())) as client:
+                response = await client.get(PATH)
+                assert response.status == 200
+
+    asyncio.run(scenario())
+    assert received == [SQL]
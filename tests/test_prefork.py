@@ -0,0 +1,45 @@
+import select
+import socket
+import threading
+import time
+
+from prefork import create_listener, create_server
+
+
+def test_a_busy_worker_leaves_the_connections_in_the_backlog():
+    started = threading.Event()
+    release = threading.Event()
+
+    def app(environ, start_response):
+        started.set()
+        release.wait(10)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    sock = create_listener('127.0.0.1', 0, 16)
+    port = sock.getsockname()[1]
+    server = create_server('127.0.0.1', port, app, sock, threads=1)
+    serving = threading.Thread(target=server.serve_forever, daemon=True)
+    serving.start()
+    clients = [socket.create_connection(('127.0.0.1', port)) for _ in range(2)]
+    try:
+        for client in clients:
+            client.sendall(b'GET / HTTP/1.1\r\nHost: test\r\n\r\n')
+
+        # the only thread holds the first request, the second connection is not accepted
+        assert started.wait(10)
+        time.sleep(0.5)
+        readable, _, _ = select.select([sock], [], [], 0)
+        assert readable == [sock]
+
+        release.set()
+        for client in clients:
+            client.settimeout(10)
+            assert client.recv(1024).startswith(b'HTTP/1.1 200')
+    finally:
+        release.set()
+        for client in clients:
+            client.close()
+        server.shutdown()
+        server.executor.shutdown(wait=True)
+        sock.close()
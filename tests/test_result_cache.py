@@ -0,0 +1,56 @@
+import time
+
+from result_cache import QueryResultCache, read_key, written_tables
+
+
+def test_writes_invalidate_the_entries_of_their_tables():
+    cache = QueryResultCache()
+    key, names = read_key("SELECT * FROM actor WHERE actor_id = 1")
+    cache.put(key, names, 'rows', cache.generation(names))
+
+    cache.invalidate({'film'})
+    assert cache.get(key) == 'rows'
+    cache.invalidate({'actor'})
+    assert cache.get(key) is None
+
+
+def test_a_result_read_before_a_write_is_not_stored():
+    cache = QueryResultCache()
+    key, names = read_key("SELECT * FROM actor")
+    generation = cache.generation(names)
+
+    cache.invalidate({'actor'})
+    cache.put(key, names, 'rows', generation)
+
+    assert cache.get(key) is None
+
+
+def test_a_staleness_bound_refuses_older_entries():
+    cache = QueryResultCache()
+    key, names = read_key("SELECT * FROM actor")
+    cache.put(key, names, 'rows', cache.generation(names), as_of=time.time() - 3)
+
+    assert cache.get(key) == 'rows'
+    assert cache.get(key, max_staleness=10) == 'rows'
+    assert cache.get(key, max_staleness=1) is None
+    assert cache.stats()['too_stale'] == 1
+
+
+def test_writes_on_base_tables_invalidate_the_views_reading_them():
+    cache = QueryResultCache()
+    key, names = read_key("SELECT * FROM film_list WHERE FID = 1")
+    cache.put(key, names, 'rows', cache.generation(names))
+
+    cache.invalidate(written_tables("UPDATE category SET name = 'Horror' WHERE category_id = 11"))
+
+    assert cache.get(key) is None
+
+
+def test_writes_invalidate_the_tables_their_triggers_write():
+    cache = QueryResultCache()
+    key, names = read_key("SELECT * FROM film_text WHERE film_id = 1")
+    cache.put(key, names, 'rows', cache.generation(names))
+
+    cache.invalidate(written_tables("UPDATE film SET title = 'ACADEMY' WHERE film_id = 1"))
+
+    assert cache.get(key) is None
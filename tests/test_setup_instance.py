@@ -0,0 +1,88 @@
+import threading
+
+import boto3
+import pytest
+
+moto = pytest.importorskip('moto')
+
+import constants
+import setup_instance
+
+
+@pytest.fixture
+def ec2_client():
+    with moto.mock_aws():
+        yield boto3.client('ec2', region_name='us-east-1')
+
+
+def create_group(ec2_client, name):
+    return ec2_client.create_security_group(GroupName=name, Description=name)['GroupId']
+
+
+def instance_tags(ec2_client):
+    tags = {}
+    for reservation in ec2_client.describe_instances()['Reservations']:
+        for instance in reservation['Instances']:
+            tags[instance['InstanceId']] = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+    return tags
+
+
+def test_create_ec2_batch_names_every_instance(ec2_client):
+    sg_id = create_group(ec2_client, 'proxy-sg')
+
+    instance_ids = setup_instance.create_ec2_batch('t2.micro', sg_id, 'key', '', ['Child_1', 'Child_2', 'Child_3'],
+                                                   ec2_client)
+
+    assert list(instance_ids) == ['Child_1', 'Child_2', 'Child_3']
+    tags = instance_tags(ec2_client)
+    assert {tags[instance_id]['Name'] for instance_id in instance_ids.values()} == set(instance_ids)
+    assert all(tags[instance_id][constants.PROJECT_TAG['Key']] == constants.PROJECT_TAG['Value']
+               for instance_id in instance_ids.values())
+
+
+def test_start_instances_batches_the_roles_sharing_a_configuration(ec2_client, monkeypatch):
+    proxy_sg_id = create_group(ec2_client, 'proxy-sg')
+    gatekeeper_sg_id = create_group(ec2_client, 'gatekeeper-sg')
+    role_specs = {
+        'Master': ('t2.micro', proxy_sg_id, ''),
+        'Child_1': ('t2.micro', proxy_sg_id, ''),
+        'Child_2': ('t2.micro', proxy_sg_id, ''),
+        'Proxy': ('t2.large', proxy_sg_id, 'proxy'),
+        'Gatekeeper': ('t2.large', gatekeeper_sg_id, 'gatekeeper'),
+    }
+    run_instances = ec2_client.run_instances
+    calls = []
+
+    def record_run_instances(**kwargs):
+        calls.append((threading.current_thread().name, kwargs['InstanceType'], kwargs['MaxCount']))
+        return run_instances(**kwargs)
+
+    monkeypatch.setattr(ec2_client, 'run_instances', record_run_instances)
+
+    started = setup_instance.start_instances(role_specs, 'key', ec2_client)
+
+    # one call per distinct configuration, each from a thread of the pool
+    assert sorted(call[1:] for call in calls) == [('t2.large', 1), ('t2.large', 1), ('t2.micro', 3)]
+    assert all(call[0] != threading.main_thread().name for call in calls)
+
+    assert set(started) == set(role_specs)
+    for role, (public_ip, private_ip, dns, name) in started.items():
+        assert name == role
+        assert private_ip and dns
+    assert len({private_ip for _, private_ip, _, _ in started.values()}) == len(role_specs)
+
+    states = {instance['InstanceId']: instance['State']['Name']
+              for reservation in ec2_client.describe_instances()['Reservations']
+              for instance in reservation['Instances']}
+    assert len(states) == len(role_specs)
+    assert set(states.values()) == {'running'}
+
+
+def test_retrieve_instances_ip_dns_reads_every_instance(ec2_client):
+    sg_id = create_group(ec2_client, 'proxy-sg')
+    instance_ids = setup_instance.create_ec2_batch('t2.micro', sg_id, 'key', '', ['A', 'B'], ec2_client)
+
+    addresses = setup_instance.retrieve_instances_ip_dns(instance_ids.values(), ec2_client)
+
+    assert set(addresses) == set(instance_ids.values())
+    assert all(private_ip and dns for _, private_ip, dns in addresses.values())
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+"""
+Request IDs and per-hop timings propagated through gatekeeper, trustedhost and proxy.
+
+Each tier reuses the request ID of the incoming request (the gatekeeper
+creates it when the client didn't send a valid one) and appends its phase
+timings to the `Server-Timing` header of the response it relays, as
+`<tier>-<phase>;dur=<ms>`. The edge response thus carries the breakdown of
+every hop. The gatekeeper also decides whether a request is sampled; the
+tiers then log one json line per sampled request.
+"""
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+SAMPLED_HEADER = 'X-Trace-Sampled'
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+# request IDs accepted from the previous hop, anything else is replaced
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# sampled traces are written as json lines on stderr
+logger = logging.getLogger('trace')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+
+
+class RequestTrace:
+    """Request ID, sampling decision and phase timings of a request in one tier."""
+
+    def __init__(self, tier, request_id, sampled):
+        self.tier = tier
+        self.request_id = request_id
+        self.sampled = sampled
+        self.started_at = time.perf_counter()
+        self.timings = []
+
+    def add(self, phase, seconds):
+        self.timings.append((phase, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def apply(self, headers):
+        """Sets the request ID and Server-Timing headers of a response, before it is sent."""
+        headers[REQUEST_ID_HEADER] = self.request_id
+        headers[SERVER_TIMING_HEADER] = self.server_timing(headers.get(SERVER_TIMING_HEADER))
+
+    def outgoing_headers(self):
+        """Headers propagating the trace to the next hop."""
+        return {REQUEST_ID_HEADER: self.request_id, SAMPLED_HEADER: '1' if self.sampled else '0'}
+
+    def server_timing(self, upstream=None):
+        """
+        `Server-Timing` value of the response : this tier's timings (and its
+        total) followed by the ones the next hop already reported.
+        """
+        entries = [f'{self.tier}-{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.timings]
+        entries.append(f'{self.tier}-total;dur={(time.perf_counter() - self.started_at) * 1000:.2f}')
+        if upstream:
+            entries.append(upstream)
+        return ', '.join(entries)
+
+    def log(self, route, status):
+        if not self.sampled:
+            return
+        logger.info(json.dumps({
+            "request_id": self.request_id,
+            "tier": self.tier,
+            "route": route,
+            "status": status,
+            "total_ms": round((time.perf_counter() - self.started_at) * 1000, 3),
+            "timings_ms": {phase: round(seconds * 1000, 3) for phase, seconds in self.timings},
+        }))
+
+
+def start_trace(tier, headers, edge=False, sample_rate=0.0):
+    """
+    Starts the trace of an incoming request.
+
+    Args:
+        tier (str): name of the tier, prefix of its Server-Timing entries.
+        headers (mapping): incoming request headers.
+        edge (bool): whether the request comes from a client rather than from the previous tier,
+            the sampling is then decided here instead of being read from the headers.
+        sample_rate (float): fraction of the requests logged, used at the edge.
+
+    Returns:
+        RequestTrace.
+    """
+    request_id = headers.get(REQUEST_ID_HEADER)
+    if not request_id or not _REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    if edge:
+        sampled = random.random() < sample_rate
+    else:
+        sampled = headers.get(SAMPLED_HEADER) == '1'
+    return RequestTrace(tier, request_id, sampled)
+
+
+def instrument_flask(app, tier, route_label, edge=False, sample_rate=0.0):
+    """
+    Traces every request of a flask app : the trace is available as
+    `flask.g.trace` during the request, and the request ID and Server-Timing
+    headers are set on the response.
+
+    Args:
+        app (Flask): the application.
+        tier (str): name of the tier.
+        route_label (callable): returns the route label of the current request, logged with sampled traces.
+        edge (bool): see `start_trace`.
+        sample_rate (float): see `start_trace`.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def begin_trace():
+        g.trace = start_trace(tier, request.headers, edge=edge, sample_rate=sample_rate)
+
+    @app.after_request
+    def end_trace(response):
+        trace = g.get('trace')
+        if trace is not None:
+            trace.apply(response.headers)
+            trace.log(route_label(), response.status_code)
+        return response
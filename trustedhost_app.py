@@ -1,11 +1,18 @@
 #!/usr/bin/python
 
 import os
-import re
 import logging
-from flask import Flask, request
+from urllib.parse import quote
+from flask import Flask, Response, g, request
 import requests
 
+from batch import InvalidBatch, parse_batch
+from forwarding import BUFFERED_SKIPPED_HEADERS, end_to_end_headers, stream_upstream, with_query_string
+from metrics import CONTENT_TYPE, HttpMetrics, Registry, instrument_flask, route_label
+from parameterized import InvalidQuery, parse_query
+from sql_validator import SqlValidator
+import tracing
+
 app = Flask(__name__)
 
 # Setup logging
@@ -13,37 +20,111 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 # Get the proxy instance's private IP from an environment variable
 PROXY_INSTANCE_PRIVATE_IP = os.getenv('INSTANCE_PRIVATE_IP_PROXY_IP', 'default_proxy_ip')  # Replace 'default_proxy_ip' with a default value or error handling
-PROXY_INSTANCE_PRIVATE_URL = f"http://{PROXY_INSTANCE_PRIVATE_IP}:80"
+PROXY_INSTANCE_PRIVATE_URL = os.getenv('TRUSTEDHOST_UPSTREAM_URL', f"http://{PROXY_INSTANCE_PRIVATE_IP}:80")
+# port the trusted host listens on
+PORT = int(os.getenv('TRUSTEDHOST_PORT', '80'))
+
+# number of verdicts kept by the validator caches
+VALIDATOR_CACHE_SIZE = int(os.getenv('TRUSTEDHOST_VALIDATOR_CACHE_SIZE', '4096'))
+validator = SqlValidator(cache_size=VALIDATOR_CACHE_SIZE)
+# relay the proxy's response as it arrives instead of buffering it whole
+STREAM_RESPONSES = os.getenv('TRUSTEDHOST_STREAM_RESPONSES', '1') == '1'
+
+# request, validation and upstream timings, exported on /metrics
+registry = Registry()
+http_metrics = HttpMetrics(registry, 'trustedhost')
+phase_latency = registry.histogram('trustedhost_phase_duration_seconds',
+                                   'Time spent in each phase of a request.', ('route', 'backend', 'phase'))
+instrument_flask(app, http_metrics, lambda: route_label(request.path))
+# request IDs and Server-Timing breakdown, propagated from the gatekeeper, see tracing.py
+tracing.instrument_flask(app, 'trustedhost', lambda: route_label(request.path))
 
 def is_valid_request(sql, method):
-    if not re.match(r'^\s*(SELECT\s+.+?\s+FROM\s+.+?|INSERT\s+INTO\s+.+?\s+VALUES\s*\(.+?\)|UPDATE\s+.+?\s+SET\s+.+?(\s+WHERE\s+.+?)?|DELETE\s+FROM\s+.+?(\s+WHERE\s+.+?)?)\s*;?\s*$', sql):
-        return False
     if method not in ['GET', 'POST', 'PUT', 'DELETE']:
         return False
+    if not validator.is_valid(sql):
+        return False
     return True
 
-@app.route('/<path>/<sql>', methods=['GET', 'POST', 'PUT', 'DELETE'])
-def forward_request(path,sql):
+# forwards the current request, query string included, to a url of the proxy and relays its response
+def forward(url):
     try:
+        url = with_query_string(url, request.query_string)
         method = request.method
         data = request.get_data()
-        headers = {key: value for (key, value) in request.headers if key != 'Host'}
-
-        if not is_valid_request(sql, method):
-            logger.warning(f"Invalid request: {method} {sql}")
-            return "Invalid Request", 400
+        headers = dict(end_to_end_headers(request.headers, skip={'host'}))
+        headers.update(g.trace.outgoing_headers())
 
-        url = f"{PROXY_INSTANCE_PRIVATE_URL}/{path}/{sql}"
         logger.info(f"Forwarding {method} request to {url}")
 
-        response = requests.request(method, url, headers=headers, data=data, allow_redirects=False)
+        # until the response headers (or the whole body when not streaming) are received
+        with g.trace.phase('forward'), \
+                phase_latency.time(route=route_label(request.path), backend='proxy', phase='upstream'):
+            response = requests.request(method, url, headers=headers, data=data, allow_redirects=False,
+                                        stream=STREAM_RESPONSES)
 
         logger.info(f"Received response with status: {response.status_code}")
-        return (response.content, response.status_code, response.headers.items())
+        if STREAM_RESPONSES:
+            return Response(stream_upstream(response), response.status_code,
+                            end_to_end_headers(response.headers.items()))
+        # the buffered body is decoded, its encoding and length no longer apply
+        return (response.content, response.status_code,
+                end_to_end_headers(response.headers.items(), skip=BUFFERED_SKIPPED_HEADERS))
 
     except requests.RequestException as e:
         logger.error(f"Error during request transmission: {e}")
         return "Internal Server Error", 500
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/<path>/<sql>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def forward_request(path,sql):
+    method = request.method
+    with g.trace.phase('validate'), \
+            phase_latency.time(route=route_label(request.path), backend='', phase='validation'):
+        valid = is_valid_request(sql, method)
+    if not valid:
+        logger.warning(f"Invalid request: {method} {sql}")
+        return "Invalid Request", 400
+
+    # the statement was decoded by the routing, quoted again so that ?, # and % reach the proxy as part of it
+    return forward(f"{PROXY_INSTANCE_PRIVATE_URL}/{path}/{quote(sql, safe='')}")
+
+@app.route('/batch', methods=['POST'])
+def forward_batch():
+    # every statement of the batch has to be valid for the batch to be forwarded
+    with g.trace.phase('validate'), phase_latency.time(route='batch', backend='', phase='validation'):
+        try:
+            mode, statements = parse_batch(request.get_data())
+        except InvalidBatch as e:
+            logger.warning(f"Invalid batch: {e}")
+            return f"Invalid Request: {e}", 400
+
+        for idx, (sql, params) in enumerate(statements):
+            if not validator.is_valid(sql):
+                logger.warning(f"Invalid batch statement {idx}: {sql}")
+                return f"Invalid Request: statement {idx}", 400
+
+    return forward(f"{PROXY_INSTANCE_PRIVATE_URL}/batch")
+
+@app.route('/query/<path>', methods=['POST'])
+def forward_query(path):
+    # only the template is validated, the values are bound by the proxy (see parameterized.py), so the
+    # verdict cache holds one entry per template whatever the values
+    with g.trace.phase('validate'), phase_latency.time(route='query', backend='', phase='validation'):
+        try:
+            sql, _ = parse_query(request.get_data())
+        except InvalidQuery as e:
+            logger.warning(f"Invalid query: {e}")
+            return f"Invalid Request: {e}", 400
+
+        if not validator.is_valid(sql):
+            logger.warning(f"Invalid query template: {sql}")
+            return "Invalid Request", 400
+
+    return forward(f"{PROXY_INSTANCE_PRIVATE_URL}/query/{path}")
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80)
+    app.run(host='0.0.0.0', port=PORT)